@@ -0,0 +1,539 @@
+import asyncio
+import logging
+import time
+
+from datetime import date, timedelta
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
+
+import httpx
+
+from concurrency_controller import (
+    AimdController,
+    AsyncConcurrencyLimiter,
+    Saturation,
+)
+from instrumentation import span, with_timings
+from latency_recorder import STATUS_CONNECTION_ERROR, STATUS_TIMEOUT, LatencyRecorder
+from live_metrics import request_finished, request_started
+from load_profile import LoadProfile
+from log_util import get_logger
+from payload_corpus import BodySource
+from retry_policy import RetryPolicy
+from run_journal import RunJournal, get_journal
+
+
+logger = get_logger(__name__)
+# httpx logs every request at INFO level, which floods the log on the request path
+get_logger("httpx").setLevel(logging.WARNING)
+
+
+class _BufferContent:
+    """Request content sending a buffer (e.g. a memoryview of a payload
+    corpus) without copying it to bytes.
+
+    httpx takes content other than bytes as a stream, which can be iterated
+    again on a retry since it is not a generator.
+    """
+
+    def __init__(self, buffer: memoryview):
+        self.__buffer = buffer
+
+    async def __aiter__(self) -> AsyncIterator[memoryview]:
+        yield self.__buffer
+
+
+class AsyncStorylineClient:
+    """Storyline API client driven by asyncio.
+
+    All coroutines share one `httpx.AsyncClient`, thus TCP connections are kept
+    alive and reused instead of a new handshake per request. Latency of every
+    attempt is recorded to `recorder`, and created/deleted storylines are
+    recorded to `journal` (if given). Requests time out and are retried by
+    `retry` (no timeout nor retry if None).
+    """
+
+    def __init__(
+        self,
+        host_url: str,
+        headers: Dict[str, str],
+        max_connections: int,
+        recorder: LatencyRecorder,
+        journal: Optional[RunJournal] = None,
+        retry: Optional[RetryPolicy] = None,
+    ):
+        self.__host_url = host_url
+        self.__recorder = recorder
+        self.__journal = journal
+        self.__retry = retry or RetryPolicy(timeout=None, max_retries=0)
+        self.__client = httpx.AsyncClient(
+            headers=headers,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            # waiting for a pooled connection is queueing in the generator, not a failure of the service
+            timeout=httpx.Timeout(self.__retry.timeout, pool=None),
+        )
+
+    async def __aenter__(self) -> "AsyncStorylineClient":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.__client.aclose()
+
+    async def __post(
+        self,
+        endpoint: str,
+        url: str,
+        idempotent: bool,
+        start: Optional[float] = None,
+        **kwargs: Any,
+    ) -> Tuple[int, Optional[httpx.Response], int]:
+        """Post to `url` retrying by the retry policy, and record each attempt
+        as `endpoint`. Latency of the first attempt is measured from `start`
+        (`time.perf_counter()` value) if given.
+
+        Return a tuple containing the status code of the last attempt
+        (STATUS_TIMEOUT or STATUS_CONNECTION_ERROR without a response), the
+        response (None without a response) and the number of attempts.
+        """
+        attempt = 0
+        while True:
+            if start is None or attempt > 0:
+                start = time.perf_counter()
+            request_started()
+            response = None
+            try:
+                response = await self.__client.post(url, **kwargs)
+                status_code = response.status_code
+                sent = True
+            except (httpx.ConnectTimeout, httpx.PoolTimeout):
+                status_code, sent = STATUS_TIMEOUT, False
+            except httpx.TimeoutException:
+                status_code, sent = STATUS_TIMEOUT, True
+            except httpx.ConnectError:
+                status_code, sent = STATUS_CONNECTION_ERROR, False
+            except (httpx.NetworkError, httpx.RemoteProtocolError):
+                status_code, sent = STATUS_CONNECTION_ERROR, True
+            elapsed = time.perf_counter() - start
+            self.__recorder.record(endpoint, status_code, elapsed)
+            request_finished(endpoint, status_code, elapsed)
+
+            if not self.__retry.should_retry(attempt, status_code, idempotent, sent):
+                return status_code, response, attempt + 1
+            await asyncio.sleep(self.__retry.delay(attempt))
+            attempt += 1
+
+    async def create_storyline(
+        self,
+        dependent_id: int,
+        target_date: date,
+        intended_start: Optional[float] = None,
+    ) -> Optional[int]:
+        """Call Api to create Storyline.
+
+        Latency is measured from `intended_start` (`time.perf_counter()` value)
+        if given, such that a delay before sending is also counted.
+
+        None would be returned if API call is failed.
+        """
+        url = f"{self.__host_url}/v3/internal/storylines"
+        status_code, response, _ = await self.__post(
+            "create_storyline",
+            url,
+            idempotent=False,
+            start=intended_start,
+            json={
+                "date": target_date.strftime("%Y-%m-%d"),
+                "dependentId": dependent_id,
+            },
+        )
+
+        storyline_id = None
+        if status_code == 201:
+            storyline_id = response.json()["data"]["id"]
+            if self.__journal is not None:
+                self.__journal.created(storyline_id, dependent_id, target_date)
+
+        return storyline_id
+
+    async def create_stories(self, storyline_id: int, body: Union[bytes, memoryview]) -> int:
+        """Call API to create stories under `storyline_id` with JSON `body`
+        (a memoryview is sent without copying).
+
+        Return the status code (STATUS_TIMEOUT or STATUS_CONNECTION_ERROR
+        without a response).
+        """
+        url = f"{self.__host_url}/v3/internal/storylines/{storyline_id}/stories/create-bulk"
+        kwargs: Dict[str, Any] = {"content": body}
+        if isinstance(body, memoryview):
+            # a stream is sent chunked unless its length is given
+            kwargs = {"content": _BufferContent(body), "headers": {"Content-Length": str(body.nbytes)}}
+        status_code, _, _ = await self.__post(
+            "create_stories", url, idempotent=False, **kwargs
+        )
+
+        return status_code
+
+    async def delete_storyline(self, id: int, missing_ok: bool = False) -> Optional[int]:
+        """Delete storyline having `id` and its associated data.
+
+        A storyline not found is regarded as deleted if `missing_ok`.
+
+        Return `id` if it failed to delete.
+        """
+        url = f"{self.__host_url}/v3/internal/storylines/{id}/unsafe-delete"
+        status_code, _, attempts = await self.__post(
+            "delete_storyline", url, idempotent=True
+        )
+
+        # a retried deletion may find the storyline deleted by the previous attempt
+        if status_code != 204 and not (status_code == 404 and (missing_ok or attempts > 1)):
+            return id
+
+        if self.__journal is not None:
+            self.__journal.deleted(id)
+
+
+async def create_storyline_data(
+    client: AsyncStorylineClient,
+    limiter: Optional[AsyncConcurrencyLimiter],
+    dependent_id: int,
+    target_date: date,
+    data_template: BodySource,
+    intended_start: Optional[float] = None,
+    cleanup_queue: Optional[Any] = None,
+) -> Optional[int]:
+    """Call create storyline and stories API in sequence.
+
+    Workflows in flight at the same time are kept within the limit of
+    `limiter` (unbounded if None), which observes the duration and the outcome
+    of each workflow. Created storyline id is put to `cleanup_queue` (if given)
+    to be deleted by streaming clean up.
+
+    Return storyline_id (None if failed on creating).
+    """
+    if limiter is not None:
+        await limiter.acquire()
+    start = time.perf_counter()
+    ok = False
+    try:
+        storyline_id = await client.create_storyline(
+            dependent_id, target_date, intended_start
+        )
+
+        if storyline_id:
+            with span("render_body"):
+                body = data_template.get_bytes(
+                    dependent_id=dependent_id,
+                    target_date=target_date.strftime("%Y-%m-%d"),
+                )
+            code = await client.create_stories(storyline_id=storyline_id, body=body)
+            ok = code == 201
+
+            if code != 201:
+                logger.info(f"Fail on creating stories for storyline (id:{storyline_id})")
+            if cleanup_queue is not None:
+                # the queue may block when it is full, thus do not block the event loop
+                with span("cleanup_queue_put"):
+                    await asyncio.to_thread(
+                        cleanup_queue.put, (storyline_id, time.time())
+                    )
+        else:
+            logger.info(
+                f"Fail on creating storyline for dependent ({dependent_id}) at {target_date}"
+            )
+    finally:
+        if limiter is not None:
+            await limiter.release(time.perf_counter() - start, ok)
+
+    return storyline_id
+
+
+async def create_storylines(
+    target_dates: List[date],
+    dependent_ids: List[int],
+    data_template: BodySource,
+    host_url: str,
+    headers: Dict[str, str],
+    controller: AimdController,
+    recorder: LatencyRecorder,
+    cleanup_queue: Optional[Any] = None,
+    journal: Optional[RunJournal] = None,
+    retry: Optional[RetryPolicy] = None,
+) -> List[Optional[int]]:
+    """Create storyline for all `dependent_ids` at every date in `target_dates`
+    over one pooled client, keeping workflows in flight within the limit of
+    `controller`.
+
+    Each date is marked as done in `journal` (if given) once storylines of all
+    dependents at the date are handled.
+    """
+    limiter = AsyncConcurrencyLimiter(controller)
+
+    async def create_date(
+        client: AsyncStorylineClient, target_date: date
+    ) -> List[Optional[int]]:
+        result = await asyncio.gather(
+            *[
+                create_storyline_data(
+                    client,
+                    limiter,
+                    dependent_id,
+                    target_date,
+                    data_template,
+                    cleanup_queue=cleanup_queue,
+                )
+                for dependent_id in dependent_ids
+            ]
+        )
+        if journal is not None:
+            journal.date_done(target_date)
+
+        return result
+
+    # connections for the largest limit the controller can reach
+    async with AsyncStorylineClient(
+        host_url, headers, controller.maximum, recorder, journal, retry
+    ) as client:
+        results = await asyncio.gather(
+            *[create_date(client, target_date) for target_date in target_dates]
+        )
+
+    return [id for result in results for id in result]
+
+
+async def create_storylines_open_loop(
+    profile: LoadProfile,
+    rate_scale: float,
+    workload: Iterator[Tuple[int, date]],
+    data_template: BodySource,
+    host_url: str,
+    headers: Dict[str, str],
+    max_connections: int,
+    recorder: LatencyRecorder,
+    cleanup_queue: Optional[Any] = None,
+    journal: Optional[RunJournal] = None,
+    retry: Optional[RetryPolicy] = None,
+) -> List[Optional[int]]:
+    """Start a workflow for each item of `workload` at the rate of `profile`,
+    without waiting for the previous workflows to finish (open-loop).
+
+    Latency of creating storyline is measured from the intended send time, thus
+    queueing delay in the generator (e.g. waiting for a pooled connection) is
+    not hidden (coordinated omission correction).
+    """
+    tasks = []
+    async with AsyncStorylineClient(
+        host_url, headers, max_connections, recorder, journal, retry
+    ) as client:
+        loop_start = time.perf_counter()
+        for send_time, (dependent_id, target_date) in zip(
+            profile.send_times(rate_scale), workload
+        ):
+            intended_start = loop_start + send_time
+            delay = intended_start - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            tasks.append(
+                asyncio.create_task(
+                    create_storyline_data(
+                        client,
+                        None,
+                        dependent_id,
+                        target_date,
+                        data_template,
+                        intended_start,
+                        cleanup_queue,
+                    )
+                )
+            )
+
+        return await asyncio.gather(*tasks)
+
+
+def _open_loop_workload(
+    first_date: date, date_step: int, dependent_ids: List[int]
+) -> Iterator[Tuple[int, date]]:
+    """Yield (dependent id, date) pairs for every dependent at `first_date` and
+    every `date_step` days after it (endlessly).
+    """
+    target_date = first_date
+    while True:
+        for dependent_id in dependent_ids:
+            yield dependent_id, target_date
+        target_date += timedelta(days=date_step)
+
+
+async def delete_storylines(
+    storyline_ids: List[int],
+    host_url: str,
+    headers: Dict[str, str],
+    concurrency: int,
+    recorder: LatencyRecorder,
+    journal: Optional[RunJournal] = None,
+    retry: Optional[RetryPolicy] = None,
+    missing_ok: bool = False,
+) -> List[int]:
+    """Delete storylines with `storyline_ids` over one pooled client.
+
+    Storylines not found are regarded as deleted if `missing_ok`.
+
+    Returns list of storyline ids failed on deletion.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def delete(client: AsyncStorylineClient, id: int) -> Optional[int]:
+        async with semaphore:
+            return await client.delete_storyline(id, missing_ok)
+
+    async with AsyncStorylineClient(
+        host_url, headers, concurrency, recorder, journal, retry
+    ) as client:
+        results = await asyncio.gather(*[delete(client, id) for id in storyline_ids])
+
+    return [id for id in results if id is not None]
+
+
+@with_timings
+def run_async_process(
+    target_dates: List[date],
+    dependent_ids: List[int],
+    data_template: BodySource,
+    host_url: str,
+    headers: Dict[str, str],
+    controller: AimdController,
+    cleanup_queue: Optional[Any] = None,
+    journal_dir: Optional[str] = None,
+    retry: Optional[RetryPolicy] = None,
+) -> Tuple[List[Optional[int]], LatencyRecorder, Optional[Saturation]]:
+    """Entry point of a worker process running the asyncio engine.
+
+    Workflows in flight are kept within the limit of `controller`, and
+    requests are retried by `retry`. Created ids, timings and completed dates
+    are recorded to the run journal in `journal_dir` (if given).
+
+    Return a tuple containing a list of created storyline id (None if failed on
+    creating), latencies recorded in the process and the saturation point
+    found by `controller` (same as `run_process`).
+    """
+    logger.info(
+        f"===Running event loop to create storyline at {len(target_dates)} dates==="
+    )
+    recorder, journal = _new_recorder(journal_dir)
+    result = asyncio.run(
+        create_storylines(
+            target_dates,
+            dependent_ids,
+            data_template,
+            host_url,
+            headers,
+            controller,
+            recorder,
+            cleanup_queue,
+            journal,
+            retry,
+        )
+    )
+    if journal is not None:
+        journal.flush()
+
+    return result, recorder, controller.saturation()
+
+
+@with_timings
+def run_open_loop_process(
+    profile: LoadProfile,
+    rate_scale: float,
+    first_date: date,
+    date_step: int,
+    dependent_ids: List[int],
+    data_template: BodySource,
+    host_url: str,
+    headers: Dict[str, str],
+    max_connections: int,
+    cleanup_queue: Optional[Any] = None,
+    journal_dir: Optional[str] = None,
+    retry: Optional[RetryPolicy] = None,
+) -> Tuple[List[Optional[int]], LatencyRecorder, Optional[Saturation]]:
+    """Entry point of a worker process running open-loop load with the asyncio engine.
+
+    The process sends `rate_scale` of the `profile` rate, creating storylines at
+    `first_date` and every `date_step` days after it such that processes do
+    not create storylines at the same date. Requests are retried by `retry`.
+    Created ids and timings are recorded to the run journal in `journal_dir`
+    (if given).
+
+    Return a tuple containing a list of created storyline id (None if failed on
+    creating), latencies recorded in the process and None (the rate is given by
+    `profile`, not by a concurrency controller).
+    """
+    logger.info(f"===Running open-loop load of {profile} from {first_date}===")
+    recorder, journal = _new_recorder(journal_dir)
+    result = asyncio.run(
+        create_storylines_open_loop(
+            profile,
+            rate_scale,
+            _open_loop_workload(first_date, date_step, dependent_ids),
+            data_template,
+            host_url,
+            headers,
+            max_connections,
+            recorder,
+            cleanup_queue,
+            journal,
+            retry,
+        )
+    )
+    if journal is not None:
+        journal.flush()
+
+    return result, recorder, None
+
+
+@with_timings
+def run_async_delete_process(
+    storyline_ids: List[int],
+    host_url: str,
+    headers: Dict[str, str],
+    concurrency: int,
+    journal_dir: Optional[str] = None,
+    retry: Optional[RetryPolicy] = None,
+    missing_ok: bool = False,
+) -> Tuple[List[int], LatencyRecorder]:
+    """Entry point of a worker process deleting storylines with the asyncio engine.
+
+    Requests are retried by `retry`. Deleted ids are recorded to the run
+    journal in `journal_dir` (if given). Storylines not found are regarded as
+    deleted if `missing_ok`.
+
+    Returns list of storyline ids failed on deletion and latencies recorded in
+    the process (same as `run_delete_process`).
+    """
+    recorder, journal = _new_recorder(journal_dir)
+    failed_ids = asyncio.run(
+        delete_storylines(
+            storyline_ids, host_url, headers, concurrency, recorder, journal, retry, missing_ok
+        )
+    )
+    if journal is not None:
+        journal.flush()
+
+    return failed_ids, recorder
+
+
+def _new_recorder(
+    journal_dir: Optional[str],
+) -> Tuple[LatencyRecorder, Optional[RunJournal]]:
+    """Return a new recorder and the journal of this process writing to
+    `journal_dir` (None if not given) which receives all recorded timings.
+    """
+    recorder = LatencyRecorder()
+    if journal_dir is None:
+        return recorder, None
+
+    journal = get_journal(journal_dir)
+    recorder.add_listener(journal.timing)
+
+    return recorder, journal
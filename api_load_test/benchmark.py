@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+from typing import Any, Dict, List, Optional
+
+import main
+
+from log_util import get_logger
+
+
+logger = get_logger(__name__)
+
+ENGINES = ("thread", "asyncio")
+
+# seconds to wait for the mock server to accept connections
+_SERVER_STARTUP_TIMEOUT = 10.0
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _cpu_seconds() -> float:
+    """CPU seconds of this process and its waited children (pool workers are
+    waited when the pool is shut down, the mock server is not until the end).
+    """
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def start_mock_server(
+    port: int,
+    latency: Optional[str],
+    error_rate: float,
+    number_of_processes: int,
+) -> subprocess.Popen:
+    """Start `mock_server.py` and wait until it accepts connections."""
+    command = [
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.realpath(__file__)), "mock_server.py"),
+        "--port",
+        str(port),
+        "--error-rate",
+        str(error_rate),
+        "--processes",
+        str(number_of_processes),
+    ]
+    if latency:
+        command += ["--latency", latency]
+    server = subprocess.Popen(command)
+
+    deadline = time.monotonic() + _SERVER_STARTUP_TIMEOUT
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError(f"Mock server is not started on port {port}")
+            time.sleep(0.05)
+
+
+def measure(phase: str, engine: str, run: Any) -> Dict[str, Any]:
+    """Run `run()` returning the number of requests sent, and return the rate
+    and CPU cost per request of the whole generator (all processes).
+    """
+    cpu_start = _cpu_seconds()
+    start = time.perf_counter()
+    requests = run()
+    elapsed = time.perf_counter() - start
+    cpu = _cpu_seconds() - cpu_start
+
+    return {
+        "engine": engine,
+        "phase": phase,
+        "requests": requests,
+        "seconds": round(elapsed, 3),
+        "rps": round(requests / elapsed, 1) if elapsed else 0.0,
+        "cpu_us_per_request": round(cpu / requests * 1_000_000, 1) if requests else 0.0,
+    }
+
+
+def benchmark(engines: List[str], host_url: str) -> List[Dict[str, Any]]:
+    """Run the configured closed-loop load and clean up with each engine
+    against a mock server at `host_url`.
+
+    With a mock server answering immediately, the rate is the maximum the
+    generator achieves on this machine.
+    """
+    main.configure(
+        {
+            "HOST_URL": host_url,
+            "LOAD_MODE": "closed",
+            "STREAMING_CLEANUP": False,
+            "JOURNAL_DIR": None,
+            "TRACE_FILE": None,
+        }
+    )
+
+    results = []
+    for engine in engines:
+        main.configure({"ENGINE": engine})
+        logger.info(f"=====Benchmarking {engine} engine=====")
+
+        storyline_ids: List[List[int]] = []
+
+        def create() -> int:
+            ids, recorder, _ = main.run_load()
+            storyline_ids.extend(ids)
+            return sum(histogram.count for histogram in recorder.histograms.values())
+
+        def delete() -> int:
+            main.clean_up(storyline_ids)
+            return sum(len(ids) for ids in storyline_ids)
+
+        results.append(measure("create", engine, create))
+        results.append(measure("delete", engine, delete))
+
+    return results
+
+
+def compare(
+    results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float
+) -> List[str]:
+    """Return regressions of `results` from `baseline`: a rate lower, or a CPU
+    cost per request higher, than the baseline by more than `tolerance` (ratio).
+    """
+    baseline_by_key = {(r["engine"], r["phase"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        base = baseline_by_key.get((result["engine"], result["phase"]))
+        if base is None:
+            continue
+        name = f"{result['engine']} {result['phase']}"
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {base['rps']} -> {result['rps']}")
+        if result["cpu_us_per_request"] > base["cpu_us_per_request"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: cpu/request {base['cpu_us_per_request']}us -> {result['cpu_us_per_request']}us"
+            )
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the load generator against a local mock storyline service"
+    )
+    parser.add_argument(
+        "--engines", default=",".join(ENGINES), help="comma separated engines to benchmark"
+    )
+    parser.add_argument("--processes", type=int, default=4, help="NUMBER_OF_PROCESSES of the generator")
+    parser.add_argument("--days", type=int, default=50, help="DAYS_TO_ITERATE (requests scale with it)")
+    parser.add_argument("--server-processes", type=int, default=2, help="processes of the mock server")
+    parser.add_argument("--latency", help="latency distribution of the mock server (see mock_server.py)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="ratio of failed requests of the mock server")
+    parser.add_argument("--save", metavar="FILE", help="write results as JSON (e.g. a baseline)")
+    parser.add_argument("--compare", metavar="FILE", help="baseline JSON to compare, exit with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed ratio of regressions")
+    args = parser.parse_args()
+
+    engines = [engine.strip() for engine in args.engines.split(",") if engine.strip()]
+    for engine in engines:
+        if engine not in ENGINES:
+            parser.error(f"Unknown engine {engine}, one of {ENGINES}")
+
+    main.configure({"NUMBER_OF_PROCESSES": args.processes, "DAYS_TO_ITERATE": args.days})
+    port = _free_port()
+    server = start_mock_server(port, args.latency, args.error_rate, args.server_processes)
+    try:
+        results = benchmark(engines, f"http://127.0.0.1:{port}/storyline-service")
+    finally:
+        server.terminate()
+        server.wait()
+
+    logger.info("=====Benchmark results=====")
+    for result in results:
+        logger.info(
+            f"{result['engine']} {result['phase']}: {result['requests']} requests in {result['seconds']}s"
+            f" rps={result['rps']} cpu/request={result['cpu_us_per_request']}us"
+        )
+
+    if args.save:
+        with open(args.save, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        for regression in regressions:
+            logger.error(f"Regression of {regression}")
+        if regressions:
+            sys.exit(1)
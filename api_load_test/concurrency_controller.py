@@ -0,0 +1,233 @@
+import asyncio
+import threading
+import time
+
+from typing import List, Optional
+
+
+class ControlWindow:
+    """Observations of a control window of `AimdController`."""
+
+    def __init__(
+        self,
+        limit: int,
+        throughput: float,
+        mean_latency: float,
+        error_ratio: float,
+        overloaded: bool,
+    ):
+        self.limit = limit
+        self.throughput = throughput
+        self.mean_latency = mean_latency
+        self.error_ratio = error_ratio
+        self.overloaded = overloaded
+
+
+class Saturation:
+    """Operating point with the highest throughput found by a controller.
+
+    `concurrency` is the average number of requests in flight at the point by
+    Little's law (throughput x latency), which can be lower than `limit` if the
+    generator could not fill the limit. Saturations of processes are summed up
+    with `merge`.
+    """
+
+    def __init__(self, limit: int, concurrency: float, throughput: float, latency: float):
+        self.limit = limit
+        self.concurrency = concurrency
+        self.throughput = throughput
+        self.latency = latency
+
+    def merge(self, other: "Saturation") -> None:
+        # latency is averaged by throughput, i.e. over requests
+        total = self.throughput + other.throughput
+        if total:
+            self.latency = (
+                self.latency * self.throughput + other.latency * other.throughput
+            ) / total
+        self.limit += other.limit
+        self.concurrency += other.concurrency
+        self.throughput = total
+
+    def __str__(self):
+        return (
+            f"saturation at {self.concurrency:.1f} in flight (limit={self.limit}):"
+            f" throughput={self.throughput:.1f}/s latency={self.latency * 1000:.3f}ms"
+        )
+
+
+class AimdController:
+    """Limit of in-flight requests adapted from observed latency and errors.
+
+    Completed requests are grouped into windows of `window` seconds. A window
+    is overloaded if its error ratio exceeds `max_error_ratio` or its mean
+    latency exceeds `latency_tolerance` times the lowest mean latency seen so
+    far (requests are queued in the service). The limit is doubled per window
+    until the first overload (slow start), then increased by `increase` per
+    window and multiplied by `decrease` on an overloaded window (AIMD), thus it
+    oscillates around the saturation point of the service.
+
+    With `adaptive=False` the limit is kept at `initial` and windows are only
+    observed, such that the operating point is reported in the same way.
+
+    It is safe to be shared by threads.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        maximum: int,
+        minimum: int = 1,
+        window: float = 1.0,
+        latency_tolerance: float = 2.0,
+        max_error_ratio: float = 0.01,
+        increase: int = 1,
+        decrease: float = 0.5,
+        adaptive: bool = True,
+    ):
+        """
+        Args:
+            initial (int): the first limit
+            maximum (int): the upper bound of the limit
+            minimum (int, optional): the lower bound of the limit. Defaults to 1.
+            window (float, optional): seconds of a control window. Defaults to 1.0.
+            latency_tolerance (float, optional): ratio of latency to the lowest one regarded as overloaded. Defaults to
+                2.0.
+            max_error_ratio (float, optional): ratio of errors regarded as overloaded. Defaults to 0.01.
+            increase (int, optional): additive increase per window. Defaults to 1.
+            decrease (float, optional): multiplicative decrease on overload. Defaults to 0.5.
+            adaptive (bool, optional): adapt the limit, otherwise only observe. Defaults to True.
+        """
+        self.limit = min(max(initial, minimum), maximum)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = window
+        self.latency_tolerance = latency_tolerance
+        self.max_error_ratio = max_error_ratio
+        self.increase = increase
+        self.decrease = decrease
+        self.adaptive = adaptive
+        self.history: List[ControlWindow] = []
+        self.__lock = threading.Lock()
+        self.__slow_start = True
+        self.__min_latency: Optional[float] = None
+        self.__reset_window(time.perf_counter())
+
+    def __reset_window(self, now: float) -> None:
+        self.__window_start = now
+        self.__count = 0
+        self.__errors = 0
+        self.__total_latency = 0.0
+
+    def record(self, seconds: float, ok: bool) -> None:
+        """Record a completed request taking `seconds`, adjusting the limit at
+        the end of a window.
+        """
+        now = time.perf_counter()
+        with self.__lock:
+            self.__count += 1
+            self.__total_latency += seconds
+            if not ok:
+                self.__errors += 1
+            if now - self.__window_start >= self.window:
+                self.__adjust(now)
+
+    def __adjust(self, now: float) -> None:
+        mean_latency = self.__total_latency / self.__count
+        error_ratio = self.__errors / self.__count
+        throughput = self.__count / (now - self.__window_start)
+        if self.__min_latency is None or mean_latency < self.__min_latency:
+            self.__min_latency = mean_latency
+        overloaded = (
+            error_ratio > self.max_error_ratio
+            or mean_latency > self.__min_latency * self.latency_tolerance
+        )
+        self.history.append(
+            ControlWindow(self.limit, throughput, mean_latency, error_ratio, overloaded)
+        )
+
+        if self.adaptive:
+            if overloaded:
+                self.__slow_start = False
+                limit = int(self.limit * self.decrease)
+            elif self.__slow_start:
+                limit = self.limit * 2
+            else:
+                limit = self.limit + self.increase
+            self.limit = min(max(limit, self.minimum), self.maximum)
+
+        self.__reset_window(now)
+
+    def saturation(self) -> Optional[Saturation]:
+        """Return the window with the highest throughput among the windows not
+        overloaded (among all windows if every window is overloaded), None if
+        no window is completed.
+        """
+        with self.__lock:
+            windows = [w for w in self.history if not w.overloaded] or self.history
+            if not windows:
+                return None
+            best = max(windows, key=lambda w: w.throughput)
+            return Saturation(
+                best.limit,
+                best.throughput * best.mean_latency,
+                best.throughput,
+                best.mean_latency,
+            )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_AimdController__lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__lock = threading.Lock()
+
+
+class ConcurrencyLimiter:
+    """Gate of threads keeping in-flight requests within the limit of a controller.
+
+    Example:
+        limiter.acquire()
+        start = time.perf_counter()
+        ok = call_api()
+        limiter.release(time.perf_counter() - start, ok)
+    """
+
+    def __init__(self, controller: AimdController):
+        self.controller = controller
+        self.in_flight = 0
+        self.__condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.in_flight < self.controller.limit)
+            self.in_flight += 1
+
+    def release(self, seconds: float, ok: bool) -> None:
+        self.controller.record(seconds, ok)
+        with self.__condition:
+            self.in_flight -= 1
+            # the limit may be raised, thus more than one waiter can proceed
+            self.__condition.notify_all()
+
+
+class AsyncConcurrencyLimiter:
+    """`ConcurrencyLimiter` for coroutines of an event loop."""
+
+    def __init__(self, controller: AimdController):
+        self.controller = controller
+        self.in_flight = 0
+        self.__condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self.__condition:
+            await self.__condition.wait_for(lambda: self.in_flight < self.controller.limit)
+            self.in_flight += 1
+
+    async def release(self, seconds: float, ok: bool) -> None:
+        self.controller.record(seconds, ok)
+        async with self.__condition:
+            self.in_flight -= 1
+            self.__condition.notify_all()
@@ -1,7 +1,13 @@
 import json
+import os
+import threading
 
 from string import Template
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+
+# templates compiled in this process, keyed by (absolute file name, cache size)
+_templates: Dict[Tuple[str, int], "DataTemplate"] = {}
+_templates_lock = threading.Lock()
 
 
 class DataTemplate:
@@ -9,13 +15,66 @@ class DataTemplate:
 
     It holds a template thus some keyword strings (${value_to_change}) can be
     substituted.
+
+    The template is split once into static byte segments and keyword slots,
+    such that `get_bytes` renders a ready-to-send body by joining them without
+    parsing the template again.
+
+    A pickled template only holds its file name, and it is unpickled to the
+    template compiled once in the receiving process (see `get_data_template`),
+    thus tasks sent to worker processes do not carry the template.
     """
     __template: Optional[Template] = None
 
-    def __init__(self, file_name: str):
+    def __init__(self, file_name: str, cache_size: int = 0):
+        """
+        Args:
+            file_name (str): a file containing the template
+            cache_size (int, optional): the number of rendered bodies kept by `get_bytes`. Defaults to 0 (no cache).
+        """
+        self.file_name = os.path.abspath(file_name)
         with open(file_name) as fp:
             self.__template = Template(fp.read().replace('\n', ''))
 
+        self.__segments, self.__slots = self.__compile(self.__template)
+        self.__cache_size = cache_size
+        self.__cache: Dict[Tuple, bytes] = {}
+
+    @staticmethod
+    def __compile(template: Template) -> Tuple[List[bytes], List[str]]:
+        """Split `template` into static segments and keyword slots in between.
+
+        Whitespaces between JSON tokens are removed if the template is valid
+        JSON (keyword strings inside JSON strings are kept as they are).
+        """
+        text = template.template
+        try:
+            text = json.dumps(json.loads(text), ensure_ascii=False, separators=(',', ':'))
+        except ValueError:
+            # keyword strings outside of JSON strings, keep the template as it is
+            pass
+
+        segments = []
+        slots = []
+        literal = []
+        position = 0
+        for match in template.pattern.finditer(text):
+            literal.append(text[position:match.start()])
+            position = match.end()
+            if match.group('escaped') is not None:
+                literal.append(template.delimiter)
+                continue
+            name = match.group('named') or match.group('braced')
+            if name is None:
+                raise ValueError(f"Invalid placeholder in template at {match.start()}")
+            segments.append(''.join(literal).encode())
+            slots.append(name)
+            literal = []
+        literal.append(text[position:])
+        segments.append(''.join(literal).encode())
+
+        return segments, slots
+
     def get_formatted_str(self, **kwargs):
         """Returns template string with all keyword strings substituted.
         """
@@ -28,3 +87,46 @@ class DataTemplate:
         strings.
         """
         return json.loads(self.get_formatted_str(**kwargs))
+
+    def get_bytes(self, **kwargs) -> bytes:
+        """Returns UTF-8 encoded JSON body with substituted keyword strings.
+
+        Values are inserted as they are (`str(value)`), same as
+        `get_formatted_str`. Missing keyword raises KeyError.
+        """
+        if self.__cache_size:
+            key = tuple(sorted(kwargs.items()))
+            body = self.__cache.get(key)
+            if body is None:
+                body = self.__render(kwargs)
+                if len(self.__cache) < self.__cache_size:
+                    self.__cache[key] = body
+            return body
+
+        return self.__render(kwargs)
+
+    def __render(self, kwargs: Dict) -> bytes:
+        parts = [b''] * (len(self.__segments) + len(self.__slots))
+        parts[::2] = self.__segments
+        parts[1::2] = [str(kwargs[name]).encode() for name in self.__slots]
+        return b''.join(parts)
+
+    def __reduce__(self):
+        # the receiving process compiles the file once (rendered bodies are not sent either)
+        return get_data_template, (self.file_name, self.__cache_size)
+
+
+def get_data_template(file_name: str, cache_size: int = 0) -> DataTemplate:
+    """Return the template of `file_name` compiled in the current process.
+
+    The template is compiled once per process, thus it can be called in every
+    task (or in the initializer of a process pool to compile it before the
+    first task).
+    """
+    key = (os.path.abspath(file_name), cache_size)
+    with _templates_lock:
+        template = _templates.get(key)
+        if template is None:
+            template = _templates[key] = DataTemplate(file_name, cache_size)
+
+    return template
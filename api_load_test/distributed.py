@@ -0,0 +1,480 @@
+import argparse
+import ipaddress
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import time
+import traceback
+
+from datetime import timedelta
+from multiprocessing.connection import Client, Connection, Listener, wait
+from typing import Any, Dict, List, Tuple
+
+import main
+
+from latency_recorder import LatencyRecorder
+from load_profile import Scaled
+from log_util import get_logger
+from scenario import Scenario
+
+
+logger = get_logger(__name__)
+
+DEFAULT_ADDRESS = "127.0.0.1:7070"
+# environment variable of the key authenticating agents and the coordinator to each other. Messages are pickled,
+#   thus only trusted peers must connect (see `get_authkey`)
+AUTHKEY_ENVIRONMENT_VARIABLE = "LOAD_TEST_AUTHKEY"
+# key used without the environment variable, only on a loopback address
+_LOOPBACK_AUTHKEY = "storyline-load-test"
+
+# seconds from sending the start time to agents to the start, such that every agent receives it in time
+_START_DELAY = 2.0
+# seconds for an agent to retry connecting while the coordinator is starting
+_CONNECT_TIMEOUT = 30.0
+
+# Messages are tuples of (kind, payload)
+#   agent -> coordinator: ("hello", {"host", "pid"}), ("ready", None), ("created", result of `main.run_load`),
+#                         ("cleaned", result of `main.clean_up`), ("error", traceback)
+#   coordinator -> agent: ("configure", configurations), ("start", wall clock time), ("clean_up", ids), ("stop", None)
+
+
+def parse_address(text: str) -> Tuple[str, int]:
+    """Parse `host:port`.
+
+    Raises:
+        ValueError: if text is not `host:port`
+    """
+    host, separator, port = text.rpartition(":")
+    if not separator or not port.isdigit():
+        raise ValueError(f"Address must be host:port, but {text}")
+    return host, int(port)
+
+
+def is_loopback(host: str) -> bool:
+    """Returns True if `host` is only reachable from this host (an empty host
+    binds all interfaces).
+    """
+    if not host:
+        return False
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def get_authkey(host: str, generate: bool = False) -> bytes:
+    """Returns the key authenticating peers at `host` (the coordinator address).
+
+    The key is taken from LOAD_TEST_AUTHKEY. Without it, a random key is
+    generated if `generate` (for agents started by the coordinator, see
+    `start_local_agents`), or a built-in key is used if `host` is a loopback
+    address.
+
+    Raises:
+        ValueError: if LOAD_TEST_AUTHKEY is not set for an address reachable from other hosts
+    """
+    authkey = os.environ.get(AUTHKEY_ENVIRONMENT_VARIABLE)
+    if authkey:
+        return authkey.encode()
+    if generate:
+        return secrets.token_hex(32).encode()
+    if is_loopback(host):
+        return _LOOPBACK_AUTHKEY.encode()
+    raise ValueError(
+        f"{AUTHKEY_ENVIRONMENT_VARIABLE} must be set to a secret shared by the coordinator and the agents"
+        f" to use {host or 'all interfaces'}, since anyone who knows the key can run code in them"
+    )
+
+
+def partition_work(number_of_agents: int) -> List[Dict[str, Any]]:
+    """Split the DEPENDENT_IDS x dates work space of main into configurations
+    overridden on each agent.
+
+    In closed-loop mode, consecutive dates are split (or dependent ids if
+    there are fewer dates than agents). In open-loop mode, dependent ids are
+    split since dates are not bounded, and each agent sends its share of
+    LOAD_PROFILE rate.
+
+    Journal of each agent is written to its own sub-directory of JOURNAL_DIR,
+    thus agents on the same host do not share journal files.
+
+    Raises:
+        ValueError: if the work space cannot be split to the number of agents
+    """
+    dependent_ids = main.DEPENDENT_IDS
+    days = main.DAYS_TO_ITERATE
+    if main.LOAD_MODE == "open" or days < number_of_agents:
+        if len(dependent_ids) < number_of_agents:
+            raise ValueError(
+                f"{len(dependent_ids)} dependent ids cannot be split to {number_of_agents} agents"
+            )
+        partitions = [
+            {"DEPENDENT_IDS": dependent_ids[i::number_of_agents]}
+            for i in range(number_of_agents)
+        ]
+        if main.LOAD_MODE == "open":
+            for partition in partitions:
+                partition["LOAD_PROFILE"] = Scaled(main.LOAD_PROFILE, 1 / number_of_agents)
+    else:
+        partitions = []
+        start_date = main.START_DATE
+        for i in range(number_of_agents):
+            agent_days = days // number_of_agents + (1 if i < days % number_of_agents else 0)
+            partitions.append({"START_DATE": start_date, "DAYS_TO_ITERATE": agent_days})
+            start_date += timedelta(days=agent_days)
+
+    if main.JOURNAL_DIR is not None:
+        for i, partition in enumerate(partitions):
+            partition["JOURNAL_DIR"] = os.path.join(main.JOURNAL_DIR, f"agent-{i}")
+
+    return partitions
+
+
+class AgentConnection:
+    """Connection of the coordinator to an agent."""
+
+    def __init__(self, index: int, connection: Connection, host: str, pid: int):
+        self.index = index
+        self.connection = connection
+        self.host = host
+        self.pid = pid
+        self.alive = True
+        self.storyline_ids: List[List[int]] = []
+
+    def send(self, kind: str, payload: Any = None) -> None:
+        try:
+            self.connection.send((kind, payload))
+        except OSError:
+            logger.error(f"{self} is disconnected")
+            self.alive = False
+
+    def __str__(self):
+        return f"agent {self.index} ({self.host}:{self.pid})"
+
+
+class Coordinator:
+    """Coordinator of agents running parts of the load on other processes or hosts.
+
+    Agents connect to the coordinator (see `run_agent`), then the coordinator
+    configures each of them with its part of the work space (see
+    `partition_work`), starts them at the same time and merges their results.
+    Created storylines are deleted by the agents which created them (by the
+    other agents if an agent is lost), thus run journals of agents are kept
+    consistent.
+
+    Example:
+        with Coordinator(("0.0.0.0", 7070), 4, b"key") as coordinator:
+            coordinator.accept_agents()
+            storyline_ids, recorder, elapsed = coordinator.run_load({"DAYS_TO_ITERATE": 1000})
+            coordinator.clean_up()
+    """
+
+    def __init__(self, address: Tuple[str, int], number_of_agents: int, authkey: bytes):
+        self.number_of_agents = number_of_agents
+        self.agents: List[AgentConnection] = []
+        self.__listener = Listener(address, authkey=authkey)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.__listener.address
+
+    def accept_agents(self) -> None:
+        """Wait for `number_of_agents` agents to connect."""
+        logger.info(f"Waiting for {self.number_of_agents} agents on {self.address}")
+        while len(self.agents) < self.number_of_agents:
+            try:
+                connection = self.__listener.accept()
+            except Exception as e:  # e.g. AuthenticationError of an unknown peer
+                logger.warning(f"Rejected a connection: {e!r}")
+                continue
+            kind, hello = connection.recv()
+            if kind != "hello":
+                logger.warning(f"Rejected a connection sending {kind} first")
+                connection.close()
+                continue
+            agent = AgentConnection(len(self.agents), connection, hello["host"], hello["pid"])
+            self.agents.append(agent)
+            logger.info(f"{agent} is connected")
+
+    def run_load(
+        self, configurations: Dict[str, Any]
+    ) -> Tuple[List[List[int]], LatencyRecorder, float]:
+        """Run the load configured by `configurations` (see `main.configure`)
+        on all agents at the same time, the work space is split by the
+        configurations of main overridden by `configurations`.
+
+        Return a tuple containing lists of created storyline ids, latencies
+        merged from all agents and the longest elapsed seconds of the agents
+        (same as `main.run_load`).
+
+        Raises:
+            RuntimeError: if no agent is connected or every agent failed
+        """
+        main.configure(configurations)
+        agents = self.__alive_agents()
+        if not agents:
+            raise RuntimeError("No agent is connected")
+        for agent, partition in zip(agents, partition_work(len(agents))):
+            logger.info(f"{agent} runs {partition}")
+            agent.send("configure", {**configurations, **partition})
+        self.__gather(agents, "ready")
+
+        start_at = time.time() + _START_DELAY
+        for agent in self.__alive_agents():
+            agent.send("start", start_at)
+        results = self.__gather(self.__alive_agents(), "created")
+        if not results:
+            raise RuntimeError("Every agent failed to run the load")
+
+        storyline_ids: List[List[int]] = []
+        recorder = LatencyRecorder()
+        elapsed = 0.0
+        for agent, (agent_ids, agent_recorder, agent_elapsed) in results:
+            created = sum(len(ids) for ids in agent_ids)
+            logger.info(f"{agent} created {created} storylines in {agent_elapsed:.3f}s")
+            agent.storyline_ids = agent_ids
+            storyline_ids.extend(agent_ids)
+            recorder.merge(agent_recorder)
+            elapsed = max(elapsed, agent_elapsed)
+
+        return storyline_ids, recorder, elapsed
+
+    def clean_up(self) -> Tuple[List[int], LatencyRecorder]:
+        """Delete storylines created by `run_load` on the agents which created
+        them, storylines of lost agents are split to the other agents (or
+        deleted by this process if every agent is lost).
+
+        Return a tuple containing ids failed to delete and latencies merged
+        from all agents (same as `main.clean_up`).
+        """
+        agents = self.__alive_agents()
+        orphaned_ids = [
+            ids for agent in self.agents if not agent.alive for ids in agent.storyline_ids
+        ]
+        if not agents:
+            return main.clean_up(orphaned_ids)
+
+        for i, ids in enumerate(orphaned_ids):
+            agents[i % len(agents)].storyline_ids.append(ids)
+        for agent in agents:
+            agent.send("clean_up", agent.storyline_ids)
+            agent.storyline_ids = []
+
+        failed_ids: List[int] = []
+        recorder = LatencyRecorder()
+        for agent, (agent_failed_ids, agent_recorder) in self.__gather(agents, "cleaned"):
+            failed_ids.extend(agent_failed_ids)
+            recorder.merge(agent_recorder)
+
+        return failed_ids, recorder
+
+    def close(self) -> None:
+        """Stop agents and close connections."""
+        for agent in self.__alive_agents():
+            agent.send("stop")
+            agent.connection.close()
+        self.__listener.close()
+
+    def __alive_agents(self) -> List[AgentConnection]:
+        return [agent for agent in self.agents if agent.alive]
+
+    def __gather(
+        self, agents: List[AgentConnection], expected_kind: str
+    ) -> List[Tuple[AgentConnection, Any]]:
+        """Wait for a reply of each agent, and return replies of `expected_kind`
+        in the order of arrival. Agents failed or disconnected are no longer
+        used.
+        """
+        waiting = {agent.connection: agent for agent in agents if agent.alive}
+        replies = []
+        while waiting:
+            for connection in wait(list(waiting)):
+                agent = waiting.pop(connection)
+                try:
+                    kind, payload = connection.recv()
+                except (EOFError, OSError):
+                    logger.error(f"{agent} is disconnected")
+                    agent.alive = False
+                    continue
+                if kind == expected_kind:
+                    replies.append((agent, payload))
+                else:
+                    logger.error(f"{agent} failed:\n{payload}")
+                    agent.alive = False
+                    agent.send("stop")
+
+        return replies
+
+    def __enter__(self) -> "Coordinator":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def coordinate(
+    address: Tuple[str, int],
+    number_of_agents: int,
+    authkey: bytes,
+    configurations: Dict[str, Any],
+) -> None:
+    """Run the load configured by `configurations` (see `main.configure`) on
+    `number_of_agents` agents, log the merged report and delete created
+    storylines.
+    """
+    with Coordinator(address, number_of_agents, authkey) as coordinator:
+        coordinator.accept_agents()
+
+        logger.info(f"=====Starting load on {number_of_agents} agents=====")
+        storyline_ids, recorder, elapsed = coordinator.run_load(configurations)
+        logger.info(
+            f"Finished creating {sum(len(ids) for ids in storyline_ids)} storylines"
+            f" on {len(coordinator.agents)} agents"
+        )
+        for line in recorder.report(elapsed):
+            logger.info(line)
+
+        logger.info("=====Deleting storylines=====")
+        failed_ids, recorder = coordinator.clean_up()
+        for line in recorder.report():
+            logger.info(line)
+        logger.info(f"All storylines are deleted except ids: {failed_ids}")
+
+
+def start_local_agents(
+    number_of_agents: int, address: Tuple[str, int], authkey: bytes
+) -> List[subprocess.Popen]:
+    """Start agents on this host connecting to the coordinator at `address`."""
+    host, port = address
+    if host in ("", "0.0.0.0"):
+        host = "127.0.0.1"
+    command = [
+        sys.executable,
+        os.path.realpath(__file__),
+        "agent",
+        "--coordinator",
+        f"{host}:{port}",
+    ]
+    # the key is passed by environment not to be shown in process lists
+    env = {**os.environ, AUTHKEY_ENVIRONMENT_VARIABLE: authkey.decode()}
+    return [subprocess.Popen(command, env=env) for _ in range(number_of_agents)]
+
+
+def _connect(address: Tuple[str, int], authkey: bytes) -> Connection:
+    deadline = time.monotonic() + _CONNECT_TIMEOUT
+    while True:
+        try:
+            return Client(address, authkey=authkey)
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def run_agent(address: Tuple[str, int], authkey: bytes) -> None:
+    """Run parts of the load requested by the coordinator at `address` until
+    it stops the agent or disconnects.
+    """
+    with _connect(address, authkey) as connection:
+        connection.send(("hello", {"host": socket.gethostname(), "pid": os.getpid()}))
+        logger.info(f"Connected to the coordinator at {address}")
+        start_method_set = False
+        while True:
+            try:
+                kind, payload = connection.recv()
+            except EOFError:
+                logger.warning("Coordinator is disconnected")
+                return
+            if kind == "stop":
+                return
+
+            try:
+                if kind == "configure":
+                    main.configure(payload)
+                    if not start_method_set:
+                        main.init_start_method()
+                        start_method_set = True
+                    reply = ("ready", None)
+                elif kind == "start":
+                    # clocks of hosts are expected to be synchronized (e.g. by NTP)
+                    delay = payload - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        logger.warning(f"Started {-delay:.3f}s late")
+                    reply = ("created", main.run_load())
+                elif kind == "clean_up":
+                    reply = ("cleaned", main.clean_up(payload))
+                else:
+                    raise ValueError(f"Unknown message {kind}")
+            except Exception:
+                logger.exception(f"Failed on {kind}")
+                reply = ("error", traceback.format_exc())
+            connection.send(reply)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Distributed load test of storyline service with a coordinator and agents"
+    )
+    subparsers = parser.add_subparsers(dest="role", required=True)
+
+    coordinator_parser = subparsers.add_parser(
+        "coordinator", help="split the load to agents and merge their results"
+    )
+    coordinator_parser.add_argument("--agents", type=int, required=True, help="number of agents to wait for")
+    coordinator_parser.add_argument(
+        "--bind",
+        default=DEFAULT_ADDRESS,
+        metavar="HOST:PORT",
+        help=f"address agents connect to ({AUTHKEY_ENVIRONMENT_VARIABLE} is required unless it is loopback or --local)",
+    )
+    coordinator_parser.add_argument(
+        "--local", action="store_true", help="start the agents on this host as well"
+    )
+    coordinator_parser.add_argument("--scenario", metavar="FILE", help="scenario file (TOML) overriding configurations")
+    coordinator_parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="override a scenario key, e.g. --set parallelism.processes=16 (repeatable)",
+    )
+
+    agent_parser = subparsers.add_parser("agent", help="run parts of the load requested by a coordinator")
+    agent_parser.add_argument(
+        "--coordinator", default=DEFAULT_ADDRESS, metavar="HOST:PORT", help="address of the coordinator"
+    )
+    args = parser.parse_args()
+
+    if args.role == "agent":
+        try:
+            coordinator_address = parse_address(args.coordinator)
+            authkey = get_authkey(coordinator_address[0])
+        except ValueError as e:
+            parser.error(str(e))
+        run_agent(coordinator_address, authkey)
+        sys.exit()
+
+    try:
+        bind_address = parse_address(args.bind)
+        # agents started here are given a random key unless the key is set
+        authkey = get_authkey(bind_address[0], generate=args.local)
+        scenario = Scenario.load(args.scenario) if args.scenario else Scenario()
+        for override in args.set:
+            scenario.set_override(override)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if args.agents < 1:
+        parser.error("--agents must be positive")
+
+    agents: List[subprocess.Popen] = []
+    if args.local:
+        agents = start_local_agents(args.agents, bind_address, authkey)
+    try:
+        coordinate(bind_address, args.agents, authkey, scenario.configurations())
+    finally:
+        for agent in agents:
+            agent.wait()
@@ -0,0 +1,221 @@
+import functools
+import json
+import os
+import threading
+import time
+
+from typing import Any, Callable, Dict, List, Optional, TypeVar, ParamSpec
+
+# for generic typing
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+class SpanStats:
+    """Aggregate of durations of a span in nanoseconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns: Optional[int] = None
+        self.max_ns = 0
+
+    def add(self, duration_ns: int) -> None:
+        self.count += 1
+        self.total_ns += duration_ns
+        if self.min_ns is None or duration_ns < self.min_ns:
+            self.min_ns = duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+
+    def merge(self, other: "SpanStats") -> None:
+        self.count += other.count
+        self.total_ns += other.total_ns
+        if other.min_ns is not None and (self.min_ns is None or other.min_ns < self.min_ns):
+            self.min_ns = other.min_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+
+
+class Timings:
+    """Span aggregates (and optionally trace events) of a process.
+
+    Timings of other processes are merged with `merge`, thus a worker returns
+    its `take_timings()` with the result of a task and the main process merges
+    them.
+    """
+
+    def __init__(self, max_trace_events: int = 0):
+        """
+        Args:
+            max_trace_events (int, optional): the number of trace events kept (see `trace_events`). Defaults to 0
+                (not traced).
+        """
+        self.__lock = threading.Lock()
+        self.stats: Dict[str, SpanStats] = {}
+        self.events: List[list] = []
+        self.max_trace_events = max_trace_events
+
+    def record(self, name: str, start_ns: int, end_ns: int) -> None:
+        with self.__lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = SpanStats()
+            stats.add(end_ns - start_ns)
+            if len(self.events) < self.max_trace_events:
+                self.events.append([name, start_ns, end_ns, os.getpid(), threading.get_ident()])
+
+    def merge(self, other: "Timings") -> None:
+        with self.__lock:
+            for name, stats in other.stats.items():
+                self.stats.setdefault(name, SpanStats()).merge(stats)
+            self.events.extend(other.events)
+
+    def report(self) -> List[str]:
+        """Returns a line per span ordered by total time."""
+        with self.__lock:
+            items = sorted(self.stats.items(), key=lambda item: item[1].total_ns, reverse=True)
+            return [
+                f"{name}: count={stats.count} total={stats.total_ns / 1e6:.3f}ms"
+                f" mean={stats.total_ns / stats.count / 1e6:.3f}ms"
+                f" min={stats.min_ns / 1e6:.3f}ms max={stats.max_ns / 1e6:.3f}ms"
+                for name, stats in items
+            ]
+
+    def trace_events(self) -> List[Dict[str, Any]]:
+        """Returns events in Chrome trace format (complete events), to be
+        loaded in `chrome://tracing` or Perfetto.
+
+        `perf_counter_ns` is system wide on Linux and Windows, thus events of
+        processes are placed on the same timeline.
+        """
+        with self.__lock:
+            return [
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": start_ns / 1000,
+                    "dur": (end_ns - start_ns) / 1000,
+                    "pid": pid,
+                    "tid": tid,
+                }
+                for name, start_ns, end_ns, pid, tid in self.events
+            ]
+
+    def dump_trace(self, file_name: str) -> None:
+        with open(file_name, "w") as fp:
+            json.dump({"traceEvents": self.trace_events()}, fp)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_Timings__lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__lock = threading.Lock()
+
+
+# timings of the current process
+_timings = Timings()
+
+
+def __reset_in_child() -> None:
+    # a forked process starts with empty timings (tracing is kept enabled)
+    global _timings
+    _timings = Timings(_timings.max_trace_events)
+
+
+os.register_at_fork(after_in_child=__reset_in_child)
+
+
+def enable_trace(max_trace_events: int) -> None:
+    """Keep up to `max_trace_events` trace events in the current process (0 to
+    disable). It is to be called in the initializer of process pools since a
+    spawned process does not inherit it.
+    """
+    _timings.max_trace_events = max_trace_events
+
+
+def get_timings() -> Timings:
+    """Returns timings of the current process."""
+    return _timings
+
+
+def take_timings() -> Timings:
+    """Returns timings of the current process recorded so far and reset them,
+    thus timings of a pooled process are not returned twice.
+    """
+    global _timings
+    timings, _timings = _timings, Timings(_timings.max_trace_events)
+    return timings
+
+
+class span:
+    """Context manager recording a span (monotonic `perf_counter_ns`) of its
+    block to timings of the current process.
+
+    Example:
+        with span("render_body"):
+            body = data_template.get_bytes(...)
+    """
+
+    __slots__ = ("name", "start_ns")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "span":
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        _timings.record(self.name, self.start_ns, time.perf_counter_ns())
+
+
+def timed(
+    name: Optional[str] = None, log: Optional[Callable[[str], Any]] = None
+) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    """Decorator recording a span of every call of a function.
+
+    The wrapper keeps the name of the function (`functools.wraps`), thus a
+    decorated top level function can still be passed to a process pool.
+
+    Args:
+        name (str, optional): a span name. Defaults to the name of the function.
+        log (Callable, optional): called with a line of the duration for each call (e.g. `logger.info`, for coarse
+            functions only). Defaults to None.
+    """
+
+    def decorator(func: Callable[P, R]) -> Callable[P, R]:
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            start_ns = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end_ns = time.perf_counter_ns()
+                _timings.record(span_name, start_ns, end_ns)
+                if log is not None:
+                    log(f"{span_name} is executed for {(end_ns - start_ns) / 1e6:.3f}ms")
+
+        return wrapper
+
+    return decorator
+
+
+def with_timings(func: Callable[P, R]) -> Callable[P, tuple]:
+    """Decorator of a task run by a process pool, returning `(result, timings)`
+    where timings are recorded in the process while running the task (see
+    `take_timings`).
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> tuple:
+        take_timings()
+        with span(func.__name__):
+            result = func(*args, **kwargs)
+        return result, take_timings()
+
+    return wrapper
@@ -0,0 +1,258 @@
+import threading
+
+from array import array
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Each power of two range is split into `_SUB_BUCKET_COUNT` linear buckets, thus
+# a recorded value is off by at most 1/128 (< 0.8%) of itself (HDR histogram style)
+_SUB_BUCKET_BITS = 7
+_SUB_BUCKET_COUNT = 1 << _SUB_BUCKET_BITS
+# values below this are stored exactly (one bucket per microsecond)
+_EXACT_LIMIT = _SUB_BUCKET_COUNT << 1
+# largest trackable value is about 19 hours in microseconds, larger values are clamped
+_MAX_VALUE_BITS = 36
+_MAX_VALUE = (1 << _MAX_VALUE_BITS) - 1
+_BUCKET_COUNT = (
+    _EXACT_LIMIT + (_MAX_VALUE_BITS - _SUB_BUCKET_BITS - 1) * _SUB_BUCKET_COUNT
+)
+
+REPORT_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+# pseudo status codes recorded for requests without a response
+STATUS_TIMEOUT = -1
+STATUS_CONNECTION_ERROR = -2  # refused, reset or closed connection
+
+# outcomes of requests, each of them has its own histogram (see `classify`)
+OUTCOMES = ("2xx", "3xx", "4xx", "5xx", "timeout", "connection_error")
+
+
+def classify(status_code: int) -> str:
+    """Return the outcome (one of OUTCOMES) of a request with `status_code`."""
+    if status_code == STATUS_TIMEOUT:
+        return "timeout"
+    if status_code == STATUS_CONNECTION_ERROR:
+        return "connection_error"
+    return f"{min(max(status_code // 100, 2), 5)}xx"
+
+
+def _status_label(status_code: int) -> Any:
+    return status_code if status_code >= 0 else classify(status_code)
+
+
+def _bucket_index(value: int) -> int:
+    """Return index of the bucket holding `value` (in microseconds)."""
+    if value < _EXACT_LIMIT:
+        return value
+    shift = value.bit_length() - _SUB_BUCKET_BITS - 1
+    return (
+        _EXACT_LIMIT
+        + (shift - 1) * _SUB_BUCKET_COUNT
+        + (value >> shift)
+        - _SUB_BUCKET_COUNT
+    )
+
+
+def _bucket_upper_bound(index: int) -> int:
+    """Return the largest value (in microseconds) stored in the bucket at `index`."""
+    if index < _EXACT_LIMIT:
+        return index
+    shift, sub_index = divmod(index - _EXACT_LIMIT, _SUB_BUCKET_COUNT)
+    shift += 1
+    return ((_SUB_BUCKET_COUNT + sub_index + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """Log-bucketed histogram of latencies with fixed memory.
+
+    Values are kept in microseconds and the size of the histogram does not
+    depend on the number of recorded values. Pickled histogram only contains
+    non-empty buckets, thus it is cheap to be sent across process boundary.
+    """
+
+    def __init__(self):
+        self.__counts = array("Q", bytes(8 * _BUCKET_COUNT))
+        self.count = 0
+        self.total = 0
+        self.min = _MAX_VALUE
+        self.max = 0
+
+    def record(self, seconds: float) -> None:
+        value = min(max(int(seconds * 1_000_000), 0), _MAX_VALUE)
+        self.__counts[_bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        """Add all values recorded in `other` to this histogram."""
+        for index, count in other._non_empty_buckets():
+            self.__counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percentile: float) -> float:
+        """Return the value in second at `percentile` (0 < percentile <= 100).
+
+        0 would be returned if nothing is recorded.
+        """
+        if self.count == 0:
+            return 0.0
+
+        rank = max(1, round(self.count * percentile / 100))
+        cumulative = 0
+        for index, count in self._non_empty_buckets():
+            cumulative += count
+            if cumulative >= rank:
+                return min(_bucket_upper_bound(index), self.max) / 1_000_000
+
+        return self.max / 1_000_000
+
+    def mean(self) -> float:
+        """Return the mean value in second (0 if nothing is recorded)."""
+        return self.total / self.count / 1_000_000 if self.count else 0.0
+
+    def _non_empty_buckets(self) -> Iterable[Tuple[int, int]]:
+        return ((i, count) for i, count in enumerate(self.__counts) if count)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {
+            "buckets": dict(self._non_empty_buckets()),
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__counts = array("Q", bytes(8 * _BUCKET_COUNT))
+        for index, count in state["buckets"].items():
+            self.__counts[index] = count
+        self.count = state["count"]
+        self.total = state["total"]
+        self.min = state["min"]
+        self.max = state["max"]
+
+
+class LatencyRecorder:
+    """Latency histograms and status code counts per endpoint.
+
+    Latencies are recorded per outcome (see `classify`) as well, thus time
+    spent on failed requests (e.g. waiting for timeouts) is reported apart from
+    successful ones.
+
+    It is safe to be shared by threads in a process. Recorders of the worker
+    processes are merged into one with `merge`.
+
+    Listeners added by `add_listener` are called with every recorded response
+    in the process (they are not pickled).
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__listeners: List[Callable[[str, int, float], None]] = []
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.outcome_histograms: Dict[str, Dict[str, LatencyHistogram]] = {}
+        self.status_codes: Dict[str, Counter] = {}
+
+    def add_listener(self, listener: Callable[[str, int, float], None]) -> None:
+        """Call `listener(endpoint, status_code, seconds)` on every `record`."""
+        self.__listeners.append(listener)
+
+    def record(self, endpoint: str, status_code: int, seconds: float) -> None:
+        """Record a response of `endpoint` taking `seconds`."""
+        with self.__lock:
+            histogram = self.histograms.get(endpoint)
+            if histogram is None:
+                histogram = self.histograms[endpoint] = LatencyHistogram()
+                self.outcome_histograms[endpoint] = {}
+                self.status_codes[endpoint] = Counter()
+            histogram.record(seconds)
+            outcome = classify(status_code)
+            outcome_histogram = self.outcome_histograms[endpoint].get(outcome)
+            if outcome_histogram is None:
+                outcome_histogram = self.outcome_histograms[endpoint][outcome] = LatencyHistogram()
+            outcome_histogram.record(seconds)
+            self.status_codes[endpoint][status_code] += 1
+
+        for listener in self.__listeners:
+            listener(endpoint, status_code, seconds)
+
+    def merge(self, other: "LatencyRecorder") -> None:
+        with self.__lock:
+            for endpoint, histogram in other.histograms.items():
+                if endpoint not in self.histograms:
+                    self.histograms[endpoint] = LatencyHistogram()
+                    self.outcome_histograms[endpoint] = {}
+                    self.status_codes[endpoint] = Counter()
+                self.histograms[endpoint].merge(histogram)
+                for outcome, outcome_histogram in other.outcome_histograms[endpoint].items():
+                    self.outcome_histograms[endpoint].setdefault(
+                        outcome, LatencyHistogram()
+                    ).merge(outcome_histogram)
+                self.status_codes[endpoint].update(other.status_codes[endpoint])
+
+    def report(self, elapsed_seconds: Optional[float] = None) -> List[str]:
+        """Return human readable report lines (one line per endpoint, followed
+        by a line per outcome other than 2xx).
+
+        Throughput is reported if `elapsed_seconds` (wall time of the run) is given.
+
+        Return value example:
+            ['create_stories: count=3000 throughput=512.3/s p50=31.0ms ... errors={500: 2, 'timeout': 1}',
+             'create_stories[5xx]: count=2 p50=12.0ms ...',
+             'create_stories[timeout]: count=1 p50=30000.0ms ...']
+        """
+        lines = []
+        for endpoint in sorted(self.histograms):
+            histogram = self.histograms[endpoint]
+            line = f"{endpoint}: count={histogram.count}"
+            if elapsed_seconds:
+                line += f" throughput={histogram.count / elapsed_seconds:.1f}/s"
+            line += self.__format_latencies(histogram)
+
+            errors = {
+                _status_label(code): count
+                for code, count in sorted(self.status_codes[endpoint].items())
+                if not 200 <= code < 300
+            }
+            line += f" errors={errors}"
+            lines.append(line)
+
+            outcome_histograms = self.outcome_histograms[endpoint]
+            for outcome in OUTCOMES[1:]:
+                if outcome in outcome_histograms:
+                    outcome_histogram = outcome_histograms[outcome]
+                    lines.append(
+                        f"{endpoint}[{outcome}]: count={outcome_histogram.count}"
+                        + self.__format_latencies(outcome_histogram)
+                    )
+
+        return lines
+
+    @staticmethod
+    def __format_latencies(histogram: LatencyHistogram) -> str:
+        line = ""
+        for percentile in REPORT_PERCENTILES:
+            line += f" p{percentile:g}={histogram.percentile(percentile) * 1000:.3f}ms"
+        return line + f" max={histogram.max / 1000:.3f}ms"
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # lock cannot be pickled, and listeners are bound to the process
+        return {
+            "histograms": self.histograms,
+            "outcome_histograms": self.outcome_histograms,
+            "status_codes": self.status_codes,
+        }
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__lock = threading.Lock()
+        self.__listeners = []
+        self.histograms = state["histograms"]
+        self.outcome_histograms = state["outcome_histograms"]
+        self.status_codes = state["status_codes"]
@@ -0,0 +1,313 @@
+import csv
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
+import threading
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from latency_recorder import LatencyHistogram
+
+# percentiles of each window (the live line and the time series)
+LIVE_PERCENTILES = (50.0, 99.0)
+
+# windows are emitted once this many windows have passed, such that every process has sent them
+_GRACE_WINDOWS = 2
+
+
+class WindowStats:
+    """Responses of an endpoint completed in a window."""
+
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.errors = 0
+
+    def record(self, status_code: int, seconds: float) -> None:
+        self.histogram.record(seconds)
+        if not 200 <= status_code < 300:
+            self.errors += 1
+
+    def merge(self, other: "WindowStats") -> None:
+        self.histogram.merge(other.histogram)
+        self.errors += other.errors
+
+
+class LiveMetrics:
+    """Windowed counters of requests of a process, sent to `LiveAggregator` of
+    the main process through `channel` once per window.
+
+    Windows are aligned to the wall clock (e.g. every second), thus windows of
+    all processes are merged by their index. A background thread sends
+    completed windows together with the number of requests in flight at the
+    end of the window.
+    """
+
+    def __init__(self, channel: Any, interval: float):
+        """
+        Args:
+            channel (Any): a queue of the aggregator (see `LiveAggregator.channel`)
+            interval (float): seconds of a window
+        """
+        self.interval = interval
+        self.in_flight = 0
+        self.__channel = channel
+        self.__lock = threading.Lock()
+        self.__windows: Dict[int, Dict[str, WindowStats]] = {}
+        self.__stopped = threading.Event()
+        self.__sender = threading.Thread(target=self.__send_periodically, name="live-metrics", daemon=True)
+        self.__sender.start()
+        # pool workers exit without atexit handlers, but with finalizers of multiprocessing
+        multiprocessing.util.Finalize(self, self.close, exitpriority=10)
+
+    def started(self) -> None:
+        """Count a request sent."""
+        with self.__lock:
+            self.in_flight += 1
+
+    def finished(self, endpoint: str, status_code: int, seconds: float) -> None:
+        """Count a response of `endpoint` (or an error without a response) taking `seconds`."""
+        window = int(time.time() / self.interval)
+        with self.__lock:
+            self.in_flight -= 1
+            windows = self.__windows.get(window)
+            if windows is None:
+                windows = self.__windows[window] = {}
+            stats = windows.get(endpoint)
+            if stats is None:
+                stats = windows[endpoint] = WindowStats()
+            stats.record(status_code, seconds)
+
+    def send(self, completed_only: bool = True) -> None:
+        """Send windows to the aggregator (only windows already ended if
+        `completed_only`).
+        """
+        current = int(time.time() / self.interval)
+        with self.__lock:
+            windows = {
+                window: stats
+                for window, stats in self.__windows.items()
+                if window < current or not completed_only
+            }
+            for window in windows:
+                del self.__windows[window]
+            in_flight = self.in_flight
+        self.__channel.put((os.getpid(), current, in_flight, windows))
+
+    def close(self) -> None:
+        """Stop sending periodically, and send all windows."""
+        if self.__stopped.is_set():
+            return
+        self.__stopped.set()
+        self.send(completed_only=False)
+
+    def __send_periodically(self) -> None:
+        while not self.__stopped.wait(self.interval - time.time() % self.interval):
+            self.send()
+
+
+# live metrics of the current process (None if disabled)
+_live_metrics: Optional[LiveMetrics] = None
+
+
+def __reset_in_child() -> None:
+    # the sender thread is not running in a forked process
+    global _live_metrics
+    _live_metrics = None
+
+
+os.register_at_fork(after_in_child=__reset_in_child)
+
+
+def enable_live_metrics(channel: Optional[Any], interval: float) -> None:
+    """Send live metrics of the current process to `channel` (disabled if
+    `channel` is None).
+    """
+    global _live_metrics
+    disable_live_metrics()
+    if channel is not None:
+        _live_metrics = LiveMetrics(channel, interval)
+
+
+def disable_live_metrics() -> None:
+    global _live_metrics
+    if _live_metrics is not None:
+        _live_metrics.close()
+        _live_metrics = None
+
+
+def request_started() -> None:
+    """Count a request sent by the current process (no-op if disabled)."""
+    if _live_metrics is not None:
+        _live_metrics.started()
+
+
+def request_finished(endpoint: str, status_code: int, seconds: float) -> None:
+    """Count a response received by the current process (no-op if disabled)."""
+    if _live_metrics is not None:
+        _live_metrics.finished(endpoint, status_code, seconds)
+
+
+class LiveAggregator:
+    """Merge windows sent by `LiveMetrics` of all processes, and output a line
+    per window and the time series to `output_file`.
+
+    `output_file` is written as CSV (a row per window and endpoint), or as a
+    Prometheus textfile (e.g. for the textfile collector of node_exporter)
+    replaced with the latest window if it ends with ".prom".
+
+    Example of a line:
+        live 12:00:03 in_flight=24 create_storyline=105.0/s p50=12.3ms p99=40.1ms errors=0 | ...
+
+    Example:
+        with LiveAggregator(1.0, "live.csv", logger.info) as aggregator:
+            enable_live_metrics(aggregator.channel, 1.0)  # in each process
+            ...
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        output_file: Optional[str] = None,
+        output: Callable[[str], Any] = print,
+    ):
+        """
+        Args:
+            interval (float): seconds of a window, the same as `LiveMetrics`
+            output_file (str, optional): file of the time series (CSV or Prometheus textfile). Defaults to None.
+            output (Callable, optional): a function writing a line, e.g. `logger.info`. Defaults to print.
+        """
+        self.interval = interval
+        self.channel = multiprocessing.Queue()
+        self.__output_file = output_file
+        self.__output = output
+        self.__windows: Dict[int, Dict[str, WindowStats]] = {}
+        # requests in flight at the end of a window, per window and process
+        self.__in_flight: Dict[int, Dict[int, int]] = {}
+        self.__emitted = -1
+        self.__csv_file = None
+        self.__csv_writer = None
+        if output_file is not None and not output_file.endswith(".prom"):
+            self.__csv_file = open(output_file, "a", newline="")
+            self.__csv_writer = csv.writer(self.__csv_file)
+            if self.__csv_file.tell() == 0:
+                self.__csv_writer.writerow(
+                    ["time", "endpoint", "count", "rps"]
+                    + [f"p{percentile:g}_ms" for percentile in LIVE_PERCENTILES]
+                    + ["errors", "in_flight"]
+                )
+        self.__receiver = threading.Thread(target=self.__receive, name="live-aggregator", daemon=True)
+        self.__receiver.start()
+
+    def close(self) -> None:
+        """Emit all windows received, it is to be called after processes sent their windows."""
+        self.channel.put(None)
+        self.__receiver.join()
+        if self.__csv_file is not None:
+            self.__csv_file.close()
+
+    def __receive(self) -> None:
+        while True:
+            try:
+                message = self.channel.get(timeout=self.interval)
+            except queue.Empty:
+                message = ()
+            if message is None:
+                self.__emit(None)
+                return
+            if message:
+                self.__merge(*message)
+            self.__emit(int(time.time() / self.interval) - _GRACE_WINDOWS)
+
+    def __merge(
+        self, pid: int, current: int, in_flight: int, windows: Dict[int, Dict[str, WindowStats]]
+    ) -> None:
+        for window, stats_by_endpoint in windows.items():
+            if window <= self.__emitted:
+                continue  # too late to be emitted
+            merged = self.__windows.setdefault(window, {})
+            for endpoint, stats in stats_by_endpoint.items():
+                merged.setdefault(endpoint, WindowStats()).merge(stats)
+        if current - 1 > self.__emitted:
+            self.__in_flight.setdefault(current - 1, {})[pid] = in_flight
+
+    def __emit(self, until: Optional[int]) -> None:
+        """Emit windows up to `until` (all windows if None)."""
+        windows = sorted(set(self.__windows) | set(self.__in_flight))
+        for window in windows:
+            if until is not None and window > until:
+                break
+            self.__write(
+                window,
+                self.__windows.pop(window, {}),
+                sum(self.__in_flight.pop(window, {}).values()),
+            )
+            self.__emitted = window
+
+    def __write(self, window: int, stats_by_endpoint: Dict[str, WindowStats], in_flight: int) -> None:
+        timestamp = (window + 1) * self.interval
+        line = f"live {time.strftime('%H:%M:%S', time.localtime(timestamp))} in_flight={in_flight}"
+        rows = []
+        for endpoint, stats in sorted(stats_by_endpoint.items()):
+            histogram = stats.histogram
+            rps = histogram.count / self.interval
+            percentiles = [histogram.percentile(percentile) * 1000 for percentile in LIVE_PERCENTILES]
+            line += f" {endpoint}={rps:.1f}/s" + "".join(
+                f" p{percentile:g}={value:.1f}ms" for percentile, value in zip(LIVE_PERCENTILES, percentiles)
+            )
+            line += f" errors={stats.errors} |"
+            rows.append((endpoint, histogram.count, rps, percentiles, stats.errors))
+        self.__output(line.rstrip(" |"))
+
+        if self.__csv_writer is not None:
+            for endpoint, count, rps, percentiles, errors in rows:
+                self.__csv_writer.writerow(
+                    [round(timestamp, 3), endpoint, count, round(rps, 3)]
+                    + [round(value, 3) for value in percentiles]
+                    + [errors, in_flight]
+                )
+            self.__csv_file.flush()
+        elif self.__output_file is not None:
+            self.__write_textfile(rows, in_flight)
+
+    def __write_textfile(self, rows: List[Tuple[str, int, float, List[float], int]], in_flight: int) -> None:
+        lines = [
+            "# HELP storyline_load_requests_per_second Responses per second in the last window.",
+            "# TYPE storyline_load_requests_per_second gauge",
+        ]
+        lines += [f'storyline_load_requests_per_second{{endpoint="{row[0]}"}} {row[2]}' for row in rows]
+        lines += [
+            "# HELP storyline_load_latency_seconds Latency percentiles in the last window.",
+            "# TYPE storyline_load_latency_seconds gauge",
+        ]
+        for endpoint, _, _, percentiles, _ in rows:
+            for percentile, value in zip(LIVE_PERCENTILES, percentiles):
+                lines.append(
+                    f'storyline_load_latency_seconds{{endpoint="{endpoint}",quantile="{percentile / 100:g}"}}'
+                    f" {value / 1000}"
+                )
+        lines += [
+            "# HELP storyline_load_errors_per_second Failed responses per second in the last window.",
+            "# TYPE storyline_load_errors_per_second gauge",
+        ]
+        lines += [
+            f'storyline_load_errors_per_second{{endpoint="{row[0]}"}} {row[4] / self.interval}' for row in rows
+        ]
+        lines += [
+            "# HELP storyline_load_in_flight Requests in flight at the end of the last window.",
+            "# TYPE storyline_load_in_flight gauge",
+            f"storyline_load_in_flight {in_flight}",
+        ]
+
+        # replaced at once, thus a collector never reads a partial file
+        temporary_file = f"{self.__output_file}.{os.getpid()}.tmp"
+        with open(temporary_file, "w") as fp:
+            fp.write("\n".join(lines) + "\n")
+        os.replace(temporary_file, self.__output_file)
+
+    def __enter__(self) -> "LiveAggregator":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
@@ -0,0 +1,122 @@
+from abc import ABC, abstractmethod
+from typing import Iterator, List
+
+# rate is re-evaluated at least once in this interval (in second)
+_TICK = 0.001
+
+
+class LoadProfile(ABC):
+    """Base class of request arrival rate over time for open-loop load.
+
+    Subclasses implement `rate_at` (a subclass without it cannot be
+    instantiated). Requests are scheduled by `send_times`
+    regardless of how long previous requests take.
+    """
+
+    def __init__(self, duration: float):
+        self.duration = duration
+
+    @abstractmethod
+    def rate_at(self, elapsed: float) -> float:
+        """Return the target requests per second at `elapsed` seconds from the start."""
+
+    def send_times(self, scale: float = 1.0) -> Iterator[float]:
+        """Yield intended send time (seconds from the start) of each request.
+
+        Args:
+            scale (float, optional): a factor multiplied to the rate (e.g. 1/4 for each of 4 processes). Defaults to 1.0.
+        """
+        elapsed = 0.0
+        # accumulated fraction of the next request since the last one was sent
+        credit = 0.0
+        while elapsed < self.duration:
+            rate = self.rate_at(elapsed) * scale
+            if rate > 0 and credit + rate * _TICK >= 1:
+                elapsed += (1 - credit) / rate
+                credit = 0.0
+                if elapsed < self.duration:
+                    yield elapsed
+            else:
+                credit += max(rate, 0) * _TICK
+                elapsed += _TICK
+
+    def __repr__(self):
+        return "{}({})".format(
+            self.__class__.__name__,
+            ", ".join(f"{k}={v}" for k, v in sorted(self.__dict__.items())),
+        )
+
+
+class ConstantRate(LoadProfile):
+    """`rps` requests per second for `duration` seconds."""
+
+    def __init__(self, rps: float, duration: float):
+        super().__init__(duration)
+        self.rps = rps
+
+    def rate_at(self, elapsed: float) -> float:
+        return self.rps
+
+
+class RampUp(LoadProfile):
+    """Rate linearly changing from `start_rps` to `end_rps` over `duration` seconds."""
+
+    def __init__(self, start_rps: float, end_rps: float, duration: float):
+        super().__init__(duration)
+        self.start_rps = start_rps
+        self.end_rps = end_rps
+
+    def rate_at(self, elapsed: float) -> float:
+        return self.start_rps + (self.end_rps - self.start_rps) * elapsed / self.duration
+
+
+class Step(LoadProfile):
+    """Rate changing to each of `rps_steps` every `step_duration` seconds.
+
+    Example:
+        Step([100, 200, 300], 60) runs 100 rps for a minute, then 200 rps and 300 rps.
+    """
+
+    def __init__(self, rps_steps: List[float], step_duration: float):
+        super().__init__(len(rps_steps) * step_duration)
+        self.rps_steps = rps_steps
+        self.step_duration = step_duration
+
+    def rate_at(self, elapsed: float) -> float:
+        index = min(int(elapsed // self.step_duration), len(self.rps_steps) - 1)
+        return self.rps_steps[index]
+
+
+class Spike(LoadProfile):
+    """`base_rps` with a burst of `spike_rps` from `spike_start` for `spike_duration` seconds."""
+
+    def __init__(
+        self,
+        base_rps: float,
+        spike_rps: float,
+        duration: float,
+        spike_start: float,
+        spike_duration: float,
+    ):
+        super().__init__(duration)
+        self.base_rps = base_rps
+        self.spike_rps = spike_rps
+        self.spike_start = spike_start
+        self.spike_duration = spike_duration
+
+    def rate_at(self, elapsed: float) -> float:
+        if self.spike_start <= elapsed < self.spike_start + self.spike_duration:
+            return self.spike_rps
+        return self.base_rps
+
+
+class Scaled(LoadProfile):
+    """Rate of `profile` multiplied by `scale` (e.g. the share of a host generating a part of the load)."""
+
+    def __init__(self, profile: LoadProfile, scale: float):
+        super().__init__(profile.duration)
+        self.profile = profile
+        self.scale = scale
+
+    def rate_at(self, elapsed: float) -> float:
+        return self.profile.rate_at(elapsed) * self.scale
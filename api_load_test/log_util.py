@@ -1,26 +1,106 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
 
 from datetime import date
+from typing import Any, Optional
 
 __IS_INITIALIZED = False
 __LOG_FILE_NAME = f'{date.today()}.log'
 __LOGGING_FORMAT = '%(name)-12s %(levelname)-8s %(message)s'
 __LOG_DEFAULT_LEVEL = logging.INFO
+# write the log file as JSON lines (`{date}.jsonl`) instead of text if set to non-zero (e.g. `LOG_JSON=1`)
+__LOG_JSON = os.environ.get('LOG_JSON', '0') not in ('', '0')
+_FILE_BUFFER_SIZE = 1024 * 1024
+
+# records are sent to queues and written by listener threads of the main process
+__handlers = []
+__worker_log_queue: Optional[Any] = None
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Format a record as a JSON object in a line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'name': record.name,
+            'process': record.process,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _BufferedFileHandler(logging.FileHandler):
+    """File handler which writes to a large buffer and flushes only when asked
+    by `_BatchingQueueListener`, instead of after every record.
+    """
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=_FILE_BUFFER_SIZE, encoding=self.encoding)
+
+    def flush(self):
+        pass
+
+    def flush_buffer(self):
+        super().flush()
+
+
+class _BatchingQueueListener(logging.handlers.QueueListener):
+    """Queue listener flushing handlers once the queue is drained, thus records
+    arriving in a burst are written in a batch.
+    """
+
+    def dequeue(self, block: bool):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            self.flush_buffers()
+            return self.queue.get(block)
+
+    def flush_buffers(self):
+        for handler in self.handlers:
+            if isinstance(handler, _BufferedFileHandler):
+                handler.flush_buffer()
+
+    def stop(self):
+        super().stop()
+        self.flush_buffers()
+
+
+def __start_listener(log_queue: Any) -> None:
+    listener = _BatchingQueueListener(log_queue, *__handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
 
 
 def __init_logger():
-    global __IS_INITIALIZED
+    global __IS_INITIALIZED, __handlers
     if __IS_INITIALIZED:
         return
 
-    # ref: https://docs.python.org/3/howto/logging-cookbook.html#logging-to-multiple-destinations
-    # First set the root logger to log to a file
-    logging.basicConfig(
-        level=__LOG_DEFAULT_LEVEL,
-        format='%(asctime)s ' + __LOGGING_FORMAT,
-        datefmt='%Y-%m-%d %H:%M:%S',
-        filename=__LOG_FILE_NAME, # default to append mode
-    )
+    if multiprocessing.parent_process() is not None:
+        # worker processes send records to the main process (see `init_worker_logging`)
+        return
+
+    # ref: https://docs.python.org/3/howto/logging-cookbook.html#logging-to-a-single-file-from-multiple-processes
+    # First set a file handler writing all records
+    if __LOG_JSON:
+        file_handler = _BufferedFileHandler(f'{os.path.splitext(__LOG_FILE_NAME)[0]}.jsonl') # default to append mode
+        file_handler.setFormatter(JsonLinesFormatter())
+    else:
+        file_handler = _BufferedFileHandler(__LOG_FILE_NAME) # default to append mode
+        file_handler.setFormatter(logging.Formatter('%(asctime)s ' + __LOGGING_FORMAT, datefmt='%Y-%m-%d %H:%M:%S'))
 
     # Add handler to stderr
     console = logging.StreamHandler()
@@ -28,40 +108,49 @@ def __init_logger():
     console.setLevel(logging.INFO)
     console.setFormatter(logging.Formatter(__LOGGING_FORMAT))
 
-    root_logger = logging.getLogger('')
-    root_logger.addHandler(console)
+    # handlers are run by the listener thread, thus a log call on the request path costs an enqueue only
+    __handlers = [file_handler, console]
+    log_queue = queue.SimpleQueue()
+    __start_listener(log_queue)
+
+    init_worker_logging(log_queue)
     __IS_INITIALIZED = True
 
 
-def get_logger(name: str) -> logging.Logger:
-    return logging.getLogger(name)
+def get_log_queue() -> Any:
+    """Returns the queue to be passed to `init_worker_logging` of worker
+    processes (None in a worker process).
 
+    The queue is created on the first call, thus the start method of
+    multiprocessing can be set after importing this module.
+    """
+    global __worker_log_queue
+    if __worker_log_queue is None and __IS_INITIALIZED:
+        __worker_log_queue = multiprocessing.Queue()
+        __start_listener(__worker_log_queue)
 
-def is_time_to_log(
-        current_iteration: int,
-        total_count: int,
-        percentile: int = 20) -> bool:
-    """A function to be used to check the periodic logging time.
+    return __worker_log_queue
 
-    It returns true if current_iteration is at specific percentile in progress.
 
-    Args:
-        current_iteration (int): a number to represent current iteration (count from 1)
-        total_count (int): the total number of iterations to run
-        percentile (int, optional): a percentile to notify. Defaults to 20(%).
+def init_worker_logging(log_queue: Any) -> None:
+    """Send records of the current process to log_queue of the main process.
 
-    Returns:
-        bool: true if current_iteration is at specific percentile. If percentile is not in the right range, false would
-            be always returned.
+    It is to be used as an initializer of process pools, e.g.
+    `ProcessPoolExecutor(initializer=init_worker_logging, initargs=(get_log_queue(),))`, otherwise records of the
+    workers are not written.
     """
-    if not 1 <= percentile <= 100:
-        return False
+    if log_queue is None:
+        return
 
-    denominator = int(total_count * (percentile / 100))
-    if denominator == 0:
-        return False
-    else:
-        return current_iteration % denominator == 0
+    root_logger = logging.getLogger('')
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    root_logger.setLevel(__LOG_DEFAULT_LEVEL)
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
 
 
 __init_logger()
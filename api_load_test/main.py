@@ -1,27 +1,138 @@
+import argparse
+import csv
 import requests
+import urllib3
 import concurrent.futures
-
-from datetime import date, datetime, timedelta
-from typing import Any, Callable, List, Optional, Tuple, TypeVar, ParamSpec
-
-from data_template import DataTemplate
-from log_util import get_logger
+import contextlib
+import functools
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from async_engine import (
+    run_async_delete_process,
+    run_async_process,
+    run_open_loop_process,
+)
+from concurrency_controller import AimdController, ConcurrencyLimiter, Saturation
+from data_template import get_data_template
+from instrumentation import enable_trace, get_timings, span, timed, with_timings
+from latency_recorder import (
+    REPORT_PERCENTILES,
+    STATUS_CONNECTION_ERROR,
+    STATUS_TIMEOUT,
+    LatencyRecorder,
+)
+from live_metrics import (
+    LiveAggregator,
+    disable_live_metrics,
+    enable_live_metrics,
+    request_finished,
+    request_started,
+)
+from load_profile import ConstantRate, LoadProfile, RampUp, Spike, Step
+from log_util import get_log_queue, get_logger, init_worker_logging
+from payload_corpus import BodySource, PayloadCorpus, get_payload_corpus
+from retry_policy import RetryPolicy
+from run_journal import (
+    RunJournal,
+    check_journal,
+    get_journal,
+    read_journal,
+    reset_journal,
+)
+from scenario import SWEEP_OUTPUT, SWEEP_PARAMETER, SWEEP_VALUES, Scenario
+from streaming_cleanup import StreamingCleaner
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "progress_reporter")
+)
+from progress_reporter import ProgressReporter
 
 ##############################
 # Configurations
+#   defaults of a run, overridden by a scenario file and `--set` (see `scenario.SCENARIO_KEYS` for the keys)
 ##############################
 
 ##### Parallelism configuration
 NUMBER_OF_PROCESSES = 8
+# "thread": a persistent thread pool per process, "asyncio": an event loop with one pooled HTTP client per process
+ENGINE = "thread"
+ASYNC_CONCURRENCY = 64  # in-flight requests per process (used by "asyncio" engine only)
+# start method of worker processes ("fork", "spawn" or "forkserver", None for the default of the platform)
+#   "forkserver" imports the HTTP clients once in the server process instead of in every worker
+START_METHOD: Optional[str] = None
+#####
+
+##### Concurrency control configuration
+# adapt in-flight workflows of each process from observed latency and errors (AIMD) to find the saturation point
+#   of the service, starting from NUMBER_OF_THREADS ("thread" engine) or ASYNC_CONCURRENCY ("asyncio" engine)
+ADAPTIVE_CONCURRENCY = False
+MAX_CONCURRENCY = 256  # upper limit of in-flight workflows per process
+CONTROL_WINDOW = 1.0  # seconds of completed workflows per adjustment
+LATENCY_TOLERANCE = 2.0  # a window is overloaded if its mean latency exceeds this times the lowest one ...
+MAX_ERROR_RATIO = 0.01  # ... or its ratio of failed workflows exceeds this
+#####
+
+##### Load mode configuration
+# "closed": a next request is sent after a response is received (runs for DAYS_TO_ITERATE dates)
+# "open": requests are sent at LOAD_PROFILE rate regardless of responses (requires "asyncio" engine)
+LOAD_MODE = "closed"
+# total rate of all processes, e.g. RampUp(10, 200, 60), Step([50, 100, 150], 60), Spike(50, 500, 120, 60, 5)
+LOAD_PROFILE: LoadProfile = ConstantRate(rps=100, duration=60)
+#####
+
+##### Clean up configuration
+# delete created storylines while load is running instead of after the whole run
+STREAMING_CLEANUP = False
+CLEANUP_WORKERS = 16  # threads deleting storylines (streaming clean up only)
+CLEANUP_QUEUE_SIZE = 1000  # created ids waiting for deletion, creation is blocked if full
+CLEANUP_BATCH_SIZE = 1  # ids are deleted once this many are gathered ...
+CLEANUP_DELAY = 0.0  # ... and all of them were created at least this seconds before
+CLEANUP_RETRIES = 1  # retries of failed deletions at the end of the run
+# directory of the run journal recording created ids and timings (None to disable)
+#   it enables `--resume` and `--cleanup-from-journal` after a crash
+JOURNAL_DIR: Optional[str] = "journal"
+#####
+
+##### Progress configuration
+PROGRESS_INTERVAL = 10.0  # minimum seconds between progress lines of tasks
+#####
+
+##### Live metrics configuration
+LIVE_INTERVAL = 1.0  # seconds of a window of the live line (throughput, in-flight and latency per endpoint), 0 to disable
+# time series of the windows (None to disable), a CSV or a Prometheus textfile replaced per window if it ends with ".prom"
+LIVE_METRICS_FILE: Optional[str] = None
+#####
+
+##### Instrumentation configuration
+# file to write a Chrome trace (chrome://tracing, Perfetto) of the load generator itself (None to disable)
+TRACE_FILE: Optional[str] = None
+TRACE_MAX_EVENTS = 100_000  # trace events kept per process
 #####
 
 ##### API configuration
 HOST_URL = "http://localhost:8080/storyline-service"
 ACCESS_TOKEN = "some.access.token"
+REQUEST_TIMEOUT: Optional[float] = 30.0  # seconds to connect and to wait for each read of a response (None to wait forever)
+# a request not sent to the service, or a deletion failed with 429/5xx, timeout or connection error is retried ...
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.1  # ... after a random delay up to this (seconds) doubled per retry ...
+RETRY_MAX_BACKOFF = 5.0  # ... up to this
 #####
 
 ##### Input data configuration
 DATA_TEMPLATE_FILENAME = "data_sample.txt"  # file containing POST body data template
+DATA_TEMPLATE_CACHE_SIZE = 0  # number of rendered POST bodies kept per process (useful only if the same bodies are sent repeatedly)
+# file built by payload_corpus.py, varied POST bodies are taken from it instead of DATA_TEMPLATE_FILENAME (None to disable)
+#   a body is rendered for each of DEPENDENT_IDS at each date, thus it must be built with the same configurations
+#   (and more days for open-loop mode, whose dates go on as long as the profile sends requests)
+PAYLOAD_CORPUS: Optional[str] = None
 DEPENDENT_IDS = [411, 412, 413, 414, 415, 416, 417, 418, 419, 420]
 START_DATE = date(2000, 3, 1)
 DAYS_TO_ITERATE = 300  # simulated site size (days are used instead of multiple sites to minimize data preparation)
@@ -41,46 +152,157 @@ API_HEADERS = {
     "Content-Type": "application/json",
 }
 
+RETRY_POLICY = RetryPolicy(REQUEST_TIMEOUT, MAX_RETRIES, RETRY_BACKOFF, RETRY_MAX_BACKOFF)
 
 logger = get_logger(__name__)
 
+# modules imported by the server process of "forkserver" start method, thus workers forked from it do not import them
+_FORKSERVER_PRELOAD = ["requests", "urllib3", "httpx"]
 
-# for generic typing
-P = ParamSpec("P")
-R = TypeVar("R")
+# configurations overridden by `configure`, passed to worker processes as well
+__configurations: Dict[str, Any] = {}
 
+# thread pool of each process kept across tasks, keyed by pid since forked processes inherit the dict
+_thread_pools: Dict[int, concurrent.futures.ThreadPoolExecutor] = {}
 
-# Note: Only top level function can be passed to ProcessPool due to limitation of pickle (i.e. wrapper function cannot apply to functions called by ProcessPoolExecutor)
-#   ref: https://stackoverflow.com/questions/72766345/attributeerror-cant-pickle-local-object-in-multiprocessing/72776044#72776044
-def log_process_time(func: Callable[P, R]) -> Callable[P, R]:
-    """Decorator to log processing time of a `func`
 
-    Args:
-        func (Callable): function to log
+def configure(configurations: Dict[str, Any]) -> None:
+    """Override configurations of this module (e.g. `{"NUMBER_OF_PROCESSES": 4}`,
+    see `Scenario.configurations`) and update the values derived from them.
+
+    Worker processes started after this call run with the same configurations.
     """
+    global NUMBER_OF_THREADS, API_HEADERS, RETRY_POLICY
+    globals().update(configurations)
+    __configurations.update(configurations)
+    NUMBER_OF_THREADS = NUMBER_OF_PROCESSES + 4
+    API_HEADERS = {
+        "Authorization": f"Bearer {ACCESS_TOKEN}",
+        "Content-Type": "application/json",
+    }
+    RETRY_POLICY = RetryPolicy(
+        REQUEST_TIMEOUT, MAX_RETRIES, RETRY_BACKOFF, RETRY_MAX_BACKOFF
+    )
 
-    def wrapper(*args: Any, **kwargs: Any) -> Any:
-        start = datetime.now()
-        result = func(*args, **kwargs)
-        end = datetime.now()
-        logger.info(
-            f"{func.__name__} is executed for {(end - start).total_seconds() * 1000:.3f}ms"
+
+def get_thread_pool() -> concurrent.futures.ThreadPoolExecutor:
+    """Return the thread pool of the current process, created on the first
+    call with enough threads for the largest concurrency limit.
+    """
+    pool = _thread_pools.get(os.getpid())
+    if pool is None:
+        max_workers = max(NUMBER_OF_THREADS, MAX_CONCURRENCY if ADAPTIVE_CONCURRENCY else 0)
+        pool = _thread_pools[os.getpid()] = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers
         )
 
-        return result
+    return pool
+
+
+def new_controller(initial: int) -> AimdController:
+    """Return a concurrency controller starting at `initial` in-flight
+    workflows (fixed at `initial` unless ADAPTIVE_CONCURRENCY).
+    """
+    return AimdController(
+        initial,
+        max(initial, MAX_CONCURRENCY) if ADAPTIVE_CONCURRENCY else initial,
+        window=CONTROL_WINDOW,
+        latency_tolerance=LATENCY_TOLERANCE,
+        max_error_ratio=MAX_ERROR_RATIO,
+        adaptive=ADAPTIVE_CONCURRENCY,
+    )
+
+
+def __init_worker(
+    log_queue: Any,
+    max_trace_events: int,
+    configurations: Dict[str, Any],
+    live_channel: Optional[Any],
+) -> None:
+    """Initializer of worker processes."""
+    init_worker_logging(log_queue)
+    enable_trace(max_trace_events)
+    # a spawned process imports this module again with the defaults
+    configure(configurations)
+    enable_live_metrics(live_channel, LIVE_INTERVAL)
+    # compile the template (or map the corpus) before the first task, tasks only carry its file name
+    get_body_source()
+
+
+def get_body_source() -> BodySource:
+    """Return PAYLOAD_CORPUS (if configured) or the template of
+    DATA_TEMPLATE_FILENAME, loaded once per process.
+    """
+    if PAYLOAD_CORPUS:
+        return get_payload_corpus(PAYLOAD_CORPUS)
+    return get_data_template(DATA_TEMPLATE_FILENAME, DATA_TEMPLATE_CACHE_SIZE)
+
+
+def _is_connect_error(error: requests.ConnectionError) -> bool:
+    """Return whether `error` happened before the request was sent."""
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
 
-    return wrapper
 
+def post_with_retry(
+    endpoint: str, url: str, recorder: LatencyRecorder, idempotent: bool, **kwargs: Any
+) -> Tuple[int, Optional[requests.Response], int]:
+    """Post to `url` with REQUEST_TIMEOUT, retrying by RETRY_POLICY, and record
+    each attempt as `endpoint` to `recorder`.
 
-def create_storyline(dependent_id: int, target_date: date) -> Optional[int]:
+    Errors without a response are recorded and returned as pseudo status codes,
+    thus they do not stop the other requests.
+
+    Return a tuple containing the status code of the last attempt
+    (STATUS_TIMEOUT or STATUS_CONNECTION_ERROR without a response), the
+    response (None without a response) and the number of attempts.
+    """
+    attempt = 0
+    while True:
+        request_started()
+        start = time.perf_counter()
+        response = None
+        try:
+            response = requests.post(
+                url=url, headers=API_HEADERS, timeout=RETRY_POLICY.timeout, **kwargs
+            )
+            status_code = response.status_code
+            sent = True
+        except requests.ConnectTimeout:
+            status_code, sent = STATUS_TIMEOUT, False
+        except requests.Timeout:
+            status_code, sent = STATUS_TIMEOUT, True
+        except requests.ConnectionError as e:
+            status_code, sent = STATUS_CONNECTION_ERROR, not _is_connect_error(e)
+        elapsed = time.perf_counter() - start
+        recorder.record(endpoint, status_code, elapsed)
+        request_finished(endpoint, status_code, elapsed)
+
+        if not RETRY_POLICY.should_retry(attempt, status_code, idempotent, sent):
+            return status_code, response, attempt + 1
+        time.sleep(RETRY_POLICY.delay(attempt))
+        attempt += 1
+
+
+def create_storyline(
+    dependent_id: int,
+    target_date: date,
+    recorder: LatencyRecorder,
+    journal: Optional[RunJournal] = None,
+) -> Optional[int]:
     """Call Api to create Storyline.
 
+    Created storyline is recorded to `journal` (if given).
+
     None would be returned if API call is failed.
     """
     url = f"{HOST_URL}/v3/internal/storylines"
-    response = requests.post(
-        url=url,
-        headers=API_HEADERS,
+    # creation is not idempotent, thus it is retried only if it was not sent
+    status_code, response, _ = post_with_retry(
+        "create_storyline",
+        url,
+        recorder,
+        idempotent=False,
         json={
             "date": target_date.strftime("%Y-%m-%d"),
             "dependentId": dependent_id,
@@ -88,190 +310,734 @@ def create_storyline(dependent_id: int, target_date: date) -> Optional[int]:
     )
 
     storyline_id = None
-    if response.status_code == 201:
+    if status_code == 201:
         storyline_id = response.json()["data"]["id"]
+        if journal is not None:
+            journal.created(storyline_id, dependent_id, target_date)
 
     return storyline_id
 
 
-def create_stories(storyline_id: int, json: Any) -> Tuple[int, float]:
-    """Call API to create stories under `storyline_id`.
+def create_stories(
+    storyline_id: int, body: Union[bytes, memoryview], recorder: LatencyRecorder
+) -> int:
+    """Call API to create stories under `storyline_id` with JSON `body`
+    (a memoryview is sent without copying).
 
-    Return a tuple containing status code and a processing time in second.
+    Return the status code (STATUS_TIMEOUT or STATUS_CONNECTION_ERROR without a
+    response).
     """
-    # add redundancy (log_process_time) due to ProcessPoolExecutor limitation
-    start = datetime.now()
-
     url = f"{HOST_URL}/v3/internal/storylines/{storyline_id}/stories/create-bulk"
+    status_code, _, _ = post_with_retry(
+        "create_stories", url, recorder, idempotent=False, data=body
+    )
 
-    response = requests.post(url=url, headers=API_HEADERS, json=json)
-
-    end = datetime.now()
-
-    return response.status_code, (end - start).total_seconds()
+    return status_code
 
 
+@timed()
 def create_storyline_data(
-    dependent_id: int, target_date: date, data_template: DataTemplate
-) -> Tuple[Optional[int], float | None]:
+    dependent_id: int,
+    target_date: date,
+    data_template: BodySource,
+    recorder: LatencyRecorder,
+    cleanup_queue: Optional[Any] = None,
+    journal: Optional[RunJournal] = None,
+    limiter: Optional[ConcurrencyLimiter] = None,
+) -> Optional[int]:
     """Call create storyline and stories API in sequence.
 
-    Return a tuple containing storyline_id (None if failed on creating) and
-    stories creation time in second.
-    """
-    storyline_id = create_storyline(dependent_id, target_date)
-    process_time = None
-
-    if storyline_id:
-        code, process_time = create_stories(
-            storyline_id=storyline_id,
-            json=data_template.get_json(
-                dependent_id=dependent_id, target_date=target_date.strftime("%Y-%m-%d")
-            ),
-        )
+    Created storyline id is put to `cleanup_queue` (if given) to be deleted by
+    streaming clean up, and recorded to `journal` (if given). `limiter` (if
+    given) is acquired by the caller, and released with the duration and the
+    outcome of the workflow.
 
-        if code != 201:
-            logger.info(f"Fail on creating stories for storyline (id:{storyline_id})")
-    else:
-        logger.info(
-            f"Fail on creating storyline for dependent ({dependent_id}) at {target_date}"
-        )
+    Return storyline_id (None if failed on creating).
+    """
+    start = time.perf_counter()
+    ok = False
+    try:
+        storyline_id = create_storyline(dependent_id, target_date, recorder, journal)
+
+        if storyline_id:
+            with span("render_body"):
+                body = data_template.get_bytes(
+                    dependent_id=dependent_id, target_date=target_date.strftime("%Y-%m-%d")
+                )
+            code = create_stories(storyline_id=storyline_id, body=body, recorder=recorder)
+            ok = code == 201
+
+            if code != 201:
+                logger.info(f"Fail on creating stories for storyline (id:{storyline_id})")
+            if cleanup_queue is not None:
+                with span("cleanup_queue_put"):
+                    cleanup_queue.put((storyline_id, time.time()))
+        else:
+            logger.info(
+                f"Fail on creating storyline for dependent ({dependent_id}) at {target_date}"
+            )
+    finally:
+        if limiter is not None:
+            limiter.release(time.perf_counter() - start, ok)
 
-    return storyline_id, process_time
+    return storyline_id
 
 
+@with_timings
 def run_process(
-    target_date: date, data_template: DataTemplate
-) -> List[Tuple[Optional[int], float | None]]:
-    """Create storyline for all dependents at `target_date`.
-
-    Return a list containing tuple of created storyline id (None if failed on
-    creating) and stories creation time in second.
+    target_dates: List[date],
+    data_template: BodySource,
+    controller: AimdController,
+    cleanup_queue: Optional[Any] = None,
+    journal_dir: Optional[str] = None,
+) -> Tuple[List[Optional[int]], LatencyRecorder, Optional[Saturation]]:
+    """Create storyline for all dependents at every date in `target_dates` on
+    the thread pool of the process (see `get_thread_pool`).
+
+    Workflows are submitted as soon as the limit of `controller` allows, thus
+    dates overlap instead of waiting for the slowest workflow of each date.
+    Created ids and timings are recorded to the run journal in `journal_dir`
+    (if given), and each date is marked as done once all of its workflows are
+    handled.
+
+    Return a tuple containing a list of created storyline id (None if failed on
+    creating), latencies recorded in the process and the saturation point
+    found by `controller`.
 
     Return value example:
-        [(1, 0.53), (2, 0.50), (3, 0.49)]
+        ([1, 2, None], <LatencyRecorder>, <Saturation>)
     """
-    logger.info(f"===Running threads to create storyline at {target_date}===")
-    with concurrent.futures.ThreadPoolExecutor(
-        max_workers=NUMBER_OF_THREADS
-    ) as executor:
-        futures = [
-            executor.submit(
-                create_storyline_data, dependent_id, target_date, data_template
+    logger.info(f"===Running threads to create storyline at {len(target_dates)} dates===")
+    recorder = LatencyRecorder()
+    journal = None
+    if journal_dir is not None:
+        journal = get_journal(journal_dir)
+        recorder.add_listener(journal.timing)
+
+    executor = get_thread_pool()
+    limiter = ConcurrencyLimiter(controller)
+    futures_by_date = []
+    for target_date in target_dates:
+        futures = []
+        for dependent_id in DEPENDENT_IDS:
+            limiter.acquire()
+            futures.append(
+                executor.submit(
+                    create_storyline_data,
+                    dependent_id,
+                    target_date,
+                    data_template,
+                    recorder,
+                    cleanup_queue,
+                    journal,
+                    limiter,
+                )
             )
-            for dependent_id in DEPENDENT_IDS
-        ]
+        futures_by_date.append((target_date, futures))
+
+    result = []
+    for target_date, futures in futures_by_date:
+        result.extend(f.result() for f in futures)
+        if journal is not None:
+            journal.date_done(target_date)
 
-        result = [f.result() for f in concurrent.futures.as_completed(futures)]
+    if journal is not None:
+        journal.flush()
 
-    return result
+    return result, recorder, controller.saturation()
 
 
 def __extract_result(
-    results: List[List[Tuple[int | None, float | None]]],
-) -> Tuple[List[List[int]], List[float]]:
-    """From `result` extract a nested list of storyline ids, and a flat list of process time.
+    results: List[Tuple[List[Optional[int]], LatencyRecorder, Optional[Saturation]]],
+) -> Tuple[List[List[int]], LatencyRecorder, Optional[Saturation]]:
+    """From `result` extract a nested list of storyline ids, a merged latency
+    recorder and the saturation points summed up over processes.
 
     Return value example:
-        ([1, 2, 3], [0.53, 0.50, 0.49])
+        ([[1, 2], [3]], <LatencyRecorder>, <Saturation>)
     """
     # keep the original structure of nested list such that it can be clean up with multi-process
     storyline_ids = []
-    # make a flat list with not None data only
-    stories_creation_time = []
-    # results contains List[List[Tuple]] (one nested result per process)
-    for result in results:
-        ids_in_process = []
-        for item in result:
-            if item[0] is not None:
-                ids_in_process.append(item[0])
-            if item[1] is not None:
-                stories_creation_time.append(item[1])
+    recorder = LatencyRecorder()
+    saturation = None
+    # results contains one tuple per process
+    for ids, process_recorder, process_saturation in results:
+        storyline_ids.append([id for id in ids if id is not None])
+        recorder.merge(process_recorder)
+        if process_saturation is None:
+            continue
+        if saturation is None:
+            saturation = process_saturation
+        else:
+            saturation.merge(process_saturation)
+
+    return storyline_ids, recorder, saturation
+
+
+@timed(log=logger.info)
+def main(resume: bool = False) -> List[List[int]]:
+    """Run the load and return a nested list of storyline ids to be deleted.
+
+    If `resume` is True, dates completed in the run journal are skipped and
+    storylines left by the previous run are returned to be deleted as well.
+    """
+    storyline_ids, _, _ = run_load(resume)
+
+    return storyline_ids
 
-        storyline_ids.append(ids_in_process)
 
-    return storyline_ids, stories_creation_time
+def run_load(
+    resume: bool = False,
+    keep_journal: bool = False,
+) -> Tuple[List[List[int]], LatencyRecorder, float]:
+    """Run the load (see `main`).
 
+    If `keep_journal` is True, the run is appended to the run journal instead
+    of resetting it, e.g. by later points of a sweep such that storylines left
+    by an earlier point are kept in the journal.
 
-@log_process_time
-def main() -> List[List[int]]:
+    Return a tuple containing a nested list of storyline ids to be deleted,
+    latencies merged from all processes and elapsed seconds of the load.
+    """
     logger.info("=====Starting main=====")
+    if LOAD_MODE == "open" and ENGINE != "asyncio":
+        raise ValueError('Open-loop load mode is only supported by "asyncio" engine')
+    if resume and (JOURNAL_DIR is None or LOAD_MODE == "open"):
+        raise ValueError("Resume requires JOURNAL_DIR and closed-loop load mode")
+
     date_list = [START_DATE + timedelta(days=i) for i in range(DAYS_TO_ITERATE)]
-    data_template = DataTemplate(DATA_TEMPLATE_FILENAME)
+    data_template = get_body_source()
+    if isinstance(data_template, PayloadCorpus):
+        __check_corpus(data_template, date_list)
+
+    left_ids = []
+    if resume:
+        state = read_journal(JOURNAL_DIR)
+        left_ids = state.orphaned_ids
+        date_list = [d for d in date_list if d.isoformat() not in state.done_dates]
+        logger.info(
+            f"Resuming from journal: {DAYS_TO_ITERATE - len(date_list)} dates are done,"
+            f" {len(left_ids)} storylines are left to be deleted"
+        )
+    elif JOURNAL_DIR is not None and not keep_journal:
+        reset_journal(JOURNAL_DIR)
+
+    with contextlib.ExitStack() as stack:
+        live_channel = stack.enter_context(__live_metrics())
+        cleanup_queue = None
+        cleaner = None
+        if STREAMING_CLEANUP:
+            manager = stack.enter_context(multiprocessing.Manager())
+            cleanup_queue = manager.Queue(CLEANUP_QUEUE_SIZE)
+            delete_func = delete_storyline
+            if JOURNAL_DIR is not None:
+                delete_func = functools.partial(
+                    delete_storyline, journal=get_journal(JOURNAL_DIR)
+                )
+            cleaner = StreamingCleaner(
+                cleanup_queue,
+                delete_func,
+                CLEANUP_WORKERS,
+                CLEANUP_BATCH_SIZE,
+                CLEANUP_DELAY,
+            )
 
-    with concurrent.futures.ProcessPoolExecutor(
-        max_workers=NUMBER_OF_PROCESSES
-    ) as executor:
-        futures = [
-            executor.submit(run_process, target_date, data_template)
-            for target_date in date_list
-        ]
-        results = [f.result() for f in concurrent.futures.as_completed(futures)]
+        start = time.perf_counter()
+        results = __run_load(date_list, data_template, cleanup_queue, live_channel)
+        elapsed = time.perf_counter() - start
 
-    number_of_storylines = DAYS_TO_ITERATE * len(DEPENDENT_IDS)
-    logger.info(f"Finished creating {number_of_storylines} storylines")
+        if cleaner is not None:
+            failed_ids = cleaner.close(CLEANUP_RETRIES)
+            if JOURNAL_DIR is not None:
+                get_journal(JOURNAL_DIR).flush()
 
-    storyline_ids, stories_creation_time_list = __extract_result(results)
+    number_of_storylines = sum(len(ids) for ids, _, _ in results)
+    storyline_ids, recorder, saturation = __extract_result(results)
 
-    average_time_str = "N/A"
-    if len(stories_creation_time_list) > 0:
-        # calculate average time in ms
-        average_time_str = (
-            f"{sum(stories_creation_time_list) / number_of_storylines * 1000:.3f}"
+    logger.info(
+        f"Finished creating {sum(len(ids) for ids in storyline_ids)}/{number_of_storylines} storylines"
+    )
+    for line in recorder.report(elapsed):
+        logger.info(line)
+    if saturation is not None:
+        logger.info(
+            f"Concurrency of {NUMBER_OF_PROCESSES} processes"
+            f" ({'adaptive' if ADAPTIVE_CONCURRENCY else 'fixed'}): {saturation}"
         )
 
-    logger.info(f"Average time on the creating stories API: {average_time_str}ms")
+    if cleaner is not None:
+        for line in cleaner.recorder.report():
+            logger.info(line)
+        # only ids failed on streaming clean up are left to be deleted
+        storyline_ids = [failed_ids]
 
-    return storyline_ids
+    if left_ids:
+        storyline_ids.append(left_ids)
+
+    return storyline_ids, recorder, elapsed
+
+
+def __check_corpus(corpus: PayloadCorpus, date_list: List[date]) -> None:
+    """Check that `corpus` has the bodies of all DEPENDENT_IDS at all dates of
+    the load, thus the load does not fail on the way.
+
+    Raises:
+        ValueError: if a body is missing
+    """
+    if LOAD_MODE == "open":
+        # each process takes every NUMBER_OF_PROCESSES-th date as long as its share of the profile sends requests
+        number_of_requests = sum(1 for _ in LOAD_PROFILE.send_times(1 / NUMBER_OF_PROCESSES))
+        dates_per_process = -(-number_of_requests // len(DEPENDENT_IDS))
+        date_list = [
+            START_DATE + timedelta(days=i + NUMBER_OF_PROCESSES * k)
+            for i in range(NUMBER_OF_PROCESSES)
+            for k in range(dates_per_process)
+        ]
+
+    if any((id, d) not in corpus for id in DEPENDENT_IDS for d in date_list):
+        days = (max(date_list) - START_DATE).days + 1
+        raise ValueError(
+            f"{PAYLOAD_CORPUS} does not have bodies of all DEPENDENT_IDS in {days} days from START_DATE,"
+            f" build it with them (e.g. payload_corpus.py --start-date {START_DATE} --days {days})"
+        )
 
 
-def delete_storyline(id: int) -> Optional[int]:
+def __run_load(
+    date_list: List[date],
+    data_template: BodySource,
+    cleanup_queue: Optional[Any],
+    live_channel: Optional[Any],
+) -> List[Tuple[List[Optional[int]], LatencyRecorder, Optional[Saturation]]]:
+    """Run configured load on worker processes and return results of each task."""
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=NUMBER_OF_PROCESSES,
+        initializer=__init_worker,
+        initargs=(
+            get_log_queue(),
+            TRACE_MAX_EVENTS if TRACE_FILE else 0,
+            __configurations,
+            live_channel,
+        ),
+    ) as executor:
+        if LOAD_MODE == "open":
+            # each process takes every NUMBER_OF_PROCESSES-th date to avoid duplicated storylines
+            futures = [
+                executor.submit(
+                    run_open_loop_process,
+                    LOAD_PROFILE,
+                    1 / NUMBER_OF_PROCESSES,
+                    START_DATE + timedelta(days=i),
+                    NUMBER_OF_PROCESSES,
+                    DEPENDENT_IDS,
+                    data_template,
+                    HOST_URL,
+                    API_HEADERS,
+                    ASYNC_CONCURRENCY,
+                    cleanup_queue,
+                    JOURNAL_DIR,
+                    RETRY_POLICY,
+                )
+                for i in range(NUMBER_OF_PROCESSES)
+            ]
+        elif ENGINE == "asyncio":
+            # one long running event loop per process instead of one task per date
+            futures = [
+                executor.submit(
+                    run_async_process,
+                    date_list[i::NUMBER_OF_PROCESSES],
+                    DEPENDENT_IDS,
+                    data_template,
+                    HOST_URL,
+                    API_HEADERS,
+                    new_controller(ASYNC_CONCURRENCY),
+                    cleanup_queue,
+                    JOURNAL_DIR,
+                    RETRY_POLICY,
+                )
+                for i in range(min(NUMBER_OF_PROCESSES, len(date_list)))
+            ]
+        else:
+            # one long running task per process on its persistent thread pool
+            futures = [
+                executor.submit(
+                    run_process,
+                    date_list[i::NUMBER_OF_PROCESSES],
+                    data_template,
+                    new_controller(NUMBER_OF_THREADS),
+                    cleanup_queue,
+                    JOURNAL_DIR,
+                )
+                for i in range(min(NUMBER_OF_PROCESSES, len(date_list)))
+            ]
+
+        return __collect_results(futures, "Load tasks")
+
+
+@contextlib.contextmanager
+def __live_metrics() -> Iterator[Optional[Any]]:
+    """Aggregate live metrics of this process and worker processes while in
+    the context (see `live_metrics`), and yield the channel to be passed to
+    the workers (None if disabled).
+    """
+    if not LIVE_INTERVAL:
+        yield None
+        return
+
+    with LiveAggregator(LIVE_INTERVAL, LIVE_METRICS_FILE, logger.info) as aggregator:
+        enable_live_metrics(aggregator.channel, LIVE_INTERVAL)
+        try:
+            yield aggregator.channel
+        finally:
+            disable_live_metrics()
+
+
+def __collect_results(
+    futures: List[concurrent.futures.Future], name: str
+) -> List[Any]:
+    """Wait for `futures` logging progress of finished ones, and return their
+    results in the order of completion.
+
+    Tasks are decorated by `with_timings`, thus their timings are merged to the
+    timings of this process.
+    """
+    results = []
+    timings = get_timings()
+    with ProgressReporter(
+        len(futures), name=name, interval=PROGRESS_INTERVAL, output=logger.info
+    ) as progress:
+        for f in concurrent.futures.as_completed(futures):
+            result, task_timings = f.result()
+            results.append(result)
+            timings.merge(task_timings)
+            progress.update()
+
+    return results
+
+
+def delete_storyline(
+    id: int,
+    recorder: LatencyRecorder,
+    journal: Optional[RunJournal] = None,
+    missing_ok: bool = False,
+) -> Optional[int]:
     """Delete storyline having `id` and its associated data.
 
+    Deleted storyline is recorded to `journal` (if given). A storyline not
+    found is regarded as deleted if `missing_ok`.
+
     Return `id` if it failed to delete.
     """
     url = f"{HOST_URL}/v3/internal/storylines/{id}/unsafe-delete"
-    response = requests.post(url=url, headers=API_HEADERS)
+    status_code, _, attempts = post_with_retry(
+        "delete_storyline", url, recorder, idempotent=True
+    )
 
-    if response.status_code != 204:
+    # a retried deletion may find the storyline deleted by the previous attempt
+    if status_code != 204 and not (status_code == 404 and (missing_ok or attempts > 1)):
         return id
 
+    if journal is not None:
+        journal.deleted(id)
+
 
-def run_delete_process(storyline_ids: List[int]) -> List[int]:
-    """Run `delete_storyline` using threads.
+@with_timings
+def run_delete_process(
+    storyline_ids: List[int],
+    journal_dir: Optional[str] = None,
+    missing_ok: bool = False,
+) -> Tuple[List[int], LatencyRecorder]:
+    """Run `delete_storyline` using the thread pool of the process.
 
-    Returns list of storyline ids failed on deletion.
+    Deleted ids are recorded to the run journal in `journal_dir` (if given).
+    Storylines not found are regarded as deleted if `missing_ok`.
+
+    Returns list of storyline ids failed on deletion and latencies recorded in
+    the process.
+    """
+    recorder = LatencyRecorder()
+    journal = get_journal(journal_dir) if journal_dir is not None else None
+    executor = get_thread_pool()
+    # the pool can be larger for adaptive concurrency, deletions are kept at NUMBER_OF_THREADS
+    semaphore = threading.Semaphore(NUMBER_OF_THREADS)
+    futures = []
+    for id in storyline_ids:
+        semaphore.acquire()
+        future = executor.submit(delete_storyline, id, recorder, journal, missing_ok)
+        future.add_done_callback(lambda _: semaphore.release())
+        futures.append(future)
+    results = [f.result() for f in concurrent.futures.as_completed(futures)]
+
+    if journal is not None:
+        journal.flush()
+
+    return [id for id in results if id is not None], recorder
+
+
+@timed(log=logger.info)
+def clean_up(
+    storyline_ids_list: List[List[int]],
+    engine: Optional[str] = None,
+    missing_ok: bool = False,
+) -> Tuple[List[int], LatencyRecorder]:
+    """Delete storylines with id in `storyline_ids_list`
+
+    `engine` overrides ENGINE configuration if given. Storylines not found are
+    regarded as deleted if `missing_ok` (e.g. deleted by others since the run
+    journal is written).
+
+    Return a tuple containing ids failed to delete and latencies of the deletions.
     """
-    with concurrent.futures.ThreadPoolExecutor(
-        max_workers=NUMBER_OF_THREADS
+    start = time.perf_counter()
+    with __live_metrics() as live_channel, concurrent.futures.ProcessPoolExecutor(
+        max_workers=NUMBER_OF_THREADS,
+        initializer=__init_worker,
+        initargs=(
+            get_log_queue(),
+            TRACE_MAX_EVENTS if TRACE_FILE else 0,
+            __configurations,
+            live_channel,
+        ),
     ) as executor:
-        futures = [executor.submit(delete_storyline, id) for id in storyline_ids]
-        results = [f.result() for f in concurrent.futures.as_completed(futures)]
+        if (engine or ENGINE) == "asyncio":
+            futures = [
+                executor.submit(
+                    run_async_delete_process,
+                    lst,
+                    HOST_URL,
+                    API_HEADERS,
+                    ASYNC_CONCURRENCY,
+                    JOURNAL_DIR,
+                    RETRY_POLICY,
+                    missing_ok,
+                )
+                for lst in storyline_ids_list
+                if lst
+            ]
+        else:
+            futures = [
+                executor.submit(run_delete_process, lst, JOURNAL_DIR, missing_ok)
+                for lst in storyline_ids_list
+                if lst
+            ]
+        results = __collect_results(futures, "Clean up tasks")
+    elapsed = time.perf_counter() - start
+
+    # results is a list containing list of ids and recorder returned from each process
+    failed_ids = []
+    recorder = LatencyRecorder()
+    for ids, process_recorder in results:
+        failed_ids.extend(ids)
+        recorder.merge(process_recorder)
+
+    for line in recorder.report(elapsed):
+        logger.info(line)
+    logger.info(f"All storylines are deleted except ids: {failed_ids}")
+
+    return failed_ids, recorder
+
+
+def init_start_method() -> None:
+    """Set START_METHOD (if configured) of worker processes, it is to be called
+    before starting any process.
+    """
+    if START_METHOD:
+        multiprocessing.set_start_method(START_METHOD)
+        if START_METHOD == "forkserver":
+            multiprocessing.set_forkserver_preload(_FORKSERVER_PRELOAD)
 
-    return [id for id in results if id is not None]
 
+def report_timings() -> None:
+    """Log timings of the load generator merged from all processes, and write
+    them to TRACE_FILE (if configured).
+    """
+    timings = get_timings()
+    logger.info("=====Timings of the load generator=====")
+    for line in timings.report():
+        logger.info(line)
+    if TRACE_FILE:
+        timings.dump_trace(TRACE_FILE)
+        logger.info(f"Trace is written to {TRACE_FILE}")
+
+
+def sweep(scenario: Scenario) -> List[Dict[str, Any]]:
+    """Run the load (and clean up) once per value of the sweep parameter of
+    `scenario`, e.g. a matrix of concurrency levels, and write throughput and
+    latency percentiles per endpoint of each run to the sweep output (CSV).
+
+    The parameter defaults to `parallelism.async_concurrency` for the asyncio
+    engine, `parallelism.processes` otherwise. The run journal is reset by the
+    first run only, thus storylines which a run fails to delete are left in
+    the journal for `cleanup_from_journal` instead of stopping later runs.
+
+    Return rows of the throughput-vs-latency curve.
+    """
+    parameter = scenario.get(SWEEP_PARAMETER) or (
+        "parallelism.async_concurrency"
+        if ENGINE == "asyncio"
+        else "parallelism.processes"
+    )
+    rows = []
+    for i, value in enumerate(scenario.sweep_values()):
+        logger.info(f"=====Sweeping {parameter}={value}=====")
+        scenario.set(parameter, value)
+        configure(scenario.configurations())
+        storyline_ids, recorder, elapsed = run_load(keep_journal=i > 0)
+        clean_up(storyline_ids)
+
+        for endpoint, histogram in sorted(recorder.histograms.items()):
+            errors = sum(
+                count
+                for code, count in recorder.status_codes[endpoint].items()
+                if not 200 <= code < 300
+            )
+            rows.append(
+                {
+                    "parameter": parameter,
+                    "value": value,
+                    "endpoint": endpoint,
+                    "count": histogram.count,
+                    "throughput": round(histogram.count / elapsed, 3),
+                    "mean_ms": round(histogram.mean() * 1000, 3),
+                    **{
+                        f"p{percentile:g}_ms": round(
+                            histogram.percentile(percentile) * 1000, 3
+                        )
+                        for percentile in REPORT_PERCENTILES
+                    },
+                    "max_ms": histogram.max / 1000,
+                    "errors": errors,
+                }
+            )
 
-@log_process_time
-def clean_up(storyline_ids_list: List[List[int]]) -> None:
-    """Delete storylines with id in `storyline_ids_list`"""
-    with concurrent.futures.ProcessPoolExecutor(
-        max_workers=NUMBER_OF_THREADS
-    ) as executor:
-        futures = [
-            executor.submit(run_delete_process, lst) for lst in storyline_ids_list
-        ]
-        results = [f.result() for f in concurrent.futures.as_completed(futures)]
+    logger.info("=====Throughput vs latency=====")
+    for row in rows:
+        logger.info(
+            f"{row['parameter']}={row['value']} {row['endpoint']}:"
+            f" throughput={row['throughput']}/s p50={row['p50_ms']}ms p99={row['p99_ms']}ms"
+            f" errors={row['errors']}"
+        )
 
-    # results is a list containing list of ids returned from each process
-    logger.info(
-        f"All storylines are deleted except ids: {[item for result in results for item in result]}"
+    if JOURNAL_DIR is not None:
+        orphaned_ids = read_journal(JOURNAL_DIR).orphaned_ids
+        if orphaned_ids:
+            logger.warning(
+                f"{len(orphaned_ids)} storylines are left not deleted in {JOURNAL_DIR},"
+                " run with --cleanup-from-journal to delete them"
+            )
+
+    output = scenario.get(SWEEP_OUTPUT)
+    if output and rows:
+        with open(output, "w", newline="") as fp:
+            writer = csv.DictWriter(fp, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        logger.info(f"Sweep result is written to {output}")
+
+    return rows
+
+
+def cleanup_from_journal() -> None:
+    """Delete storylines created but not deleted according to the run journal
+    (e.g. left by a crashed run), using the asyncio engine on all processes.
+
+    Storylines already gone from the service are regarded as deleted, thus
+    they are not left in the journal.
+    """
+    if JOURNAL_DIR is None:
+        raise ValueError("JOURNAL_DIR is not configured")
+
+    orphaned_ids = read_journal(JOURNAL_DIR).orphaned_ids
+    logger.info(f"Deleting {len(orphaned_ids)} storylines found in {JOURNAL_DIR}")
+    clean_up(
+        [orphaned_ids[i::NUMBER_OF_PROCESSES] for i in range(NUMBER_OF_PROCESSES)],
+        engine="asyncio",
+        missing_ok=True,
     )
 
 
+def discard_journal() -> None:
+    """Remove the run journal, storylines left in it are not deleted (e.g.
+    they are known to be deleted in another way).
+    """
+    if JOURNAL_DIR is None:
+        raise ValueError("JOURNAL_DIR is not configured")
+
+    orphaned_ids = read_journal(JOURNAL_DIR).orphaned_ids
+    reset_journal(JOURNAL_DIR, force=True)
+    logger.info(f"Removed the journal in {JOURNAL_DIR} leaving {len(orphaned_ids)} storylines not deleted")
+
+
 if __name__ == "__main__":
-    # for i in range(5):
-    #     logger.info(f"==========Iteration: {i}==========")
-    results = main()
-    # clean up created storylines
-    logger.info("=====Deleting storylines=====")
-    clean_up(results)
+    parser = argparse.ArgumentParser(description="Load test of storyline service")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip dates completed in the run journal and delete storylines left by the previous run",
+    )
+    parser.add_argument(
+        "--cleanup-from-journal",
+        action="store_true",
+        help="only delete storylines left in the run journal",
+    )
+    parser.add_argument(
+        "--discard-journal",
+        action="store_true",
+        help="only remove the run journal without deleting storylines left in it",
+    )
+    parser.add_argument(
+        "--scenario",
+        metavar="FILE",
+        help="scenario file (TOML) overriding configurations",
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="override a scenario key, e.g. --set parallelism.processes=16 (repeatable)",
+    )
+    parser.add_argument(
+        "--sweep",
+        metavar="VALUES",
+        help="comma separated values of the sweep parameter, e.g. --sweep 8,16,32,64",
+    )
+    args = parser.parse_args()
+
+    try:
+        scenario = Scenario.load(args.scenario) if args.scenario else Scenario()
+        for override in args.set:
+            scenario.set_override(override)
+        if args.sweep:
+            scenario.set_override(f"{SWEEP_VALUES}=[{args.sweep}]")
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    configure(scenario.configurations())
+
+    if (
+        JOURNAL_DIR is not None
+        and not (args.resume or args.cleanup_from_journal or args.discard_journal)
+    ):
+        # fail before starting any process rather than with a traceback of run_load
+        try:
+            check_journal(JOURNAL_DIR)
+        except RuntimeError as e:
+            parser.exit(1, f"{parser.prog}: error: {e}\n")
+
+    init_start_method()
+    if TRACE_FILE:
+        enable_trace(TRACE_MAX_EVENTS)
+
+    if args.cleanup_from_journal:
+        cleanup_from_journal()
+    elif args.discard_journal:
+        discard_journal()
+    elif scenario.sweep_values():
+        sweep(scenario)
+    else:
+        # for i in range(5):
+        #     logger.info(f"==========Iteration: {i}==========")
+        results = main(resume=args.resume)
+        # clean up created storylines
+        logger.info("=====Deleting storylines=====")
+        clean_up(results)
+    report_timings()
@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import itertools
+import math
+import multiprocessing
+import random
+import re
+import signal
+import socket
+import sys
+
+from typing import Callable, List, Optional, Tuple
+
+from log_util import get_logger
+
+
+logger = get_logger(__name__)
+
+# storyline API paths under any prefix (e.g. `/storyline-service`)
+_CREATE_STORYLINE = re.compile(rb"/v3/internal/storylines/?$")
+_CREATE_STORIES = re.compile(rb"/v3/internal/storylines/\d+/stories/create-bulk/?$")
+_DELETE_STORYLINE = re.compile(rb"/v3/internal/storylines/\d+/unsafe-delete/?$")
+
+_REASONS = {200: b"OK", 201: b"Created", 204: b"No Content", 404: b"Not Found"}
+
+
+class LatencyDistribution:
+    """Random response delay of the mock server in seconds.
+
+    Distributions are given as `name:parameters` in milliseconds:
+        constant:20              always 20ms
+        uniform:10,50            between 10ms and 50ms
+        exponential:20           mean of 20ms
+        lognormal:20,0.5         median of 20ms with sigma 0.5 (long tail)
+    """
+
+    def __init__(self, name: str, sample: Callable[[], float]):
+        self.name = name
+        self.sample = sample
+
+    @classmethod
+    def parse(cls, text: str) -> "LatencyDistribution":
+        """
+        Raises:
+            ValueError: if the distribution is unknown or the parameters are invalid
+        """
+        name, _, parameters = text.partition(":")
+        try:
+            values = [float(p) for p in parameters.split(",") if p]
+            if name == "constant" and len(values) == 1:
+                value = values[0] / 1000
+                return cls(text, lambda: value)
+            if name == "uniform" and len(values) == 2:
+                low, high = values[0] / 1000, values[1] / 1000
+                return cls(text, lambda: random.uniform(low, high))
+            if name == "exponential" and len(values) == 1:
+                rate = 1000 / values[0]
+                return cls(text, lambda: random.expovariate(rate))
+            if name == "lognormal" and len(values) == 2:
+                mu, sigma = math.log(values[0] / 1000), values[1]
+                return cls(text, lambda: random.lognormvariate(mu, sigma))
+        except (ValueError, ZeroDivisionError) as e:
+            raise ValueError(f"Invalid latency distribution {text}: {e}") from e
+
+        raise ValueError(
+            f"Invalid latency distribution {text}, one of constant:ms, uniform:min_ms,max_ms,"
+            " exponential:mean_ms and lognormal:median_ms,sigma"
+        )
+
+    def __repr__(self):
+        return self.name
+
+
+class MockStorylineService:
+    """Stand-in of storyline service answering the APIs called by the load
+    test without doing any work, thus it can be used to benchmark the load
+    generator itself.
+
+    Responses are delayed by `latency` and a request fails with `error_status`
+    at `error_rate`. HTTP/1.1 keep-alive is supported, thus pooled clients
+    reuse connections as they do with the real service.
+    """
+
+    def __init__(
+        self,
+        latency: Optional[LatencyDistribution] = None,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        id_start: int = 1,
+        id_step: int = 1,
+    ):
+        """
+        Args:
+            latency (LatencyDistribution, optional): delay of each response. Defaults to None (no delay).
+            error_rate (float, optional): ratio of failed requests (0 to 1). Defaults to 0.0.
+            error_status (int, optional): status code of failed requests. Defaults to 500.
+            id_start (int, optional): the first storyline id. Defaults to 1.
+            id_step (int, optional): step of storyline ids (the number of server processes). Defaults to 1.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.__ids = itertools.count(id_start, id_step)
+
+    def respond(self, method: bytes, target: bytes) -> Tuple[int, bytes]:
+        """Returns (status code, body) of a request."""
+        request_path = target.split(b"?", 1)[0]
+        if method != b"POST":
+            return 404, b""
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_status, b'{"error":"mock error"}'
+        if _CREATE_STORYLINE.search(request_path):
+            return 201, b'{"data":{"id":%d}}' % next(self.__ids)
+        if _CREATE_STORIES.search(request_path):
+            return 201, b'{"data":[]}'
+        if _DELETE_STORYLINE.search(request_path):
+            return 204, b""
+        return 404, b""
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve requests of a connection until the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.split(b" ", 2)
+                content_length = 0
+                keep_alive = version.strip() == b"HTTP/1.1"
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.partition(b":")
+                    name = name.strip().lower()
+                    if name == b"content-length":
+                        content_length = int(value)
+                    elif name == b"connection":
+                        keep_alive = value.strip().lower() == b"keep-alive"
+                if content_length:
+                    await reader.readexactly(content_length)
+
+                status, body = self.respond(method, target)
+                if self.latency is not None:
+                    delay = self.latency.sample()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                writer.write(
+                    b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n%s\r\n%s"
+                    % (
+                        status,
+                        _REASONS.get(status, b"Error"),
+                        len(body),
+                        b"" if keep_alive else b"Connection: close\r\n",
+                        body,
+                    )
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # broken or closed connection
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, sock: socket.socket) -> None:
+        server = await asyncio.start_server(self.handle, sock=sock)
+        async with server:
+            await server.serve_forever()
+
+
+def bind(host: str, port: int, reuse_port: bool = False) -> socket.socket:
+    """Returns a listening socket. With `reuse_port`, processes bind the same
+    port and the kernel balances connections among them (Linux, BSD).
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(4096)
+    return sock
+
+
+def run_server_process(
+    host: str,
+    port: int,
+    latency: Optional[str],
+    error_rate: float,
+    error_status: int,
+    index: int,
+    number_of_processes: int,
+) -> None:
+    """Entry point of a server process. Ids are interleaved among processes,
+    thus they are unique across the server.
+    """
+    service = MockStorylineService(
+        LatencyDistribution.parse(latency) if latency else None,
+        error_rate,
+        error_status,
+        id_start=index + 1,
+        id_step=number_of_processes,
+    )
+    sock = bind(host, port, reuse_port=number_of_processes > 1)
+    try:
+        asyncio.run(service.serve(sock))
+    except KeyboardInterrupt:
+        pass
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    latency: Optional[str] = None,
+    error_rate: float = 0.0,
+    error_status: int = 500,
+    number_of_processes: int = 1,
+) -> None:
+    """Run the mock server until interrupted, on `number_of_processes`
+    processes sharing the port (requires SO_REUSEPORT if more than one).
+    """
+    if number_of_processes > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        logger.warning("SO_REUSEPORT is not supported, running a single server process")
+        number_of_processes = 1
+
+    logger.info(
+        f"Mock storyline service on http://{host}:{port} (processes={number_of_processes},"
+        f" latency={latency}, error_rate={error_rate})"
+    )
+    # exit through `finally` on terminate, otherwise the other processes are left running
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    arguments = (host, port, latency, error_rate, error_status)
+    processes: List[multiprocessing.Process] = [
+        multiprocessing.Process(
+            target=run_server_process, args=(*arguments, i, number_of_processes), daemon=True
+        )
+        for i in range(1, number_of_processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        run_server_process(*arguments, 0, number_of_processes)
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock storyline service for benchmarking the load test")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--latency",
+        help="response delay, e.g. constant:20, uniform:10,50, exponential:20 or lognormal:20,0.5 (in ms)",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="ratio of failed requests (0 to 1)")
+    parser.add_argument("--error-status", type=int, default=500, help="status code of failed requests")
+    parser.add_argument("--processes", type=int, default=1, help="server processes sharing the port")
+    args = parser.parse_args()
+
+    if args.latency:
+        try:
+            LatencyDistribution.parse(args.latency)
+        except ValueError as e:
+            parser.error(str(e))
+
+    serve(args.host, args.port, args.latency, args.error_rate, args.error_status, args.processes)
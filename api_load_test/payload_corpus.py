@@ -0,0 +1,303 @@
+import argparse
+import bisect
+import copy
+import json
+import mmap
+import os
+import random
+import string
+import struct
+import threading
+
+from array import array
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from data_template import DataTemplate
+from log_util import get_logger
+
+
+logger = get_logger(__name__)
+
+# File layout (integers in native byte order):
+#   header: magic, the number of bodies, offset of the index
+#   bodies: concatenated UTF-8 JSON bodies
+#   index:  start offsets, end offsets and keys (see `_get_key`) of the bodies in ascending order of the keys
+#           (8 bytes each, 8 bytes aligned)
+_MAGIC = b"PLCORP02"
+_HEADER = struct.Struct("=8sQQ")
+
+_TOKEN_CHARACTERS = string.ascii_lowercase + string.digits
+
+# corpora opened in this process, keyed by absolute file name
+_corpora: Dict[str, "PayloadCorpus"] = {}
+_corpora_lock = threading.Lock()
+
+
+def _get_key(dependent_id: int, target_date: Union[date, str]) -> int:
+    """Returns the key of a body rendered for `dependent_id` and `target_date`,
+    keys are ordered by dependent id then date.
+    """
+    if isinstance(target_date, str):
+        target_date = date.fromisoformat(target_date)
+    return (dependent_id << 32) | target_date.toordinal()
+
+
+class PayloadCorpus:
+    """Bodies pre-rendered by `build_corpus` in a memory-mapped file.
+
+    `get_bytes` returns a `memoryview` of the mapped file, thus a body is sent
+    without rendering nor copying it in the load generator. Pages of the file
+    are shared by all processes mapping it.
+
+    It can be used in place of `DataTemplate`: a body is rendered for each
+    dependent id and date of the work space given to `render_bodies`, and
+    `get_bytes` returns the body of its `dependent_id` and `target_date`. Thus
+    keys and capture times of the stories match the storyline they are posted
+    to, as with the template.
+
+    A pickled corpus only holds its file name, and it is unpickled to the
+    corpus mapped once in the receiving process (see `get_payload_corpus`).
+    """
+
+    def __init__(self, file_name: str):
+        """
+        Args:
+            file_name (str): a file written by `build_corpus`
+
+        Raises:
+            ValueError: if the file is not a corpus
+        """
+        self.file_name = os.path.abspath(file_name)
+        with open(file_name, "rb") as fp:
+            self.__mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.__mmap) < _HEADER.size:
+            raise ValueError(f"{file_name} is not a payload corpus")
+        magic, count, index_offset = _HEADER.unpack_from(self.__mmap)
+        if magic != _MAGIC or count == 0:
+            raise ValueError(f"{file_name} is not a payload corpus (or empty)")
+
+        self.__view = memoryview(self.__mmap)
+        self.__starts = self.__view[index_offset:index_offset + 8 * count].cast("Q")
+        index_offset += 8 * count
+        self.__ends = self.__view[index_offset:index_offset + 8 * count].cast("Q")
+        index_offset += 8 * count
+        self.__keys = self.__view[index_offset:index_offset + 8 * count].cast("q")
+
+    def __len__(self) -> int:
+        return len(self.__keys)
+
+    def __getitem__(self, index: int) -> memoryview:
+        return self.__view[self.__starts[index]:self.__ends[index]]
+
+    def __contains__(self, dependent_id_and_date: Tuple[int, Union[date, str]]) -> bool:
+        return self.__find(_get_key(*dependent_id_and_date)) is not None
+
+    def get_bytes(self, dependent_id: int, target_date: Union[date, str]) -> memoryview:
+        """Returns the body rendered for `dependent_id` and `target_date`
+        (a date or `YYYY-MM-DD`).
+
+        Raises:
+            KeyError: if the corpus is not built for them
+        """
+        index = self.__find(_get_key(dependent_id, target_date))
+        if index is None:
+            raise KeyError(
+                f"{self.file_name} has no body of dependent {dependent_id} at {target_date},"
+                " build it with the dependent ids and dates of the load"
+            )
+        return self[index]
+
+    def __find(self, key: int) -> Optional[int]:
+        index = bisect.bisect_left(self.__keys, key)
+        if index < len(self.__keys) and self.__keys[index] == key:
+            return index
+        return None
+
+    def __reduce__(self):
+        # the receiving process maps the file once
+        return get_payload_corpus, (self.file_name,)
+
+
+# source of POST bodies to create stories
+BodySource = Union[DataTemplate, PayloadCorpus]
+
+
+def get_payload_corpus(file_name: str) -> PayloadCorpus:
+    """Return the corpus of `file_name` mapped in the current process."""
+    key = os.path.abspath(file_name)
+    with _corpora_lock:
+        corpus = _corpora.get(key)
+        if corpus is None:
+            corpus = _corpora[key] = PayloadCorpus(file_name)
+
+    return corpus
+
+
+def _random_token(rng: random.Random, min_length: int, max_length: int) -> str:
+    return "".join(rng.choices(_TOKEN_CHARACTERS, k=rng.randint(min_length, max_length)))
+
+
+class _StorySampler:
+    """Randomized stories resampled from the stories of a template.
+
+    Stories of create-bulk API are lists of `media` (with bucket, key,
+    capturedAt, capturedDuration and type) and `tagNames`, which are
+    resampled and randomized if present.
+    """
+
+    def __init__(self, template: DataTemplate):
+        self.template = template
+        # placeholders are rendered with fixed values to find the fields
+        stories = json.loads(template.get_formatted_str(dependent_id=0, target_date="2000-01-01"))
+        self.max_stories = len(stories)
+        self.max_media = max((len(story.get("media", [])) for story in stories), default=0)
+        self.tags = sorted({tag for story in stories for tag in story.get("tagNames", [])})
+
+    def render(self, rng: random.Random, dependent_id: int, target_date: date) -> Any:
+        stories = json.loads(
+            self.template.get_formatted_str(dependent_id=dependent_id, target_date=target_date)
+        )
+        media = [media for story in stories for media in story.get("media", [])]
+        result = []
+        for _ in range(rng.randint(1, 2 * self.max_stories)):
+            story = copy.deepcopy(rng.choice(stories))
+            if "media" in story and media:
+                story["media"] = [
+                    self.__randomize_media(rng, copy.deepcopy(rng.choice(media)), target_date)
+                    for _ in range(rng.randint(1, 2 * self.max_media))
+                ]
+            if "tagNames" in story:
+                tags = rng.sample(self.tags, rng.randint(0, len(self.tags)))
+                story["tagNames"] = tags + [_random_token(rng, 3, 24) for _ in range(rng.randint(0, 2))]
+            result.append(story)
+
+        return result
+
+    @staticmethod
+    def __randomize_media(rng: random.Random, media: Dict[str, Any], target_date: date) -> Dict[str, Any]:
+        if isinstance(media.get("key"), str):
+            directory, _, file_name = media["key"].rpartition("/")
+            extension = os.path.splitext(file_name)[1]
+            media["key"] = f"{directory}/{_random_token(rng, 8, 96)}{extension}"
+        if "capturedAt" in media:
+            seconds = rng.randrange(24 * 60 * 60)
+            media["capturedAt"] = (
+                f"{target_date}T{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}Z"
+            )
+        if media.get("capturedDuration") is not None:
+            media["capturedDuration"] = rng.randint(1, 120)
+        return media
+
+
+def render_bodies(
+    template_files: List[str],
+    dependent_ids: List[int],
+    start_date: date,
+    days: int,
+    seed: int = 0,
+) -> Iterator[Tuple[int, date, bytes]]:
+    """Yield a body for each of `dependent_ids` at each date, rendered from a
+    randomly chosen template with randomized stories, media, keys, times and
+    tags.
+
+    Args:
+        template_files (List[str]): files of `data_sample.txt`-style templates
+        dependent_ids (List[int]): dependent ids of the load
+        start_date (date): the first date of the load ...
+        days (int): ... and the number of dates
+        seed (int, optional): seed of the randomization, the same seed renders the same bodies. Defaults to 0.
+
+    Yields:
+        Tuple[int, date, bytes]: (dependent id, date, body)
+    """
+    rng = random.Random(seed)
+    samplers = [_StorySampler(DataTemplate(file_name)) for file_name in template_files]
+    for dependent_id in dependent_ids:
+        for day in range(days):
+            target_date = start_date + timedelta(days=day)
+            stories = rng.choice(samplers).render(rng, dependent_id, target_date)
+            yield dependent_id, target_date, json.dumps(stories, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def build_corpus(output_file: str, bodies: Iterator[Tuple[int, date, bytes]]) -> int:
+    """Write `bodies` (dependent id, date and body, see `render_bodies`) into a
+    corpus file (see `PayloadCorpus`), and return the number of bodies.
+
+    Bodies are streamed to the file, thus only their offsets and keys are kept
+    in memory.
+
+    Raises:
+        ValueError: if a dependent id and date is given more than once
+    """
+    offsets = array("Q")
+    keys = array("q")
+    with open(output_file, "wb") as fp:
+        fp.write(_HEADER.pack(_MAGIC, 0, 0))
+        position = _HEADER.size
+        for dependent_id, target_date, body in bodies:
+            offsets.append(position)
+            keys.append(_get_key(dependent_id, target_date))
+            fp.write(body)
+            position += len(body)
+        offsets.append(position)
+
+        # bodies are looked up by binary search of their keys
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        if any(keys[i] == keys[j] for i, j in zip(order, order[1:])):
+            raise ValueError("A dependent id and date is given more than once")
+
+        padding = -position % 8
+        fp.write(bytes(padding))
+        fp.write(array("Q", (offsets[i] for i in order)).tobytes())
+        fp.write(array("Q", (offsets[i + 1] for i in order)).tobytes())
+        fp.write(array("q", (keys[i] for i in order)).tobytes())
+        fp.seek(0)
+        fp.write(_HEADER.pack(_MAGIC, len(keys), position + padding))
+
+    return len(keys)
+
+
+if __name__ == "__main__":
+    # defaults are the configurations of main, which imports this module
+    import main
+
+    parser = argparse.ArgumentParser(
+        description="Build a memory-mapped corpus of varied POST bodies (used by main.py with PAYLOAD_CORPUS)"
+    )
+    parser.add_argument(
+        "--template",
+        action="append",
+        metavar="FILE",
+        help=f"template file (repeatable). Defaults to {main.DATA_TEMPLATE_FILENAME}",
+    )
+    parser.add_argument("--output", default="corpus.bin", help="corpus file to write")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the randomization")
+    parser.add_argument(
+        "--dependent-ids",
+        default=",".join(str(id) for id in main.DEPENDENT_IDS),
+        help="comma separated dependent ids of the load, a body is rendered for each of them at each date",
+    )
+    parser.add_argument("--start-date", type=date.fromisoformat, default=main.START_DATE, help="first date of the load")
+    parser.add_argument("--days", type=int, default=main.DAYS_TO_ITERATE, help="number of dates of the load")
+    args = parser.parse_args()
+
+    if args.days < 1:
+        parser.error("--days must be positive")
+    try:
+        dependent_ids = [int(id) for id in args.dependent_ids.split(",")]
+    except ValueError as e:
+        parser.error(f"Invalid --dependent-ids: {e}")
+
+    templates = args.template or [main.DATA_TEMPLATE_FILENAME]
+    count = build_corpus(
+        args.output,
+        render_bodies(templates, dependent_ids, args.start_date, args.days, args.seed),
+    )
+    corpus = PayloadCorpus(args.output)
+    sizes = sorted(len(corpus[i]) for i in range(len(corpus)))
+    logger.info(
+        f"Wrote {count} bodies to {args.output} ({os.path.getsize(args.output)} bytes):"
+        f" min={sizes[0]} median={sizes[len(sizes) // 2]} max={sizes[-1]} bytes"
+    )
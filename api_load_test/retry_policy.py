@@ -0,0 +1,69 @@
+import random
+
+from typing import Optional
+
+from latency_recorder import STATUS_CONNECTION_ERROR, STATUS_TIMEOUT
+
+# status codes worth retrying since the service may answer on the next attempt
+_RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RetryPolicy:
+    """Timeout of each request and retries of failed ones.
+
+    A request which never reached the service (the connection could not be
+    established) is always safe to retry. A request which may have been
+    processed by the service is retried only if it is idempotent (e.g.
+    deleting a storyline), since retrying a creation would create it twice.
+
+    Delays between attempts grow exponentially with full jitter (a random
+    delay up to the exponential bound), thus retries of many workers do not
+    arrive at the same time.
+    """
+
+    def __init__(
+        self,
+        timeout: Optional[float] = 30.0,
+        max_retries: int = 2,
+        backoff: float = 0.1,
+        max_backoff: float = 5.0,
+    ):
+        """
+        Args:
+            timeout (float, optional): seconds to wait for connecting and for each read. Defaults to 30.0 (None to wait
+                forever).
+            max_retries (int, optional): retries after the first attempt. Defaults to 2.
+            backoff (float, optional): the upper bound of the first delay in seconds. Defaults to 0.1.
+            max_backoff (float, optional): the upper bound of any delay in seconds. Defaults to 5.0.
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def should_retry(self, attempt: int, status_code: int, idempotent: bool, sent: bool) -> bool:
+        """Return whether to retry after `attempt` (0 for the first attempt).
+
+        Args:
+            attempt (int): the number of retries so far
+            status_code (int): the status code, or STATUS_TIMEOUT/STATUS_CONNECTION_ERROR without a response
+            idempotent (bool): the request can be sent more than once
+            sent (bool): the request may have reached the service
+        """
+        if attempt >= self.max_retries:
+            return False
+        if not sent:
+            return True
+        if not idempotent:
+            return False
+        return status_code in (STATUS_TIMEOUT, STATUS_CONNECTION_ERROR) or status_code in _RETRYABLE_STATUS_CODES
+
+    def delay(self, attempt: int) -> float:
+        """Return seconds to wait before the retry after `attempt`."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2**attempt)))
+
+    def __repr__(self):
+        return "{}({})".format(
+            self.__class__.__name__,
+            ", ".join(f"{k}={v}" for k, v in sorted(self.__dict__.items())),
+        )
@@ -0,0 +1,188 @@
+import json
+import os
+import threading
+
+from datetime import date
+from typing import Dict, List, Set, Tuple
+
+from log_util import get_logger
+
+
+logger = get_logger(__name__)
+
+# record types (first item of each JSON line)
+_CREATED = "c"  # ["c", storyline_id, dependent_id, "2000-03-01"]
+_DELETED = "x"  # ["x", storyline_id]
+_DATE_DONE = "d"  # ["d", "2000-03-01"]
+_TIMING = "t"  # ["t", endpoint, status_code, seconds]
+
+# journals opened in this process, keyed by (pid, journal_dir) since forked processes inherit the dict
+_journals: Dict[Tuple[int, str], "RunJournal"] = {}
+_journals_lock = threading.Lock()
+
+
+class RunJournal:
+    """Append-only JSON lines journal of a load run.
+
+    Each process appends to its own file in `journal_dir`, thus no locking is
+    needed between processes. Records are buffered in memory and a background
+    thread writes and fsyncs them every `flush_interval` seconds (or once
+    `flush_size` records are buffered), such that recording on the request
+    path costs an append to a list only.
+    """
+
+    def __init__(
+        self, journal_dir: str, flush_size: int = 1024, flush_interval: float = 1.0
+    ):
+        os.makedirs(journal_dir, exist_ok=True)
+        self.path = os.path.join(journal_dir, f"{os.getpid()}.jsonl")
+        self.__file = open(self.path, "ab")
+        self.__flush_size = flush_size
+        self.__flush_interval = flush_interval
+        self.__buffer: List[str] = []
+        self.__lock = threading.Lock()
+        self.__flush_lock = threading.Lock()
+        self.__wake_up = threading.Event()
+        self.__flusher = threading.Thread(target=self.__run_flusher, daemon=True)
+        self.__flusher.start()
+
+    def __append(self, record: list) -> None:
+        line = json.dumps(record, separators=(",", ":"))
+        with self.__lock:
+            self.__buffer.append(line)
+            if len(self.__buffer) >= self.__flush_size:
+                self.__wake_up.set()
+
+    def created(self, storyline_id: int, dependent_id: int, target_date: date) -> None:
+        self.__append([_CREATED, storyline_id, dependent_id, target_date.isoformat()])
+
+    def deleted(self, storyline_id: int) -> None:
+        self.__append([_DELETED, storyline_id])
+
+    def date_done(self, target_date: date) -> None:
+        """Record that storylines of all dependents at `target_date` are handled."""
+        self.__append([_DATE_DONE, target_date.isoformat()])
+
+    def timing(self, endpoint: str, status_code: int, seconds: float) -> None:
+        """Record a response (same signature as `LatencyRecorder.record`)."""
+        self.__append([_TIMING, endpoint, status_code, round(seconds, 6)])
+
+    def flush(self) -> None:
+        """Write buffered records to the file and fsync it."""
+        with self.__lock:
+            lines, self.__buffer = self.__buffer, []
+        if not lines:
+            return
+
+        with self.__flush_lock:
+            self.__file.write(("\n".join(lines) + "\n").encode())
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+
+    def __run_flusher(self) -> None:
+        while True:
+            self.__wake_up.wait(self.__flush_interval)
+            self.__wake_up.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception(f"Fail on flushing journal {self.path}")
+
+
+def get_journal(journal_dir: str) -> RunJournal:
+    """Return the journal of the current process writing to `journal_dir`.
+
+    The journal is created once per process, thus it can be called in every task
+    executed by a process pool.
+    """
+    key = (os.getpid(), journal_dir)
+    with _journals_lock:
+        journal = _journals.get(key)
+        if journal is None:
+            journal = _journals[key] = RunJournal(journal_dir)
+
+    return journal
+
+
+class JournalState:
+    """State of a load run read from all journal files in a directory."""
+
+    def __init__(self):
+        self.created_ids: Dict[int, Tuple[int, str]] = {}
+        self.deleted_ids: Set[int] = set()
+        self.done_dates: Set[str] = set()
+        self.number_of_timings = 0
+
+    @property
+    def orphaned_ids(self) -> List[int]:
+        """Ids of storylines created but not deleted."""
+        return sorted(set(self.created_ids) - self.deleted_ids)
+
+
+def read_journal(journal_dir: str) -> JournalState:
+    """Read all journal files in `journal_dir`.
+
+    A broken line (e.g. the last line written while the process crashed) is
+    skipped.
+    """
+    state = JournalState()
+    if not os.path.isdir(journal_dir):
+        return state
+
+    for file_name in sorted(os.listdir(journal_dir)):
+        if not file_name.endswith(".jsonl"):
+            continue
+        with open(os.path.join(journal_dir, file_name), "rb") as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.info(f"Skipping broken journal line in {file_name}")
+                    continue
+
+                kind = record[0]
+                if kind == _CREATED:
+                    state.created_ids[record[1]] = (record[2], record[3])
+                elif kind == _DELETED:
+                    state.deleted_ids.add(record[1])
+                elif kind == _DATE_DONE:
+                    state.done_dates.add(record[1])
+                elif kind == _TIMING:
+                    state.number_of_timings += 1
+
+    return state
+
+
+def check_journal(journal_dir: str) -> None:
+    """Check that the previous run in `journal_dir` left no storylines not
+    deleted, such that its journal can be reset.
+
+    Raises:
+        RuntimeError: if the previous run left storylines not deleted
+    """
+    state = read_journal(journal_dir)
+    if state.orphaned_ids:
+        raise RuntimeError(
+            f"Journal at {journal_dir} has {len(state.orphaned_ids)} storylines not deleted."
+            " Run with --resume or --cleanup-from-journal first, or with --discard-journal if they"
+            " are known to be deleted"
+        )
+
+
+def reset_journal(journal_dir: str, force: bool = False) -> None:
+    """Remove journal files of a previous run in `journal_dir`.
+
+    Args:
+        journal_dir (str): directory of the journal
+        force (bool, optional): remove the files even if storylines are left not deleted. Defaults to False.
+
+    Raises:
+        RuntimeError: if the previous run left storylines not deleted (unless `force`, see `check_journal`)
+    """
+    if not force:
+        check_journal(journal_dir)
+
+    if os.path.isdir(journal_dir):
+        for file_name in os.listdir(journal_dir):
+            if file_name.endswith(".jsonl"):
+                os.remove(os.path.join(journal_dir, file_name))
@@ -0,0 +1,186 @@
+import tomllib
+
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from load_profile import ConstantRate, LoadProfile, RampUp, Spike, Step
+
+# scenario key (section.name) -> configuration name of main
+SCENARIO_KEYS = {
+    "parallelism.processes": "NUMBER_OF_PROCESSES",
+    "parallelism.engine": "ENGINE",
+    "parallelism.async_concurrency": "ASYNC_CONCURRENCY",
+    "parallelism.start_method": "START_METHOD",
+    "concurrency.adaptive": "ADAPTIVE_CONCURRENCY",
+    "concurrency.maximum": "MAX_CONCURRENCY",
+    "concurrency.window": "CONTROL_WINDOW",
+    "concurrency.latency_tolerance": "LATENCY_TOLERANCE",
+    "concurrency.max_error_ratio": "MAX_ERROR_RATIO",
+    "load.mode": "LOAD_MODE",
+    "load.profile": "LOAD_PROFILE",
+    "cleanup.streaming": "STREAMING_CLEANUP",
+    "cleanup.workers": "CLEANUP_WORKERS",
+    "cleanup.queue_size": "CLEANUP_QUEUE_SIZE",
+    "cleanup.batch_size": "CLEANUP_BATCH_SIZE",
+    "cleanup.delay": "CLEANUP_DELAY",
+    "cleanup.retries": "CLEANUP_RETRIES",
+    "cleanup.journal_dir": "JOURNAL_DIR",
+    "progress.interval": "PROGRESS_INTERVAL",
+    "live.interval": "LIVE_INTERVAL",
+    "live.file": "LIVE_METRICS_FILE",
+    "trace.file": "TRACE_FILE",
+    "trace.max_events": "TRACE_MAX_EVENTS",
+    "api.host_url": "HOST_URL",
+    "api.access_token": "ACCESS_TOKEN",
+    "api.timeout": "REQUEST_TIMEOUT",
+    "api.max_retries": "MAX_RETRIES",
+    "api.retry_backoff": "RETRY_BACKOFF",
+    "api.retry_max_backoff": "RETRY_MAX_BACKOFF",
+    "data.template": "DATA_TEMPLATE_FILENAME",
+    "data.cache_size": "DATA_TEMPLATE_CACHE_SIZE",
+    "data.corpus": "PAYLOAD_CORPUS",
+    "data.dependent_ids": "DEPENDENT_IDS",
+    "data.start_date": "START_DATE",
+    "data.days": "DAYS_TO_ITERATE",
+}
+
+# keys of the sweep section (not configurations, see `Scenario.sweep_values`)
+SWEEP_PARAMETER = "sweep.parameter"
+SWEEP_VALUES = "sweep.values"
+SWEEP_OUTPUT = "sweep.output"
+
+# `type` of a load.profile table -> class, other keys of the table are passed to the constructor
+_PROFILES = {
+    "constant": ConstantRate,
+    "ramp_up": RampUp,
+    "step": Step,
+    "spike": Spike,
+}
+
+
+def parse_profile(table: Dict[str, Any]) -> LoadProfile:
+    """Build a load profile from a table such as
+    `{type = "ramp_up", start_rps = 10, end_rps = 200, duration = 60}`.
+
+    Raises:
+        ValueError: if the type or an argument is unknown
+    """
+    arguments = dict(table)
+    profile_type = arguments.pop("type", None)
+    if profile_type not in _PROFILES:
+        raise ValueError(f"Unknown load profile type {profile_type}, one of {list(_PROFILES)}")
+    try:
+        return _PROFILES[profile_type](**arguments)
+    except TypeError as e:
+        raise ValueError(f"Invalid arguments of {profile_type} load profile: {e}") from e
+
+
+def parse_value(text: str) -> Any:
+    """Parse a value given in a command line as a TOML value (e.g. `16`,
+    `[411, 412]`, `2000-03-01`, `{type = "constant", rps = 50, duration = 60}`).
+
+    Text which is not a TOML value is taken as a string, thus quotes can be
+    omitted for strings such as `http://localhost:8080`.
+    """
+    try:
+        return tomllib.loads(f"value = {text}")["value"]
+    except tomllib.TOMLDecodeError:
+        return text
+
+
+def _flatten(table: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    # load.profile is a table value itself, thus it is not flattened further
+    flat = {}
+    for name, value in table.items():
+        key = f"{prefix}{name}"
+        if isinstance(value, dict) and key != "load.profile":
+            flat.update(_flatten(value, f"{key}."))
+        else:
+            flat[key] = value
+    return flat
+
+
+class Scenario:
+    """Settings of a load run read from a TOML file and command line overrides.
+
+    Example of a scenario file:
+        [parallelism]
+        processes = 4
+        engine = "asyncio"
+
+        [load]
+        mode = "open"
+        profile = {type = "ramp_up", start_rps = 10, end_rps = 200, duration = 60}
+
+        [sweep]
+        parameter = "parallelism.async_concurrency"
+        values = [8, 16, 32, 64]
+        output = "sweep.csv"
+
+    Keys are listed in SCENARIO_KEYS, keys not given keep the configurations
+    of main.
+    """
+
+    def __init__(self, values: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            values (Dict[str, Any], optional): flat keys (e.g. `parallelism.processes`) and values. Defaults to None.
+
+        Raises:
+            ValueError: if a key or a value is invalid
+        """
+        self.values: Dict[str, Any] = {}
+        for key, value in (values or {}).items():
+            self.set(key, value)
+
+    @classmethod
+    def load(cls, file_name: str) -> "Scenario":
+        with open(file_name, "rb") as fp:
+            return cls(_flatten(tomllib.load(fp)))
+
+    def set(self, key: str, value: Any) -> None:
+        """Set (override) the value of key.
+
+        Raises:
+            ValueError: if key is unknown or value is not valid for key
+        """
+        if key not in SCENARIO_KEYS and key not in (SWEEP_PARAMETER, SWEEP_VALUES, SWEEP_OUTPUT):
+            raise ValueError(f"Unknown scenario key {key}")
+        if key == "load.profile" and isinstance(value, dict):
+            parse_profile(value)
+        if key == "data.start_date" and not isinstance(value, date):
+            raise ValueError(f"{key} must be a date (e.g. 2000-03-01), but {value!r}")
+        if key == SWEEP_PARAMETER and value not in SCENARIO_KEYS:
+            raise ValueError(f"Unknown sweep parameter {value}")
+        self.values[key] = value
+
+    def set_override(self, text: str) -> None:
+        """Set a `key=value` override given in a command line (see `parse_value`).
+
+        Raises:
+            ValueError: if text is not `key=value`, or see `set`
+        """
+        key, separator, value = text.partition("=")
+        if not separator:
+            raise ValueError(f"Override must be key=value, but {text}")
+        self.set(key.strip(), parse_value(value.strip()))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.values.get(key, default)
+
+    def configurations(self) -> Dict[str, Any]:
+        """Returns configuration names of main and their values (load profile
+        tables are built into `LoadProfile`).
+        """
+        configurations = {}
+        for key, value in self.values.items():
+            if key not in SCENARIO_KEYS:
+                continue
+            if key == "load.profile" and isinstance(value, dict):
+                value = parse_profile(value)
+            configurations[SCENARIO_KEYS[key]] = value
+        return configurations
+
+    def sweep_values(self) -> List[Any]:
+        """Returns values of the sweep parameter (empty if not sweeping)."""
+        return list(self.values.get(SWEEP_VALUES, []))
@@ -0,0 +1,143 @@
+import collections
+import concurrent.futures
+import itertools
+import queue
+import threading
+import time
+
+from typing import Any, Callable, Deque, List, Optional, Tuple
+
+from latency_recorder import LatencyRecorder
+from log_util import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class StreamingCleaner:
+    """Delete storylines while load is still running.
+
+    Worker processes put `(storyline_id, created_at)` (`time.time()` value) to
+    the bounded `id_queue` (e.g. `multiprocessing.Manager().Queue(maxsize)`) as
+    soon as a storyline is created. A dispatcher thread holds them and hands
+    them over to a thread pool running `delete_func` `batch_size` ids at a
+    time, once every id of the batch is at least `delay` seconds old. Ids left
+    in a partial batch are handed over on `close` once they are old enough.
+    Producers are blocked while the queue is full.
+
+    Ids failed on deletion are kept in a retry list and retried on `close`.
+    """
+
+    def __init__(
+        self,
+        id_queue: Any,
+        delete_func: Callable[[int, LatencyRecorder], Optional[int]],
+        number_of_workers: int,
+        batch_size: int = 1,
+        delay: float = 0.0,
+    ):
+        """
+        Args:
+            id_queue (Any): a queue shared with worker processes
+            delete_func (Callable): a function deleting a storyline, returns the id if it failed
+            number_of_workers (int): the number of threads deleting storylines
+            batch_size (int, optional): the number of ids to be deleted at once. Defaults to 1.
+            delay (float, optional): minimum seconds from creation of a storyline to its deletion. Defaults to 0.0.
+        """
+        self.__queue = id_queue
+        self.__delete_func = delete_func
+        self.__batch_size = batch_size
+        self.__delay = delay
+        self.__number_of_workers = number_of_workers
+        self.__executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=number_of_workers
+        )
+        # bound the number of ids waiting in the executor such that the queue can block producers
+        self.__in_flight = threading.BoundedSemaphore(number_of_workers * 2)
+        self.__lock = threading.Lock()
+        self.__failed_ids: List[int] = []
+        self.__deleted_count = 0
+        self.recorder = LatencyRecorder()
+        self.__dispatcher = threading.Thread(target=self.__dispatch, daemon=True)
+        self.__dispatcher.start()
+
+    def __due_time(self, pending: Deque[Tuple[int, float]]) -> float:
+        """Returns the time when the first batch in `pending` can be deleted."""
+        batch = itertools.islice(pending, self.__batch_size)
+        # ids of several processes are not strictly in order of creation
+        return max(created_at for _, created_at in batch) + self.__delay
+
+    def __dispatch(self) -> None:
+        pending: Deque[Tuple[int, float]] = collections.deque()
+        while True:
+            timeout = None
+            if len(pending) >= self.__batch_size:
+                timeout = max(0.0, self.__due_time(pending) - time.time())
+            try:
+                item = self.__queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+
+            if item is None:
+                # sentinel from `close`, the rest is deleted once it is old enough
+                while pending:
+                    time.sleep(max(0.0, self.__due_time(pending) - time.time()))
+                    self.__flush(
+                        [pending.popleft() for _ in range(min(self.__batch_size, len(pending)))]
+                    )
+                return
+            if item:
+                pending.append(item)
+
+            while (
+                len(pending) >= self.__batch_size
+                and self.__due_time(pending) <= time.time()
+            ):
+                self.__flush([pending.popleft() for _ in range(self.__batch_size)])
+
+    def __flush(self, batch: List[Tuple[int, float]]) -> None:
+        for storyline_id, _ in batch:
+            self.__in_flight.acquire()
+            future = self.__executor.submit(self.__delete, storyline_id)
+            future.add_done_callback(lambda _: self.__in_flight.release())
+
+    def __delete(self, storyline_id: int) -> None:
+        try:
+            failed_id = self.__delete_func(storyline_id, self.recorder)
+        except Exception:
+            logger.exception(f"Fail on deleting storyline (id:{storyline_id})")
+            failed_id = storyline_id
+
+        with self.__lock:
+            if failed_id is None:
+                self.__deleted_count += 1
+            else:
+                self.__failed_ids.append(failed_id)
+
+    def close(self, retries: int = 1) -> List[int]:
+        """Delete all remaining ids in the queue and wait for deletion to finish.
+
+        Ids failed on deletion are retried `retries` times.
+
+        Returns list of storyline ids failed on deletion.
+        """
+        self.__queue.put(None)
+        self.__dispatcher.join()
+        self.__executor.shutdown(wait=True)
+
+        for _ in range(retries):
+            if not self.__failed_ids:
+                break
+            retry_ids, self.__failed_ids = self.__failed_ids, []
+            logger.info(f"Retrying deletion of {len(retry_ids)} storylines")
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.__number_of_workers
+            ) as executor:
+                list(executor.map(self.__delete, retry_ids))
+
+        logger.info(
+            f"Streaming clean up deleted {self.__deleted_count} storylines,"
+            f" failed ids: {self.__failed_ids}"
+        )
+
+        return list(self.__failed_ids)
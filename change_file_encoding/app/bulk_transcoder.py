@@ -0,0 +1,377 @@
+import codecs
+import mmap
+import os
+import os.path as path
+import shutil
+import tempfile
+import time
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
+from stat import S_IMODE
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+from charset_sniffer import (
+    DEFAULT_CANDIDATES,
+    get_decode_codec,
+    sniff_encoding,
+)
+from sidecar_index import SidecarIndex
+
+BLOCKSIZE = 1048576 # or some other, desired size in bytes
+
+# results of `transcode_file`
+CONVERTED = 'converted'
+PASSED_THROUGH = 'passed through' # already valid UTF-8, copied (or linked) without conversion
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+# detected encodings whose files are the same bytes in UTF-8 if they are valid UTF-8
+# (a file with BOM is converted to drop the BOM)
+PASSTHROUGH_ENCODINGS = ('utf-8', 'ascii')
+
+
+def is_up_to_date(src_filename: str, target_filename: str) -> bool:
+    """Check whether target_filename is already converted from src_filename.
+
+    Converted file gets the same modification time as its source, thus the
+    output is up to date if the modification times are the same and both
+    files are empty or not empty.
+    """
+    try:
+        target_stat = os.stat(target_filename)
+    except FileNotFoundError:
+        return False
+
+    src_stat = os.stat(src_filename)
+    return (src_stat.st_mtime_ns == target_stat.st_mtime_ns
+            and (src_stat.st_size == 0) == (target_stat.st_size == 0))
+
+
+def convert_file(
+        src_filename: str,
+        src_file_encoding: str,
+        target_filename: str,
+        dst_file_encoding: str = 'UTF-8') -> Tuple[int, int]:
+    """Convert a file with src_filename to dst_file_encoding and store to
+    target_filename.
+
+    The file is read as binary in BLOCKSIZE chunks and converted by incremental
+    decoder/encoder. Output is written to a temporary file which is renamed to
+    the target only when the whole file is converted, thus a partially
+    converted file is never left. The target gets the same permission bits and
+    modification time as the source (see `is_up_to_date`).
+
+    Returns:
+        tuple: (bytes read, bytes written)
+
+    Raises:
+        UnicodeDecodeError: if the file is not encoded with src_file_encoding
+    """
+    decoder = codecs.getincrementaldecoder(src_file_encoding)()
+    encoder = codecs.getincrementalencoder(dst_file_encoding)()
+    buffer = bytearray(BLOCKSIZE)
+    view = memoryview(buffer)
+    bytes_read = 0
+    bytes_written = 0
+
+    fd, temp_filename = tempfile.mkstemp(
+        dir=path.dirname(target_filename) or '.', prefix='.', suffix='.tmp')
+    try:
+        with open(fd, 'wb') as target_file, open(src_filename, 'rb') as source_file:
+            while True:
+                size = source_file.readinto(buffer)
+                if not size:
+                    break
+                bytes_read += size
+                bytes_written += target_file.write(encoder.encode(decoder.decode(view[:size])))
+
+            bytes_written += target_file.write(encoder.encode(decoder.decode(b'', final=True), final=True))
+
+        src_stat = os.stat(src_filename)
+        # a temporary file is only readable by its owner
+        os.chmod(temp_filename, S_IMODE(src_stat.st_mode))
+        os.utime(temp_filename, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+        os.replace(temp_filename, target_filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+    return bytes_read, bytes_written
+
+
+def is_valid_utf8(filename: str) -> bool:
+    """Check whether the whole file is valid UTF-8.
+
+    The file is memory-mapped (read in BLOCKSIZE chunks if it cannot be mapped)
+    and validated by decoding BLOCKSIZE slices, thus no more than a chunk of
+    decoded text is held at once.
+    """
+    with open(filename, 'rb') as fp:
+        try:
+            if os.fstat(fp.fileno()).st_size == 0:
+                return True
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # e.g. special files which cannot be mapped
+            return _is_utf8_chunks(iter(partial(fp.read, BLOCKSIZE), b''))
+
+        with mapped, memoryview(mapped) as view:
+            return _is_utf8_chunks(view[offset:offset + BLOCKSIZE] for offset in range(0, len(view), BLOCKSIZE))
+
+
+def _is_utf8_chunks(chunks: Iterable[bytes]) -> bool:
+    # the exception is handled here such that its traceback does not keep a slice of a mapped file
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for chunk in chunks:
+            decoder.decode(chunk)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def pass_through_file(src_filename: str, target_filename: str, link: bool = False) -> int:
+    """Store src_filename as target_filename without conversion.
+
+    The file is copied (`shutil.copyfile` uses `os.sendfile` on Linux, thus the
+    content is not copied to user space). If link is true and both are on the
+    same file system, the target is hard-linked to the source instead, thus
+    the source and the target are the same file. As in `convert_file`, the
+    target is replaced atomically and gets the same permission bits and
+    modification time as the source.
+
+    Returns:
+        int: bytes of the file
+    """
+    src_stat = os.stat(src_filename)
+    target_dir = path.dirname(target_filename) or '.'
+    if link:
+        try:
+            if path.samefile(src_filename, target_filename):
+                # already linked
+                return src_stat.st_size
+        except FileNotFoundError:
+            pass
+
+        temp_filename = path.join(target_dir, f'.{path.basename(target_filename)}.{os.getpid()}.link')
+        try:
+            os.link(src_filename, temp_filename)
+        except OSError:
+            # e.g. EXDEV (different file systems) or EPERM (not supported), fall back to copy
+            pass
+        else:
+            try:
+                os.replace(temp_filename, target_filename)
+            except BaseException:
+                os.remove(temp_filename)
+                raise
+            return src_stat.st_size
+
+    fd, temp_filename = tempfile.mkstemp(dir=target_dir, prefix='.', suffix='.tmp')
+    os.close(fd)
+    try:
+        shutil.copyfile(src_filename, temp_filename)
+        # a temporary file is only readable by its owner
+        os.chmod(temp_filename, S_IMODE(src_stat.st_mode))
+        os.utime(temp_filename, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+        os.replace(temp_filename, target_filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+    return src_stat.st_size
+
+
+def transcode_file(
+        src_filename: str,
+        src_file_encoding: Optional[str],
+        dst_file_path: str,
+        dst_file_encoding: str = 'UTF-8',
+        skip_up_to_date: bool = True,
+        link: bool = False,
+        candidates: Optional[Sequence[str]] = None) -> Tuple[str, str, int, int, Optional[str]]:
+    """Convert a file with src_filename to dst_file_encoding and store to
+    dst_file_path with the same base name (see `convert_file`).
+
+    The encoding is detected from the head of the file if src_file_encoding is
+    None (see `charset_sniffer.sniff_encoding`). A file which is already valid
+    UTF-8 is stored without conversion if dst_file_encoding is UTF-8 (see
+    `pass_through_file`).
+
+    The head can be ASCII (e.g. an English header) while the rest is not, thus
+    a file taken as ASCII or UTF-8 which is not decodable as a whole is
+    converted with the first of the other candidates decoding the whole file.
+
+    Args:
+        candidates (Sequence[str], optional): encodings tried for the whole file as above. Defaults to
+            `charset_sniffer.DEFAULT_CANDIDATES` if src_file_encoding is None, nothing otherwise.
+
+    Returns:
+        tuple: (result, src_filename, bytes read, bytes written, encoding) where the result is one of CONVERTED,
+            PASSED_THROUGH, SKIPPED and FAILED (the file is not decodable with the encoding), and the encoding is the
+            detected one (None if it is skipped before detection or unknown)
+    """
+    target_filename = path.join(dst_file_path, path.basename(src_filename))
+    # a target hard-linked by a previous run is replaced with a copy unless link is true
+    if (skip_up_to_date and is_up_to_date(src_filename, target_filename)
+            and (link or not path.samefile(src_filename, target_filename))):
+        return SKIPPED, src_filename, 0, 0, src_file_encoding
+
+    if candidates is None:
+        candidates = DEFAULT_CANDIDATES if src_file_encoding is None else ()
+    encoding = src_file_encoding or sniff_encoding(src_filename)
+    if encoding is None:
+        return FAILED, src_filename, 0, 0, None
+
+    encodings = [encoding]
+    if codecs.lookup(encoding).name in PASSTHROUGH_ENCODINGS:
+        decode_codecs = {codecs.lookup(get_decode_codec(encoding)).name}
+        for candidate in candidates:
+            decode_codec = codecs.lookup(get_decode_codec(candidate)).name
+            if decode_codec not in decode_codecs:
+                decode_codecs.add(decode_codec)
+                encodings.append(candidate)
+
+        if codecs.lookup(dst_file_encoding).name == 'utf-8':
+            if is_valid_utf8(src_filename):
+                size = pass_through_file(src_filename, target_filename, link)
+                return PASSED_THROUGH, src_filename, size, size, encoding
+            # converting as UTF-8 would fail as well
+            encodings.pop(0)
+
+    for candidate in encodings:
+        try:
+            bytes_read, bytes_written = convert_file(
+                src_filename, get_decode_codec(candidate), target_filename, dst_file_encoding)
+        except UnicodeDecodeError:
+            continue
+        return CONVERTED, src_filename, bytes_read, bytes_written, candidate
+
+    return FAILED, src_filename, 0, 0, encoding
+
+
+class TranscodeStats:
+    """Summary of `transcode_files`."""
+
+    def __init__(self):
+        self.converted = 0
+        self.passed_through = 0
+        self.skipped = 0
+        self.failed_files: List[str] = []
+        # the number of files per detected encoding
+        self.encodings = Counter()
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.elapsed = 0.0
+
+    def add(self, result: Tuple[str, str, int, int, Optional[str]]) -> None:
+        status, src_filename, bytes_read, bytes_written, encoding = result
+        if status == CONVERTED:
+            self.converted += 1
+        elif status == PASSED_THROUGH:
+            self.passed_through += 1
+        elif status == SKIPPED:
+            self.skipped += 1
+        else:
+            self.failed_files.append(src_filename)
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+        if encoding is not None:
+            self.encodings[encoding] += 1
+
+    def __str__(self):
+        number_of_files = self.converted + self.passed_through + self.skipped + len(self.failed_files)
+        elapsed = self.elapsed or float('inf')
+        return (
+            f"{number_of_files} files in {self.elapsed:.3f}s"
+            f" (converted: {self.converted}, passed through: {self.passed_through}, skipped: {self.skipped},"
+            f" failed: {len(self.failed_files)}),"
+            f" {number_of_files / elapsed:.1f} files/s, {self.bytes_read / 1048576 / elapsed:.2f} MB/s"
+            + (f", encodings: {dict(self.encodings)}" if self.encodings else "")
+        )
+
+
+def transcode_files(
+        file_names: Iterable[str],
+        src_file_encoding: Optional[str],
+        dst_file_path: str,
+        number_of_processes: Optional[int] = None,
+        chunksize: int = 16,
+        index_filename: Optional[str] = None,
+        link: bool = False,
+        on_transcoded: Optional[Callable[[Tuple[str, str, int, int, Optional[str]]], None]] = None
+        ) -> TranscodeStats:
+    """Convert all files in file_names in parallel with process pool.
+
+    Args:
+        file_names (Iterable[str]): files to convert
+        src_file_encoding (str, optional): encoding of the files. It is detected per file if None.
+        dst_file_path (str): a directory to store converted files
+        number_of_processes (int, optional): the number of processes. Defaults to the number of CPUs.
+        chunksize (int, optional): the number of files sent to a process at once. Defaults to 16.
+        index_filename (str, optional): a sidecar index caching detected encodings (see
+            `sidecar_index.SidecarIndex`). Defaults to `.charset_index.json` in dst_file_path. Only used if
+            src_file_encoding is None.
+        link (bool, optional): hard-link files which are already valid UTF-8 instead of copying, thus the outputs
+            are the same files as the sources (see `pass_through_file`). Defaults to False.
+        on_transcoded (Callable, optional): called with a result of `transcode_file` for each file (e.g. to report
+            progress). Defaults to None.
+
+    Returns:
+        TranscodeStats: summary of the conversion
+    """
+    stats = TranscodeStats()
+    start = time.perf_counter()
+
+    index = None
+    stat_by_name = {}
+    if src_file_encoding is None:
+        index = SidecarIndex(index_filename or path.join(dst_file_path, '.charset_index.json'))
+        names_to_convert = []
+        encodings = []
+        for file_name in file_names:
+            stat = os.stat(file_name)
+            found, encoding = index.get(file_name, stat)
+            if found and encoding is None:
+                # known to be undetectable, thus the file is not read again
+                result = (FAILED, file_name, 0, 0, None)
+                stats.add(result)
+                if on_transcoded is not None:
+                    on_transcoded(result)
+                continue
+            stat_by_name[file_name] = stat
+            names_to_convert.append(file_name)
+            encodings.append(encoding)
+    else:
+        names_to_convert = file_names
+        encodings = repeat(src_file_encoding)
+
+    with ProcessPoolExecutor(max_workers=number_of_processes) as executor:
+        results = executor.map(
+            transcode_file,
+            names_to_convert,
+            encodings,
+            repeat(dst_file_path),
+            repeat('UTF-8'),
+            repeat(True),
+            repeat(link),
+            # encodings cached in the index are detected from the head as well
+            repeat(DEFAULT_CANDIDATES if index is not None else ()),
+            chunksize=chunksize,
+        )
+        for result in results:
+            stats.add(result)
+            if on_transcoded is not None:
+                on_transcoded(result)
+            if index is not None and (result[0] != SKIPPED or result[4] is not None):
+                index.set(result[1], stat_by_name[result[1]], result[4])
+
+    if index is not None:
+        index.save()
+    stats.elapsed = time.perf_counter() - start
+
+    return stats
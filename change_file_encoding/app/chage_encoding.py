@@ -1,43 +1,44 @@
-import codecs
 import os.path as path
+import sys
 
-from os import (
-    listdir,
-    makedirs,
+from os import makedirs
+from typing import Iterator
+
+sys.path.append(path.join(path.dirname(path.realpath(__file__)), '..', '..', 'file_walker'))
+sys.path.append(path.join(path.dirname(path.realpath(__file__)), '..', '..', 'progress_reporter'))
+from bulk_transcoder import (
+    convert_file,
+    transcode_files,
 )
-from typing import List
+from file_walker import walk_files
+from progress_reporter import ProgressReporter
 
-BLOCKSIZE = 1048576 # or some other, desired size in bytes
 
 def change_encoding(src_filename: str, src_file_encoding: str, dst_file_path: str) -> None:
     """Change a file with src_filename to UTF-8 encoding and store to a new file.
 
     Logic is from https://stackoverflow.com/questions/191359/how-to-convert-a-file-to-utf-8-in-python
+    (converted with incremental decoder/encoder over binary I/O, see `convert_file`)
+
+    Raises:
+        UnicodeDecodeError: if the file is not encoded with src_file_encoding
     """
-    with codecs.open(src_filename, "r", src_file_encoding) as sourceFile:
-        target_filename = f"{dst_file_path}/{path.basename(src_filename)}"
-        with codecs.open(target_filename, "w", "UTF-8") as targetFile:
-            while True:
-                contents = sourceFile.read(BLOCKSIZE)
-                if not contents:
-                    break
-                targetFile.write(contents)
-
-
-def get_smi_files(src_folder_name: str) -> List[str]:
-    """Get all `.smi` files in the current directory.
+    convert_file(src_filename, src_file_encoding, f"{dst_file_path}/{path.basename(src_filename)}")
+
+
+def get_smi_files(src_folder_name: str, recursive: bool = False) -> Iterator[str]:
+    """Get all `.smi` files in src_folder_name lazily (see `walk_files`).
+
+    Converted files are stored with their base names, thus subdirectories are
+    not searched unless recursive is true.
     """
-    return [
-        f'{src_folder_name}/{f}'
-        for f in listdir(f'{src_folder_name}')
-        if f.endswith('.smi')
-    ]
+    return (entry.path for entry in walk_files(src_folder_name, include=['*.smi'], recursive=recursive))
 
 
 if __name__ == '__main__':
     current_dir = path.dirname(path.realpath(__file__))
 
-    src_file_encoding = 'EUC-KR'
+    src_file_encoding = None # detected per file (see `charset_sniffer`), or set e.g. 'EUC-KR' to skip detection
     src_file_path = f'{current_dir}/../sources'
     dst_file_path = f'{current_dir}/../results'
     print(f"src_file_path: {src_file_path}")
@@ -49,13 +50,11 @@ if __name__ == '__main__':
     file_names = get_smi_files(src_file_path)
 
     print("Changing Encodings...")
-    weired_files = []
-    for file_name in file_names:
-        print(f"Changing: {basename(file_name)}")
-        try:
-            change_encoding(file_name, src_file_encoding, dst_file_path)
-        except UnicodeDecodeError:
-            weired_files.append(file_name)
-
-    if weired_files:
-        print("Unchanged files:\n{}".format('\n'.join(path.basename(weired_files))))
+    with ProgressReporter(name="Converting") as progress:
+        stats = transcode_files(
+            file_names, src_file_encoding, dst_file_path,
+            on_transcoded=lambda result: progress.update(nbytes=result[2]))
+    print(stats)
+
+    if stats.failed_files:
+        print("Unchanged files:\n{}".format('\n'.join(path.basename(f) for f in stats.failed_files)))
@@ -0,0 +1,88 @@
+import codecs
+
+from typing import Optional, Sequence
+
+SNIFF_SIZE = 65536 # bytes read from the head of a file to detect its encoding
+
+# encodings tried in order for a file without BOM
+DEFAULT_CANDIDATES = ('utf-8', 'euc-kr', 'cp949')
+
+# ordered such that UTF-32 is checked before UTF-16 (UTF-32 LE BOM starts with UTF-16 LE BOM)
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# encodings which can be decoded with a superset codec without changing the result
+DECODE_CODECS = {
+    # CP949 is a superset of EUC-KR, thus a file having CP949 only characters after the sniffed prefix is decodable
+    'euc-kr': 'cp949',
+    'ascii': 'utf-8',
+}
+
+
+def _is_decodable(data: bytes, encoding: str, is_whole_file: bool) -> bool:
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        # a multibyte character can be cut at the end of the prefix
+        decoder.decode(data, final=is_whole_file)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def sniff_bytes(
+        data: bytes,
+        is_whole_file: bool,
+        candidates: Sequence[str] = DEFAULT_CANDIDATES) -> Optional[str]:
+    """Detect encoding of data which is the head of a file.
+
+    Args:
+        data (bytes): the head of a file
+        is_whole_file (bool): true if data is the whole file
+        candidates (Sequence[str], optional): encodings tried in order if there is no BOM. Defaults to
+            DEFAULT_CANDIDATES.
+
+    Returns:
+        Optional[str]: the name of the encoding ('ascii' if only ASCII characters are found), None if unknown
+    """
+    for bom, encoding in _BOMS:
+        if data.startswith(bom):
+            return encoding
+
+    if data.isascii():
+        return 'ascii'
+
+    # UTF-16 without BOM has NUL in every other byte for ASCII characters
+    if len(data) >= 4 and data.count(0) * 4 >= len(data):
+        if data[1::2].count(0) > data[::2].count(0):
+            return 'utf-16-le'
+        return 'utf-16-be'
+
+    for encoding in candidates:
+        if _is_decodable(data, encoding, is_whole_file):
+            return encoding
+
+    return None
+
+
+def sniff_encoding(
+        filename: str,
+        sniff_size: int = SNIFF_SIZE,
+        candidates: Sequence[str] = DEFAULT_CANDIDATES) -> Optional[str]:
+    """Detect encoding of a file by reading at most sniff_size bytes from its head.
+
+    See `sniff_bytes` for the return value.
+    """
+    with open(filename, 'rb') as fp:
+        data = fp.read(sniff_size)
+    return sniff_bytes(data, len(data) < sniff_size, candidates)
+
+
+def get_decode_codec(encoding: str) -> str:
+    """Returns the codec to be used for decoding a file detected as encoding."""
+    return DECODE_CODECS.get(encoding, encoding)
+
@@ -0,0 +1,93 @@
+import fnmatch
+import os
+import re
+
+from typing import Iterator, Optional, Pattern, Sequence
+
+
+def _compile_globs(patterns: Sequence[str]) -> Optional[Pattern]:
+    """Compile glob patterns into one regular expression (None if there is no
+    pattern), such that an entry is matched against all patterns at once.
+    """
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{fnmatch.translate(p)})' for p in patterns))
+
+
+def _is_matched(glob: Pattern, entry: os.DirEntry, relative_path: str) -> bool:
+    # relative path is matched as well, thus a pattern like `sub/*.smi` can be used
+    return glob.match(entry.name) is not None or glob.match(relative_path) is not None
+
+
+def walk_files(
+        root: str,
+        include: Sequence[str] = (),
+        exclude: Sequence[str] = (),
+        recursive: bool = True,
+        follow_symlinks: bool = False) -> Iterator[os.DirEntry]:
+    """Yield entries of files under root lazily.
+
+    Entries are read by `os.scandir`, thus file type and (on Windows) stat
+    information cached in `os.DirEntry` are reused without extra system calls.
+    Directories are visited depth first while their entries are yielded, such
+    that files can be processed as soon as they are found and memory usage does
+    not grow with the number of files. The order of entries is the order of
+    the file system (not sorted).
+
+    Glob patterns (`fnmatch` syntax, case sensitive) are matched against the
+    base name and the path relative to root (with `/` as separator).
+
+    Args:
+        root (str): a directory to walk
+        include (Sequence[str], optional): globs of files to yield. Defaults to all files.
+        exclude (Sequence[str], optional): globs of files and directories to skip, an excluded directory is not
+            visited. Defaults to nothing.
+        recursive (bool, optional): visit subdirectories. Defaults to True.
+        follow_symlinks (bool, optional): yield symbolic links to files. Defaults to False. Symbolic links to
+            directories are never visited (as `os.walk` by default), thus a link loop cannot be walked forever.
+
+    Yields:
+        os.DirEntry: an entry of a file whose `path` starts with root
+    """
+    include_glob = _compile_globs(include)
+    exclude_glob = _compile_globs(exclude)
+    yield from _walk(root, '', include_glob, exclude_glob, recursive, follow_symlinks)
+
+
+def _walk(
+        directory: str,
+        relative_dir: str,
+        include_glob: Optional[Pattern],
+        exclude_glob: Optional[Pattern],
+        recursive: bool,
+        follow_symlinks: bool) -> Iterator[os.DirEntry]:
+    subdirectories = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            relative_path = relative_dir + entry.name
+            if exclude_glob is not None and _is_matched(exclude_glob, entry, relative_path):
+                continue
+
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        subdirectories.append((entry.path, relative_path + '/'))
+                    continue
+                if entry.is_symlink() and not follow_symlinks:
+                    continue
+                if not entry.is_file():
+                    continue
+            except OSError:
+                # e.g. removed while walking
+                continue
+
+            if include_glob is None or _is_matched(include_glob, entry, relative_path):
+                yield entry
+
+    # subdirectories are visited after the directory is closed, thus only one directory is open at once
+    for subdirectory, relative_subdirectory in subdirectories:
+        try:
+            yield from _walk(
+                subdirectory, relative_subdirectory, include_glob, exclude_glob, recursive, follow_symlinks)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
@@ -0,0 +1,68 @@
+import json
+import os
+import os.path as path
+import tempfile
+
+from typing import Any, Dict, Tuple
+
+
+def _get_umask() -> int:
+    # the umask can only be read by setting it, thus it is restored at once
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+class SidecarIndex:
+    """Sidecar index of values computed from files (e.g. detected encodings or
+    capture times) keyed by file path.
+
+    An entry is valid only while the size and the modification time of the file
+    are the same as when its value was computed, thus repeated runs over the
+    same tree skip unchanged files. Values must be JSON serializable.
+    """
+
+    def __init__(self, index_filename: str):
+        self.index_filename = index_filename
+        self.__entries: Dict[str, Tuple[int, int, Any]] = {}
+        self.__is_changed = False
+        try:
+            with open(index_filename) as fp:
+                self.__entries = {k: tuple(v) for k, v in json.load(fp).items()}
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            # broken index is rebuilt
+            pass
+
+    def get(self, filename: str, stat: os.stat_result) -> Tuple[bool, Any]:
+        """Returns (found, value) of filename having stat."""
+        entry = self.__entries.get(path.realpath(filename))
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return True, entry[2]
+        return False, None
+
+    def set(self, filename: str, stat: os.stat_result, value: Any) -> None:
+        key = path.realpath(filename)
+        entry = (stat.st_size, stat.st_mtime_ns, value)
+        if self.__entries.get(key) != entry:
+            self.__entries[key] = entry
+            self.__is_changed = True
+
+    def save(self) -> None:
+        """Write the index atomically (only if it is changed)."""
+        if not self.__is_changed:
+            return
+
+        index_dir = path.dirname(self.index_filename) or '.'
+        fd, temp_filename = tempfile.mkstemp(dir=index_dir, prefix='.', suffix='.tmp')
+        try:
+            with open(fd, 'w') as fp:
+                json.dump(self.__entries, fp, separators=(',', ':'))
+            # a temporary file is only readable by its owner, the index gets the mode of a file created as usual
+            os.chmod(temp_filename, 0o666 & ~_get_umask())
+            os.replace(temp_filename, self.index_filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+        self.__is_changed = False
@@ -0,0 +1,170 @@
+import threading
+import time
+
+from typing import Any, Callable, Optional
+
+
+def _format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+def _format_bytes(number_of_bytes: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if number_of_bytes < 1024:
+            return f"{number_of_bytes:.1f} {unit}"
+        number_of_bytes /= 1024
+    return f"{number_of_bytes:.1f} TB"
+
+
+class ProgressReporter:
+    """Report progress of items (and bytes) at most once per interval.
+
+    Output is limited by time instead of the number of items, thus `update`
+    can be called for every item in a tight loop: it costs a lock and a clock
+    read unless a line is due. It can be updated from multiple threads, and
+    from other processes through `remote`.
+
+    Example:
+        with ProgressReporter(len(files), name="Copying") as progress:
+            for f in files:
+                copy(f)
+                progress.update(nbytes=size_of(f))
+    """
+
+    def __init__(
+            self,
+            total: Optional[int] = None,
+            name: str = "Progress",
+            interval: float = 1.0,
+            output: Callable[[str], Any] = print):
+        """
+        Args:
+            total (int, optional): the number of items to process, shown with ETA if given. Defaults to None.
+            name (str, optional): a prefix of lines. Defaults to "Progress".
+            interval (float, optional): minimum seconds between lines. Defaults to 1.0.
+            output (Callable, optional): a function writing a line, e.g. `logger.info`. Defaults to print.
+        """
+        self.total = total
+        self.name = name
+        self.interval = interval
+        self.__output = output
+        self.__lock = threading.Lock()
+        self.__start = time.monotonic()
+        self.__next_report = self.__start + interval
+        self.items = 0
+        self.bytes = 0
+        self.__remote_queue = None
+        self.__drainer: Optional[threading.Thread] = None
+
+    def update(self, items: int = 1, nbytes: int = 0) -> None:
+        """Add processed items and bytes, and write a line if interval passed."""
+        now = time.monotonic()
+        with self.__lock:
+            self.items += items
+            self.bytes += nbytes
+            if now < self.__next_report:
+                return
+            self.__next_report = now + self.interval
+            line = self.__format(now)
+        self.__output(line)
+
+    def __format(self, now: float) -> str:
+        elapsed = max(now - self.__start, 1e-9)
+        rate = self.items / elapsed
+        if self.total:
+            line = f"{self.name}: {self.items}/{self.total} ({self.items / self.total:.1%}), {rate:.1f} items/s"
+        else:
+            line = f"{self.name}: {self.items} items, {rate:.1f} items/s"
+        if self.bytes:
+            line += f", {_format_bytes(self.bytes / elapsed)}/s"
+        if self.total and rate > 0:
+            line += f", ETA {_format_seconds(max(self.total - self.items, 0) / rate)}"
+        return line
+
+    def summary(self) -> str:
+        """Returns a line summarizing the whole progress."""
+        with self.__lock:
+            now = time.monotonic()
+            elapsed = max(now - self.__start, 1e-9)
+            line = f"{self.name}: {self.items} items in {_format_seconds(elapsed)} ({self.items / elapsed:.1f} items/s"
+            if self.bytes:
+                line += f", {_format_bytes(self.bytes)}, {_format_bytes(self.bytes / elapsed)}/s"
+            return line + ")"
+
+    def remote(self, manager: Any, flush_interval: float = 0.2) -> "RemoteProgress":
+        """Returns a picklable handle updating this reporter from other processes.
+
+        Args:
+            manager (Any): a started `multiprocessing.Manager()` creating a queue shared with the processes
+            flush_interval (float, optional): seconds for which a handle accumulates updates before sending them.
+                Defaults to 0.2.
+        """
+        if self.__remote_queue is None:
+            self.__remote_queue = manager.Queue()
+            self.__drainer = threading.Thread(target=self.__drain, daemon=True)
+            self.__drainer.start()
+        return RemoteProgress(self.__remote_queue, flush_interval)
+
+    def __drain(self) -> None:
+        while True:
+            update = self.__remote_queue.get()
+            if update is None:
+                return
+            self.update(*update)
+
+    def close(self) -> None:
+        """Apply remaining updates from other processes and write the summary."""
+        if self.__drainer is not None:
+            self.__remote_queue.put(None)
+            self.__drainer.join()
+            self.__drainer = None
+        self.__output(self.summary())
+
+    def __enter__(self) -> "ProgressReporter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class RemoteProgress:
+    """Handle of `ProgressReporter` used in another process.
+
+    Updates are accumulated in the process and sent to the reporter at most
+    once per flush interval, thus it is cheap per item as well. `flush` must
+    be called at the end of a task to send the rest.
+    """
+
+    def __init__(self, update_queue: Any, flush_interval: float):
+        self.__queue = update_queue
+        self.__flush_interval = flush_interval
+        self.__lock = threading.Lock()
+        self.__items = 0
+        self.__bytes = 0
+        self.__next_flush = 0.0
+
+    def __getstate__(self):
+        # counts not sent yet stay in the process
+        return {'queue': self.__queue, 'flush_interval': self.__flush_interval}
+
+    def __setstate__(self, state):
+        self.__init__(state['queue'], state['flush_interval'])
+
+    def update(self, items: int = 1, nbytes: int = 0) -> None:
+        now = time.monotonic()
+        with self.__lock:
+            self.__items += items
+            self.__bytes += nbytes
+            if now < self.__next_flush:
+                return
+            self.__next_flush = now + self.__flush_interval
+            update, self.__items, self.__bytes = (self.__items, self.__bytes), 0, 0
+        self.__queue.put(update)
+
+    def flush(self) -> None:
+        with self.__lock:
+            update, self.__items, self.__bytes = (self.__items, self.__bytes), 0, 0
+        if update != (0, 0):
+            self.__queue.put(update)
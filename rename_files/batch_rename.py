@@ -0,0 +1,250 @@
+import json
+import os
+import os.path as path
+import time
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from copy_engine import _get_device
+
+# the last record of a journal whose batch is committed
+_COMMITTED = 'committed'
+
+
+class RenamePlan:
+    """Ordered renames moving each source to its target without overwriting
+    any other file in the batch.
+
+    Renames are grouped into chains (a -> b while b -> c, thus b -> c is
+    executed first) and cycles (a -> b while b -> a). A cycle is broken by
+    moving one of its files to a temporary name first and moving it to its
+    target last, thus only one extra rename per cycle is needed.
+    """
+
+    def __init__(self, steps: List[Tuple[str, str]], number_of_files: int, number_of_cycles: int):
+        self.steps = steps
+        self.number_of_files = number_of_files
+        self.number_of_cycles = number_of_cycles
+
+    def __str__(self):
+        return (
+            f"{self.number_of_files} files in {len(self.steps)} renames"
+            f" ({self.number_of_cycles} cycles broken with temporary names)"
+        )
+
+
+def plan_renames(pairs: Iterable[Tuple[str, str]]) -> RenamePlan:
+    """Compute a rename plan from (source, target) pairs.
+
+    Nothing is renamed, thus collisions are reported before any file is
+    touched.
+
+    Raises:
+        ValueError: if a source or a target is given more than once, or a
+            source and its target are on different file systems
+        FileNotFoundError: if a source does not exist
+        FileExistsError: if a target exists and is not a source of the batch
+    """
+    target_of: Dict[str, str] = {}
+    source_of: Dict[str, str] = {}
+    for src_filename, dst_filename in pairs:
+        src_filename = path.abspath(src_filename)
+        dst_filename = path.abspath(dst_filename)
+        if src_filename in target_of:
+            raise ValueError(f"Source {src_filename} is given more than once")
+        if dst_filename in source_of:
+            raise ValueError(f"Target {dst_filename} is planned for {source_of[dst_filename]} and {src_filename}")
+        target_of[src_filename] = dst_filename
+        source_of[dst_filename] = src_filename
+
+    number_of_files = len(target_of)
+    devices: Dict[str, int] = {}
+    for src_filename, dst_filename in list(target_of.items()):
+        if src_filename == dst_filename:
+            del target_of[src_filename]
+            del source_of[dst_filename]
+            continue
+
+        src_stat = os.stat(src_filename)
+        dst_dir = path.dirname(dst_filename)
+        if dst_dir not in devices:
+            devices[dst_dir] = _get_device(dst_dir)
+        if src_stat.st_dev != devices[dst_dir]:
+            raise ValueError(f"{src_filename} and {dst_filename} are on different file systems")
+        if dst_filename not in target_of and path.lexists(dst_filename):
+            raise FileExistsError(f"Target {dst_filename} of {src_filename} already exists")
+
+    steps: List[Tuple[str, str]] = []
+    visited = set()
+
+    # chains end at a target which is not a source, walked backward from there
+    for dst_filename, src_filename in source_of.items():
+        if dst_filename in target_of:
+            continue
+        while src_filename is not None:
+            steps.append((src_filename, target_of[src_filename]))
+            visited.add(src_filename)
+            src_filename = source_of.get(src_filename)
+
+    # remaining sources are in cycles
+    batch_id = f'{os.getpid()}-{time.time_ns()}'
+    number_of_cycles = 0
+    for first_src in target_of:
+        if first_src in visited:
+            continue
+        first_dst = target_of[first_src]
+        temp_filename = path.join(path.dirname(first_dst), f'.{batch_id}-{number_of_cycles}.rename')
+        steps.append((first_src, temp_filename))
+        visited.add(first_src)
+        src_filename = source_of[first_src]
+        while src_filename != first_src:
+            steps.append((src_filename, target_of[src_filename]))
+            visited.add(src_filename)
+            src_filename = source_of[src_filename]
+        steps.append((temp_filename, first_dst))
+        number_of_cycles += 1
+
+    return RenamePlan(steps, number_of_files, number_of_cycles)
+
+
+def _fsync_dirs(dirs: Iterable[str]) -> None:
+    if os.name != 'posix':
+        return
+    for directory in dirs:
+        if not path.isdir(directory):
+            continue
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def batch_rename(
+        pairs: Iterable[Tuple[str, str]],
+        journal_filename: str,
+        on_renamed: Optional[Callable[[int, str, str], None]] = None) -> RenamePlan:
+    """Rename all (source, target) pairs as a transaction.
+
+    The plan (see `plan_renames`) is written to journal_filename and synced
+    before the first rename, then the number of done renames is appended after
+    each rename, and a commit record after the last one. If a rename fails,
+    the done renames are undone and the error is raised. If the process is
+    killed on the way, the batch can be rolled back with `undo_batch_rename`,
+    which works after the batch is committed as well.
+
+    A committed journal of a previous batch at journal_filename is kept with a
+    timestamped name (e.g. `.rename-journal.1700000000000000000.jsonl`), thus
+    batches can still be undone one by one from the last one.
+
+    Args:
+        pairs (Iterable[Tuple[str, str]]): (source, target) file names
+        journal_filename (str): a file to write the undo journal
+        on_renamed (Callable, optional): called with (the number of renamed files, source, target) after each rename.
+            Defaults to None.
+
+    Returns:
+        RenamePlan: the executed plan
+
+    Raises:
+        FileExistsError: if a journal of an uncommitted batch exists at journal_filename (see `plan_renames` for
+            others)
+    """
+    plan = plan_renames(pairs)
+    if path.exists(journal_filename):
+        if not _read_journal(journal_filename)[2]:
+            raise FileExistsError(f"Journal {journal_filename} of an uncommitted batch exists, undo it first")
+        root, ext = path.splitext(journal_filename)
+        os.rename(journal_filename, f'{root}.{time.time_ns()}{ext}')
+
+    # the journal is often kept in a target directory, which may not be created yet
+    journal_dir = path.dirname(path.abspath(journal_filename))
+    os.makedirs(journal_dir, exist_ok=True)
+    with open(journal_filename, 'w') as fp:
+        for step in plan.steps:
+            fp.write(json.dumps(step) + '\n')
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    dirs = {path.dirname(dst_filename) for _, dst_filename in plan.steps}
+    for directory in dirs:
+        os.makedirs(directory, exist_ok=True)
+
+    try:
+        # unbuffered, thus a progress is kept by OS even if the process is killed
+        with open(journal_filename, 'ab', buffering=0) as journal:
+            for i, (src_filename, dst_filename) in enumerate(plan.steps):
+                os.rename(src_filename, dst_filename)
+                journal.write(b'%d\n' % (i + 1))
+                if on_renamed is not None:
+                    on_renamed(i + 1, src_filename, dst_filename)
+    except BaseException:
+        undo_batch_rename(journal_filename)
+        raise
+
+    # renames are synced before the commit record, which must not precede them on disk
+    dirs.update(path.dirname(src_filename) for src_filename, _ in plan.steps)
+    _fsync_dirs(dirs)
+    with open(journal_filename, 'a') as fp:
+        fp.write(json.dumps(_COMMITTED) + '\n')
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    return plan
+
+
+def _read_journal(journal_filename: str) -> Tuple[List[Tuple[str, str]], int, bool]:
+    """Returns (renames, the number of done renames, whether it is committed) in a journal."""
+    steps = []
+    number_of_done = 0
+    is_committed = False
+    with open(journal_filename) as fp:
+        for line in fp:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line can be broken if the process is killed while writing it
+                continue
+            if record == _COMMITTED:
+                is_committed = True
+            elif isinstance(record, int):
+                number_of_done = record
+                # an undo is started on the committed batch
+                is_committed = False
+            else:
+                steps.append(tuple(record))
+
+    # the process can be killed between a rename and writing its progress. The
+    # source of the next rename exists until the rename is done, since only the
+    # rename itself moves it.
+    if number_of_done < len(steps) and not path.lexists(steps[number_of_done][0]):
+        number_of_done += 1
+
+    return steps, number_of_done, is_committed
+
+
+def undo_batch_rename(journal_filename: str) -> int:
+    """Roll back a batch renamed by `batch_rename` with its journal.
+
+    Done renames are undone in reverse order, thus the batch is rolled back
+    whether it was committed or stopped on the way. The progress is written to
+    the journal as well, such that an undo stopped on the way can be run
+    again. The journal is removed when it is done.
+
+    Returns:
+        int: the number of renames undone
+    """
+    steps, number_of_done, _ = _read_journal(journal_filename)
+
+    with open(journal_filename, 'ab', buffering=0) as journal:
+        for i in reversed(range(number_of_done)):
+            src_filename, dst_filename = steps[i]
+            # already undone if the previous undo was killed before writing its progress
+            if not (path.lexists(src_filename) and not path.lexists(dst_filename)):
+                os.rename(dst_filename, src_filename)
+            journal.write(b'%d\n' % i)
+
+    _fsync_dirs({path.dirname(f) for step in steps for f in step})
+    os.remove(journal_filename)
+
+    return number_of_done
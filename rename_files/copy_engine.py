@@ -0,0 +1,226 @@
+import errno
+import os
+import os.path as path
+import shutil
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, reflink is never used
+    fcntl = None
+
+# modes of `execute_plan`
+AUTO = 'auto' # REFLINK on the same file system, COPY otherwise (never a hard link)
+RENAME = 'rename' # move source files in place (sources are removed)
+HARDLINK = 'hardlink' # targets share the inode of their sources, only if requested explicitly
+REFLINK = 'reflink' # copy-on-write clone, falls back to COPY per file if not supported
+COPY = 'copy'
+
+MODES = (AUTO, RENAME, HARDLINK, REFLINK, COPY)
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# rough throughput used for the estimation of `CopyPlan`
+COPY_BYTES_PER_SECOND = 200 * 1024 * 1024
+LINK_FILES_PER_SECOND = 20000
+
+# errors meaning the operation is not supported between the files, thus the next fallback is tried
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOTTY, errno.EOPNOTSUPP, errno.ENOSYS}
+
+
+def _get_device(file_path: str) -> int:
+    """Returns the device of file_path or its closest existing parent (the
+    destination may not be created yet).
+    """
+    file_path = path.abspath(file_path)
+    while not path.exists(file_path):
+        file_path = path.dirname(file_path)
+    return os.stat(file_path).st_dev
+
+
+def is_same_file_system(src_filename: str, dst_filename: str) -> bool:
+    return _get_device(src_filename) == _get_device(dst_filename)
+
+
+class CopyPlan:
+    """Pairs of source and target file names to be copied with a mode.
+
+    It is computed before anything is written (see `plan_copies`), thus it
+    can be reported as a dry run.
+    """
+
+    def __init__(self, pairs: List[Tuple[str, str]], mode: str, total_bytes: int):
+        self.pairs = pairs
+        self.mode = mode
+        self.total_bytes = total_bytes
+
+    @property
+    def estimated_seconds(self) -> float:
+        """Expected time of `execute_plan` (on a single stream).
+
+        Only COPY moves the bytes, the other modes cost a metadata update per
+        file.
+        """
+        if self.mode == COPY:
+            return self.total_bytes / COPY_BYTES_PER_SECOND
+        return len(self.pairs) / LINK_FILES_PER_SECOND
+
+    def __str__(self):
+        return (
+            f"{len(self.pairs)} files ({self.total_bytes / 1048576:.1f} MB) with {self.mode},"
+            f" expected {self.estimated_seconds:.1f}s"
+        )
+
+
+def plan_copies(pairs: Iterable[Tuple[str, str]], mode: str = AUTO) -> CopyPlan:
+    """Compute a plan copying each (source, target) of pairs.
+
+    AUTO is resolved to REFLINK if the first source and target are on the
+    same file system, COPY otherwise.
+
+    Raises:
+        ValueError: if mode is unknown or a target is given more than once
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown copy mode {mode}, one of {MODES}")
+
+    pairs = list(pairs)
+    targets = set()
+    total_bytes = 0
+    for src_filename, dst_filename in pairs:
+        if dst_filename in targets:
+            raise ValueError(f"Target {dst_filename} is planned more than once")
+        targets.add(dst_filename)
+        total_bytes += os.stat(src_filename).st_size
+
+    if mode == AUTO:
+        mode = REFLINK if pairs and is_same_file_system(pairs[0][0], pairs[0][1]) else COPY
+
+    return CopyPlan(pairs, mode, total_bytes)
+
+
+def _get_temp_filename(dst_filename: str) -> str:
+    # a hidden file next to the target, thus it can be renamed to the target atomically
+    return path.join(path.dirname(dst_filename) or '.', f'.{path.basename(dst_filename)}.{os.getpid()}.tmp')
+
+
+def _replace_with_link(src_filename: str, dst_filename: str) -> None:
+    # link to a temporary name and replace the target, since link does not overwrite an existing file
+    temp_filename = _get_temp_filename(dst_filename)
+    os.link(src_filename, temp_filename)
+    try:
+        os.replace(temp_filename, dst_filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+
+def _replace_with_copy(src_filename: str, dst_filename: str) -> None:
+    # copy to a temporary name and replace the target, since the target can be a hard link of the source
+    temp_filename = _get_temp_filename(dst_filename)
+    try:
+        shutil.copyfile(src_filename, temp_filename)
+        os.replace(temp_filename, dst_filename)
+    except BaseException:
+        if path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+
+def _reflink(src_filename: str, dst_filename: str) -> None:
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "Reflink is not supported on this platform", dst_filename)
+
+    # the target is not opened for writing, since it can be a hard link of the source
+    temp_filename = _get_temp_filename(dst_filename)
+    try:
+        with open(src_filename, 'rb') as src_file, open(temp_filename, 'wb') as temp_file:
+            fcntl.ioctl(temp_file.fileno(), FICLONE, src_file.fileno())
+        os.replace(temp_filename, dst_filename)
+    except BaseException:
+        if path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+
+def copy_file(src_filename: str, dst_filename: str, mode: str) -> str:
+    """Copy a file with mode (one of RENAME, HARDLINK, REFLINK and COPY).
+
+    REFLINK falls back to COPY if the file system does not support it, thus
+    a target shares its data with the source only if HARDLINK is requested.
+    HARDLINK falls back to COPY if the files are on different file systems.
+
+    Returns:
+        str: the mode actually used
+    """
+    if mode == HARDLINK and path.exists(dst_filename) and path.samefile(src_filename, dst_filename):
+        # already linked
+        return HARDLINK
+
+    if mode == RENAME:
+        os.replace(src_filename, dst_filename)
+        return RENAME
+
+    if mode == REFLINK:
+        try:
+            _reflink(src_filename, dst_filename)
+            return REFLINK
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+        mode = COPY
+
+    if mode == HARDLINK:
+        try:
+            _replace_with_link(src_filename, dst_filename)
+            return HARDLINK
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+
+    if path.exists(dst_filename) and path.samefile(src_filename, dst_filename):
+        # a hard link left by a previous run is replaced with a copy of its own
+        _replace_with_copy(src_filename, dst_filename)
+        return COPY
+
+    # uses os.sendfile on Linux
+    shutil.copyfile(src_filename, dst_filename)
+    return COPY
+
+
+def execute_plan(
+        plan: CopyPlan,
+        number_of_workers: int = 8,
+        on_copied: Optional[Callable[[int, str, str], None]] = None) -> Counter:
+    """Copy all files of plan in parallel with a thread pool.
+
+    Args:
+        plan (CopyPlan): a plan from `plan_copies`
+        number_of_workers (int, optional): the number of threads. Defaults to 8.
+        on_copied (Callable, optional): called with (the number of copied files, source, target) after each file is
+            copied, in the order of plan. Defaults to None.
+
+    Returns:
+        Counter: the number of files per mode actually used
+    """
+    modes = Counter()
+    if not plan.pairs:
+        return modes
+
+    for dst_dir in {path.dirname(dst_filename) for _, dst_filename in plan.pairs}:
+        if dst_dir:
+            os.makedirs(dst_dir, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=number_of_workers) as executor:
+        results = executor.map(lambda pair: copy_file(pair[0], pair[1], plan.mode), plan.pairs)
+        for i, (used_mode, (src_filename, dst_filename)) in enumerate(zip(results, plan.pairs)):
+            modes[used_mode] += 1
+            if on_copied is not None:
+                on_copied(i + 1, src_filename, dst_filename)
+
+    return modes
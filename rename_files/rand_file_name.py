@@ -1,5 +1,5 @@
+import sys
 from os import (
-    listdir,
     makedirs,
     rename,
 )
@@ -8,7 +8,17 @@ from os.path import (
     join,
 )
 from random import shuffle
-from shutil import copyfile
+
+from copy_engine import (
+    AUTO,
+    execute_plan,
+    plan_copies,
+)
+
+sys.path.append(path.join(path.dirname(path.realpath(__file__)), '..', 'file_walker'))
+sys.path.append(path.join(path.dirname(path.realpath(__file__)), '..', 'progress_reporter'))
+from file_walker import walk_files
+from progress_reporter import ProgressReporter
 
 def get_cwd_files_without_py_script(path_name):
     """Given a file path path_name, get all files in path_name directory
@@ -18,19 +28,20 @@ def get_cwd_files_without_py_script(path_name):
         path_name (str): a file direction to search
 
     Returns:
-        list[str]: list containing all file names
+        list[str]: list containing all file paths (joined with path_name)
     """
-    return [f for f in listdir(path_name)
-            if (path.isfile(f) and not f.endswith('.py'))]
+    return [entry.path for entry in walk_files(path_name, exclude=['*.py'], recursive=False)]
 
 
-def rand_rename_files(src_file_path, dst_file_path):
+def rand_rename_files(src_file_path, dst_file_path, mode=AUTO, dry_run=False):
     """Get all files in src_file_path and change file names and save them to
     dst_file_path.
 
     Args:
         src_file_path (str): a source file path
         dst_file_path (str): a destination file path
+        mode (str): one of `copy_engine.MODES`
+        dry_run (bool): only print the plan
 
     Returns:
         None
@@ -39,24 +50,31 @@ def rand_rename_files(src_file_path, dst_file_path):
     file_list = get_cwd_files_without_py_script(src_file_path)
     num_of_files = len(file_list)
 
-    # create folder if not exists
-    if not path.exists(dst_file_path):
-        makedirs(dst_file_path)
-
     # shuffle numbers to be assigned to files
     new_name_list = list(range(1, num_of_files + 1))
     shuffle(new_name_list)
 
+    new_names = []
     for i in range(num_of_files):
         # zero fill up to the number of digits in num_of_files
         cur_file_num = str(new_name_list[i]).zfill(len(str(num_of_files)))
         
-        cur_new_name = path.join(
+        new_names.append(path.join(
             dst_file_path, "{}.{}".format(
                 cur_file_num, 
-                file_list[i].split('.')[-1]))
-        print("copying {} to {}".format(file_list[i], cur_new_name))
-        copyfile(file_list[i], cur_new_name)
+                file_list[i].split('.')[-1])))
+
+    plan = plan_copies(zip(file_list, new_names), mode)
+    print("Plan: {}".format(plan))
+    if dry_run:
+        return
+
+    # create folder if not exists
+    if not path.exists(dst_file_path):
+        makedirs(dst_file_path)
+
+    with ProgressReporter(num_of_files, name="Copying") as progress:
+        execute_plan(plan, on_copied=lambda *_: progress.update())
 
 if __name__ == '__main__':
     src_file_path = '.'
@@ -1,76 +1,134 @@
+import os
 import os.path as path
+import sys
 
 from os import (
-    listdir,
     makedirs,
     rename,
 )
-from shutil import copyfile
-from typing import List
+from typing import List, Optional
 
+sys.path.append(path.join(path.dirname(path.realpath(__file__)), '..', 'file_walker'))
+sys.path.append(path.join(path.dirname(path.realpath(__file__)), '..', 'progress_reporter'))
+from batch_rename import (
+    batch_rename,
+    plan_renames,
+)
+from copy_engine import (
+    AUTO,
+    RENAME,
+    execute_plan,
+    plan_copies,
+)
+from sort_keys import (
+    NAME,
+    sort_entries,
+)
+from file_walker import walk_files
+from progress_reporter import ProgressReporter
 
-def get_cwd_files_without_py_script(path_name: str) -> List[str]:
-    """Given a file path path_name, get all files in path_name directory
-    excluding py script.
+
+def get_cwd_file_entries_without_py_script(path_name: str) -> List[os.DirEntry]:
+    """Given a file path path_name, get entries of all files in path_name
+    directory excluding py script and hidden files (e.g. rename journal).
 
     Args:
         path_name (str): a file direction to search
 
     Returns:
-        list[str]: list containing all file names
+        list[os.DirEntry]: list containing all file entries
     """
-    return [path.join(path_name, f) for f in listdir(path_name)
-            if (path.isfile(path.join(path_name, f)) and not f.endswith('.py'))]
+    return list(walk_files(path_name, exclude=['*.py', '.*'], recursive=False))
 
 
-def _is_time_to_log(
-        current_iteration: int,
-        number_of_files: int,
-        percentile_to_log: float = 0.2) -> bool:
+def get_cwd_files_without_py_script(path_name: str) -> List[str]:
+    """Given a file path path_name, get all files in path_name directory
+    excluding py script and hidden files (e.g. rename journal).
 
-    return current_iteration % int(number_of_files * percentile_to_log) == 0
+    Args:
+        path_name (str): a file direction to search
+
+    Returns:
+        list[str]: list containing all file names
+    """
+    return [entry.path for entry in get_cwd_file_entries_without_py_script(path_name)]
 
 
 def rename_ordered_files(
         src_file_path: str,
         dst_file_path: str,
-        filename_fmt: str) -> None:
+        filename_fmt: str,
+        mode: str = AUTO,
+        dry_run: bool = False,
+        number_of_workers: int = 8,
+        journal_filename: Optional[str] = None,
+        sort_key: str = NAME) -> None:
     """Get all files in src_file_path and change file names and save them to
     dst_file_path.
 
+    All target names are computed first, then files are copied in parallel
+    (see `copy_engine`). With RENAME mode, files are renamed in place as a
+    transaction with an undo journal instead (see `batch_rename`).
+
     Args:
         src_file_path (str): a source file path
         dst_file_path (str): a destination file path
         filename_fmt (str): a format string to be used for a file renaming
+        mode (str, optional): one of `copy_engine.MODES`. Defaults to AUTO.
+        dry_run (bool, optional): only print the plan. Defaults to False.
+        number_of_workers (int, optional): the number of threads copying files. Defaults to 8.
+        journal_filename (str, optional): undo journal of RENAME mode. Defaults to `.rename-journal.jsonl` in
+            dst_file_path.
+        sort_key (str, optional): order of files (one of `sort_keys.SORT_KEYS`). Defaults to NAME. Capture times are
+            cached in `.sort-keys.json` in src_file_path.
 
     Returns:
         None
 
     """
-    file_list = get_cwd_files_without_py_script(src_file_path)
-
-    # sort the list by the filename
-    file_list.sort()
+    entries = sort_entries(
+        get_cwd_file_entries_without_py_script(src_file_path),
+        sort_key,
+        path.join(src_file_path, '.sort-keys.json'),
+        number_of_workers)
+    file_list = [entry.path for entry in entries]
     num_of_files = len(file_list)
 
-    # create folder if not exists
-    if not path.exists(dst_file_path):
-        makedirs(dst_file_path)
-
     # rename files in order (by number)
+    new_names = []
     for i in range(num_of_files):
         # zero fill up to the number of digits in num_of_files
         cur_file_num = str(i + 1).zfill(len(str(num_of_files)))
 
         new_file_name = filename_fmt.format(cur_file_num)
-        cur_new_name = path.join(
+        new_names.append(path.join(
             dst_file_path, "{}.{}".format(
                 new_file_name,
-                file_list[i].split('.')[-1]))
+                file_list[i].split('.')[-1])))
+
+    if mode == RENAME:
+        if dry_run:
+            print("Plan: {}".format(plan_renames(zip(file_list, new_names))))
+            return
+        journal_filename = journal_filename or path.join(dst_file_path, '.rename-journal.jsonl')
+        with ProgressReporter(name="Renaming") as progress:
+            rename_plan = batch_rename(
+                zip(file_list, new_names), journal_filename, lambda *_: progress.update())
+        print("Renamed {} (undo journal: {})".format(rename_plan, journal_filename))
+        return
+
+    plan = plan_copies(zip(file_list, new_names), mode)
+    print("Plan: {}".format(plan))
+    if dry_run:
+        return
+
+    # create folder if not exists
+    if not path.exists(dst_file_path):
+        makedirs(dst_file_path)
 
-        if _is_time_to_log(i, num_of_files):
-            print("Renaming {}th file({})".format(cur_file_num, cur_new_name))
-        copyfile(file_list[i], cur_new_name)
+    with ProgressReporter(num_of_files, name="Renaming") as progress:
+        modes = execute_plan(plan, number_of_workers, lambda *_: progress.update())
+    print("Renamed {} files ({})".format(num_of_files, dict(modes)))
 
 if __name__ == '__main__':
     src_file_path = './source-folder'
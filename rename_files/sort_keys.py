@@ -0,0 +1,234 @@
+import os
+import re
+import struct
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sidecar_index import SidecarIndex
+
+# keys of `sort_entries`
+NAME = 'name' # lexicographic order of paths
+NATURAL = 'natural' # numbers in names are compared as numbers (img2 < img10)
+MTIME = 'mtime'
+CTIME = 'ctime' # creation time on Windows, metadata change time on Unix
+CAPTURE_TIME = 'capture_time' # EXIF (JPEG, TIFF based raw) or MP4/MOV header, modification time if not found
+
+SORT_KEYS = (NAME, NATURAL, MTIME, CTIME, CAPTURE_TIME)
+
+# APP1 segment holding EXIF is at most 64 KiB, thus TIFF based files are parsed within this size
+_HEADER_SIZE = 65536
+
+# seconds between 1904-01-01 (MP4 epoch) and 1970-01-01
+_MP4_EPOCH_OFFSET = 2082844800
+
+# EXIF tags in the order of preference
+_DATE_TIME_ORIGINAL = 0x9003
+_DATE_TIME_DIGITIZED = 0x9004
+_DATE_TIME = 0x0132
+_EXIF_IFD_POINTER = 0x8769
+
+_NUMBER_PATTERN = re.compile(r'(\d+)')
+
+
+def natural_key(name: str) -> Tuple:
+    """Key comparing numbers in name as numbers (`img2` < `img10`).
+
+    Split parts are text and number in turn (starting with text which can be
+    empty), thus the same position always has the same type.
+    """
+    return tuple(
+        int(part) if i % 2 else part.lower()
+        for i, part in enumerate(_NUMBER_PATTERN.split(name))
+    )
+
+
+def _parse_exif_date_time(value: bytes) -> Optional[float]:
+    try:
+        return datetime.strptime(value.rstrip(b'\x00 ').decode('ascii'), '%Y:%m:%d %H:%M:%S').timestamp()
+    except ValueError:
+        # e.g. "0000:00:00 00:00:00" written by some cameras
+        return None
+
+
+def _read_tiff_date_time(data: bytes) -> Optional[float]:
+    """Read date time tags of TIFF structure (EXIF payload or TIFF based raw)."""
+    byte_order = '<' if data[:2] == b'II' else '>'
+
+    def read_ifd(offset: int) -> Dict[int, Tuple[int, int, int, int]]:
+        # tag -> (type, the number of values, value or offset of values, offset of the value field)
+        (count,) = struct.unpack_from(byte_order + 'H', data, offset)
+        entries = {}
+        for i in range(count):
+            entry_offset = offset + 2 + i * 12
+            tag, value_type, number_of_values, value = struct.unpack_from(byte_order + 'HHII', data, entry_offset)
+            entries[tag] = (value_type, number_of_values, value, entry_offset + 8)
+        return entries
+
+    def read_ascii(entry: Tuple[int, int, int, int]) -> bytes:
+        _, number_of_values, value, value_offset = entry
+        if number_of_values <= 4:
+            return data[value_offset:value_offset + number_of_values]
+        return data[value:value + number_of_values]
+
+    (ifd0_offset,) = struct.unpack_from(byte_order + 'I', data, 4)
+    ifd0 = read_ifd(ifd0_offset)
+    tags = {}
+    if _EXIF_IFD_POINTER in ifd0:
+        tags.update(read_ifd(ifd0[_EXIF_IFD_POINTER][2]))
+    for tag in (_DATE_TIME_ORIGINAL, _DATE_TIME_DIGITIZED):
+        if tag in tags:
+            timestamp = _parse_exif_date_time(read_ascii(tags[tag]))
+            if timestamp is not None:
+                return timestamp
+    if _DATE_TIME in ifd0:
+        return _parse_exif_date_time(read_ascii(ifd0[_DATE_TIME]))
+    return None
+
+
+def _read_jpeg_date_time(fp) -> Optional[float]:
+    fp.seek(2)
+    while True:
+        marker = fp.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF or marker[1] in (0xD9, 0xDA):
+            # metadata segments are before the start of scan
+            return None
+        (length,) = struct.unpack('>H', fp.read(2))
+        if marker[1] == 0xE1:
+            segment = fp.read(length - 2)
+            if segment.startswith(b'Exif\x00\x00'):
+                return _read_tiff_date_time(segment[6:])
+        else:
+            fp.seek(length - 2, os.SEEK_CUR)
+
+
+def _read_mp4_date_time(fp, file_size: int) -> Optional[float]:
+    """Read creation time of `mvhd` box by seeking over the other boxes
+    (`moov` can be at the end of the file).
+    """
+    def iterate_boxes(start: int, end: int):
+        offset = start
+        while offset + 8 <= end:
+            fp.seek(offset)
+            size, box_type = struct.unpack('>I4s', fp.read(8))
+            header_size = 8
+            if size == 1:
+                (size,) = struct.unpack('>Q', fp.read(8))
+                header_size = 16
+            elif size == 0:
+                size = end - offset
+            if size < header_size:
+                return
+            yield box_type, offset + header_size, offset + size
+            offset += size
+
+    for box_type, start, end in iterate_boxes(0, file_size):
+        if box_type != b'moov':
+            continue
+        for child_type, child_start, _ in iterate_boxes(start, end):
+            if child_type == b'mvhd':
+                fp.seek(child_start)
+                version = fp.read(4)[0]
+                if version == 1:
+                    (creation_time,) = struct.unpack('>Q', fp.read(8))
+                else:
+                    (creation_time,) = struct.unpack('>I', fp.read(4))
+                return creation_time - _MP4_EPOCH_OFFSET if creation_time else None
+        return None
+    return None
+
+
+def read_capture_time(filename: str) -> Optional[float]:
+    """Read capture time (POSIX timestamp) from the header of a JPEG, TIFF based
+    raw (CR2, NEF, DNG, ...) or MP4/MOV file.
+
+    Only header bytes are read, thus it is cheap for large videos as well.
+    EXIF time has no time zone, thus it is regarded as local time.
+
+    Returns:
+        Optional[float]: the timestamp, None if the file has no capture time or is not supported
+    """
+    try:
+        with open(filename, 'rb') as fp:
+            head = fp.read(12)
+            if head[:2] == b'\xff\xd8':
+                return _read_jpeg_date_time(fp)
+            if head[:4] in (b'II*\x00', b'MM\x00*'):
+                return _read_tiff_date_time(head + fp.read(_HEADER_SIZE - len(head)))
+            if head[4:8] in (b'ftyp', b'moov', b'mdat', b'wide', b'free'):
+                return _read_mp4_date_time(fp, os.fstat(fp.fileno()).st_size)
+    except (struct.error, IndexError, OSError):
+        # truncated or broken header
+        return None
+    return None
+
+
+def _get_capture_times(
+        entries: List[os.DirEntry],
+        index_filename: Optional[str],
+        number_of_workers: int) -> List[Optional[float]]:
+    index = SidecarIndex(index_filename) if index_filename else None
+    stats = [entry.stat() for entry in entries]
+    capture_times: List[Optional[float]] = [None] * len(entries)
+    missed = []
+    for i, (entry, stat) in enumerate(zip(entries, stats)):
+        found = False
+        if index is not None:
+            found, capture_times[i] = index.get(entry.path, stat)
+        if not found:
+            missed.append(i)
+
+    # headers are read in threads since it is bound to I/O latency
+    with ThreadPoolExecutor(max_workers=number_of_workers) as executor:
+        for i, capture_time in zip(missed, executor.map(read_capture_time, [entries[i].path for i in missed])):
+            capture_times[i] = capture_time
+            if index is not None:
+                index.set(entries[i].path, stats[i], capture_time)
+
+    if index is not None:
+        index.save()
+
+    return [
+        capture_time if capture_time is not None else stat.st_mtime
+        for capture_time, stat in zip(capture_times, stats)
+    ]
+
+
+def sort_entries(
+        entries: List[os.DirEntry],
+        key: str = NAME,
+        index_filename: Optional[str] = None,
+        number_of_workers: int = 8) -> List[os.DirEntry]:
+    """Sort entries (e.g. from `walk_files`) by key.
+
+    Times are taken from the stat cached in the entries. Ties of time keys are
+    ordered by natural order of names.
+
+    Args:
+        entries (List[os.DirEntry]): entries to sort
+        key (str, optional): one of SORT_KEYS. Defaults to NAME.
+        index_filename (str, optional): a sidecar index caching capture times (see `sidecar_index.SidecarIndex`).
+            Defaults to None (not cached).
+        number_of_workers (int, optional): the number of threads reading headers for CAPTURE_TIME. Defaults to 8.
+
+    Returns:
+        List[os.DirEntry]: sorted entries
+
+    Raises:
+        ValueError: if key is unknown
+    """
+    key_funcs: Dict[str, Callable[[os.DirEntry], Tuple]] = {
+        NAME: lambda entry: (entry.path,),
+        NATURAL: lambda entry: natural_key(entry.name),
+        MTIME: lambda entry: (entry.stat().st_mtime_ns, natural_key(entry.name)),
+        CTIME: lambda entry: (entry.stat().st_ctime_ns, natural_key(entry.name)),
+    }
+    if key == CAPTURE_TIME:
+        capture_times = _get_capture_times(entries, index_filename, number_of_workers)
+        keys = [(capture_time, natural_key(entry.name)) for capture_time, entry in zip(capture_times, entries)]
+        return [entry for _, entry in sorted(zip(keys, entries), key=lambda pair: pair[0])]
+    if key not in key_funcs:
+        raise ValueError(f"Unknown sort key {key}, one of {SORT_KEYS}")
+
+    return sorted(entries, key=key_funcs[key])
@@ -15,7 +15,7 @@ Objective of this constant implementation is to reduce errors for whom using thi
     - To maximize IDE's auto complete heaven, all class attributes are explicitly declared
 """
 from typing import Tuple
-from static_attr_object import StaticAttrObject
+from static_attr_object import StaticAttrMeta, StaticAttrObject
 
 
 class _RepaymentPolicyVersionBase(StaticAttrObject):
@@ -33,7 +33,7 @@ class _RepaymentPolicyVersionBase(StaticAttrObject):
         super().__init__(**kwargs)
 
 
-class _RepaymentPolicyTypeMetaClass(type):
+class _RepaymentPolicyTypeMetaClass(StaticAttrMeta):
     """상환 타입 meta class
     """
     def __getattribute__(self, item):
@@ -1,7 +1,166 @@
+import keyword
+
 from inspect import isclass
 
 
-class StaticAttrObject:
+def _scan_attr_names(cls):
+    """Returns names of class attributes declared in `cls` itself (not in its base classes)
+
+    Returns:
+        frozenset[str]: names of attributes
+    """
+    return frozenset(
+        key
+        for key, value in cls.__dict__.items()
+        if (not key.startswith('_')     # This includes all variables start with `_` (i.e. `__double_underline`)
+            and not type(value) is classmethod
+            and not type(value) is staticmethod
+            and not type(value) is property
+            and (isclass(value) or not callable(value))      # To remove methods but not object attribute
+            )
+    )
+
+
+# methods generated for each subclass
+_GENERATED_METHODS = ('__init__', '__eq__', '__hash__', '__repr__')
+
+
+def _create_function(name, args, body, local_names):
+    """Create a function from source lines like dataclasses does.
+
+    Names in `local_names` are bound to the function (as closure variables) such that the body looks them up fast.
+    """
+    source = '\n'.join(
+        ['def __create_function__({}):'.format(', '.join(local_names.keys())),
+         '    def {}({}):'.format(name, ', '.join(args))]
+        + ['        {}'.format(line) for line in body]
+        + ['    return {}'.format(name)]
+    )
+    namespace = {}
+    exec(source, {}, namespace)
+    return namespace['__create_function__'](**local_names)
+
+
+def _generate_methods(cls, attr_names):
+    """Returns `__init__`, `__eq__`, `__hash__` and `__repr__` specialized for `attr_names` of `cls`.
+
+    Each method falls back to the generic one of StaticAttrObject if it is called for an instance of a subclass (e.g.
+    by `super()`), thus it works for the attributes of `type(self)` as the generic one does.
+    """
+    sorted_names = sorted(attr_names)
+    local_names = {
+        '__cls': cls,
+        '__names': attr_names,
+        '__base': StaticAttrObject,
+    }
+    methods = {}
+
+    # attributes are stored directly unless this class intercepts setting attributes itself
+    if cls.__setattr__ is StaticAttrObject.__setattr__:
+        methods['__init__'] = _create_function('__init__', ['self', '**kwargs'], [
+            'if self.__class__ is not __cls or not kwargs.keys() <= __names:',
+            '    __base.__init__(self, **kwargs)',
+            '    return',
+            'self.__dict__.update(kwargs)',
+        ], local_names)
+
+    comparisons = ' or '.join('self.{0} != other.{0}'.format(name) for name in sorted_names)
+    methods['__eq__'] = _create_function('__eq__', ['self', 'other'], [
+        'if self.__class__ is not __cls:',
+        '    return __base.__eq__(self, other)',
+        'if isinstance(other, __cls):',
+        '    return not ({})'.format(comparisons) if comparisons else '    return True',
+        'return NotImplemented',
+    ], local_names)
+
+    methods['__hash__'] = _create_function('__hash__', ['self'], [
+        'if self.__class__ is not __cls:',
+        '    return __base.__hash__(self)',
+        'return hash(({}))'.format(''.join('self.{}, '.format(name) for name in sorted_names)),
+    ], local_names)
+
+    # attributes are listed in the order of names as the generic one does, only if they are set to the instance
+    repr_body = [
+        'if self.__class__ is not __cls:',
+        '    return __base.__repr__(self)',
+        'd = self.__dict__',
+        'if not d.keys() <= __names:',
+        '    return __base.__repr__(self)',
+        'parts = []',
+    ]
+    for name in sorted_names:
+        repr_body += [
+            'if {!r} in d:'.format(name),
+            '    parts.append(f"{0}={{self.{0}}}")'.format(name),
+        ]
+    repr_body.append('return "{}(" + ", ".join(parts) + ")"'.format(cls.__name__))
+    methods['__repr__'] = _create_function('__repr__', ['self'], repr_body, local_names)
+
+    for method in methods.values():
+        method.__qualname__ = '{}.{}'.format(cls.__qualname__, method.__name__)
+        method.__static_attr_generated__ = True
+
+    return methods
+
+
+def _is_replaceable(name, method):
+    """Returns True if `method` is the generic method `name` of StaticAttrObject or a generated one."""
+    return method is StaticAttrObject.__dict__.get(name) or getattr(method, '__static_attr_generated__', False)
+
+
+def _update_static_attrs(cls):
+    """Compute attribute names of `cls`, and (re)generate its methods which would be resolved to the generic ones of
+    StaticAttrObject (or generated ones), i.e. neither declared in the class nor in its bases.
+    """
+    attr_names = _scan_attr_names(cls)
+    type.__setattr__(cls, '__static_attr_names__', attr_names)
+
+    # generated code refers to attributes as `self.name`, thus other names are left to the generic methods
+    if not all(name.isidentifier() and not keyword.iskeyword(name) for name in attr_names):
+        methods = {}
+    else:
+        methods = _generate_methods(cls, attr_names)
+
+    for name in _GENERATED_METHODS:
+        if name in cls.__dict__ and not getattr(cls.__dict__[name], '__static_attr_generated__', False):
+            continue  # declared in the class (`__hash__ = None` set implicitly with `__eq__` as well)
+        # the method which the class would inherit without a generated one
+        inherited = next(base.__dict__[name] for base in cls.__mro__[1:] if name in base.__dict__)
+        if name in methods and _is_replaceable(name, inherited):
+            type.__setattr__(cls, name, methods[name])
+        elif name in cls.__dict__:
+            type.__delattr__(cls, name)
+
+
+def _update_static_attrs_of_subclasses(cls):
+    """Update `cls` and its subclasses, since methods of `cls` are inherited by them."""
+    _update_static_attrs(cls)
+    for subclass in cls.__subclasses__():
+        _update_static_attrs_of_subclasses(subclass)
+
+
+class StaticAttrMeta(type):
+    """Metaclass of StaticAttrObject keeping the attribute names (and generated methods) in sync when class attributes
+    are added, replaced or deleted after the class is defined.
+
+    A custom metaclass of a subclass should derive from this.
+    """
+    def __setattr__(cls, key, value):
+        super().__setattr__(key, value)
+        if key in _GENERATED_METHODS:
+            _update_static_attrs_of_subclasses(cls)
+        elif not key.startswith('_'):
+            _update_static_attrs(cls)
+
+    def __delattr__(cls, key):
+        super().__delattr__(key)
+        if key in _GENERATED_METHODS:
+            _update_static_attrs_of_subclasses(cls)
+        elif not key.startswith('_'):
+            _update_static_attrs(cls)
+
+
+class StaticAttrObject(metaclass=StaticAttrMeta):
     """A class which works like struct.
 
     Intention of this class is to store only data (and not a class method) statically (with familiar interface as in C).
@@ -12,10 +171,18 @@ class StaticAttrObject:
             modules which requires __dict__ attribute
 
     Note: private class attributes (i.e. variable with `_` or `__` prefix) are not allowed.
-    
+
+    Attribute names are computed once when a subclass is defined (kept in `__static_attr_names__`), and `__init__`,
+    `__eq__`, `__hash__` and `__repr__` specialized for them are generated unless they are declared in the subclass
+    or in one of its bases (like dataclasses), such that creating and comparing objects does not scan the class.
+
     From python 3.7, dataclasses can be used instead of this:
         https://docs.python.org/3.7/library/dataclasses.html
     """
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _update_static_attrs(cls)
+
     def __repr__(self):
         return (
             "{}({})".format(
@@ -44,12 +211,6 @@ class StaticAttrObject:
             return self._are_variables_equal(other)
         return NotImplemented
 
-    def __ne__(self, other):
-        """Override default not equal"""
-        if isinstance(other, self.__class__):
-            return not self._are_variables_equal(other)
-        return NotImplemented
-
     def __hash__(self):
         """Override default hash
 
@@ -57,7 +218,7 @@ class StaticAttrObject:
         https://docs.python.org/3/reference/datamodel.html#object.__hash__
         """
         # use sort to create equal hash
-        attr_names = sorted(list(self._get_attr_names()))
+        attr_names = sorted(self._get_attr_names())
         return hash(tuple(getattr(self, cur_attr) for cur_attr in attr_names))
 
     @classmethod
@@ -67,26 +228,20 @@ class StaticAttrObject:
         class attributes
 
         Returns:
-            set[str]: names of attributes
+            frozenset[str]: names of attributes
         """
-        return set(
-            key
-            for key, value in cls.__dict__.items()
-            if (not key.startswith('_')     # This includes all variables start with `_` (i.e. `__double_underline`)
-                and not type(value) is classmethod
-                and not type(value) is staticmethod
-                and not type(value) is property
-                and (isclass(value) or not callable(value))      # To remove methods but not object attribute
-                )
-        )
+        return cls.__static_attr_names__
 
     def __setattr__(self, key, value):
         """Prevent dynamic addition of attributes
         """
-        if key not in self._get_attr_names():
+        if key not in self.__class__.__static_attr_names__:
             raise AttributeError("{} is not declared in {}".format(key, self.__class__.__name__))
         object.__setattr__(self, key, value)
 
     def __init__(self, **kwargs):
         for key, value in kwargs.items():
             setattr(self, key, value)
+
+
+StaticAttrObject.__static_attr_names__ = _scan_attr_names(StaticAttrObject)